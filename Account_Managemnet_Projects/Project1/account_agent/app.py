@@ -1,16 +1,24 @@
+import hmac
+import math
 import os
 import uuid
+import asyncio
+import json
+import threading
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from google.adk.agents import Agent
-from google.adk.runners import Runner
-from dotenv import load_dotenv
+from services.settings import load_env
 from google.genai import types
-from google.adk.sessions import InMemorySessionService
 from google.adk.events import Event, EventActions
-from .shared_libraries.callbacks import before_tool_callback
+from google.adk.sessions.base_session_service import GetSessionConfig
+from .shared_libraries.callbacks import authorize_tool, before_tool_callback
 import time
+from collections import ChainMap
+from types import SimpleNamespace
 from .config.Customer import Customer
+from services.session_store import get_session_service, close_session_service, register_state_type
 from .tools.tools import (
     create_account,
     update_contact,
@@ -22,46 +30,36 @@ from .tools.tools import (
 
 
 # Load .env variables
-load_dotenv()
+load_env()
+# Session state holds a Customer; let the session store persist it.
+register_state_type(Customer)
 
 # --- Config ---
 app_name = os.environ.get("APP_NAME", "Customer Support Agent")
-session_service = InMemorySessionService()
-
-# --- FastAPI setup ---
-app = FastAPI()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+LOG_STREAM_POLL_SECONDS = float(os.environ.get("LOG_STREAM_POLL_SECONDS", 0.5))
+FAST_PATH_ENABLED = os.environ.get("FAST_PATH_ENABLED", "true").lower() == "true"
+# Honour X-Forwarded-For only behind a proxy that sets it.
+RATE_LIMIT_TRUST_PROXY = os.environ.get("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+# Bearer token for admin endpoints (trace tiers, logs, metrics, stats); without one they only answer localhost.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+# Build the agent, calibrate the hasher and open the DB pool in the background once the app is serving.
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "true").lower() == "true"
+AGENT_MODEL = os.environ.get("AGENT_MODEL", "gemini-2.5-flash")
 
 # --- Imports from services ---
-from services.logger import setup_logger, get_logger
-from services.utils import call_agent_async, set_intent, get_instruction, call_custom_async, verify_otp, update_customer_account, reset_state
-
-
-instructions = get_instruction()
-# --- Root Agent with sub-agents ---
-root_agent = Agent(
-    name="account_agent",
-    model="gemini-2.5-flash",
-    global_instruction="Account Management BOT",
-    instruction=get_instruction(),
-    tools=[
-        create_account,
-        update_email,
-        update_password,
-        update_contact,
-        update_address,
-
-    ],
-    before_tool_callback=before_tool_callback,
-    output_key="conversation"
-)
+from services.logger import SESSION_ID_PATTERN, setup_logger, get_logger, configure_logging, log_stats, read_session_log
+from services.tracing import TIER_NAMES, TRACE_FULL, get_tracer, trace
+from services.utils import call_agent_async, stream_agent_async, set_intent, get_instruction, call_custom_async, verify_otp, update_customer_account
+from services.async_db_service import get_async_db
+from services.hashing import calibrate_hasher, close_hasher, get_hasher
+from services.mailer import close_outbox, get_outbox
+from services.metrics import RequestMetricsMiddleware, get_metrics
+from services.otp_manager import close_otp_manager, get_otp_manager
+from services.rate_limit import close_rate_limiter, get_rate_limiter
+from services.router import get_router
+from services.response_cache import get_response_cache, is_cacheable_message, mentions_customer
+from services.profile_cache import get_profile_cache
+
 
 def get_initial_state(user_id: str, session_id: str) -> dict:
     """Creates the initial state for a new session."""
@@ -70,20 +68,153 @@ def get_initial_state(user_id: str, session_id: str) -> dict:
         "pending_tool": None,
         "pending_args": None,
         "otp_status": None,
-        "generated_otp": None,
-        "otp_timestamp": None,
         "customer": customer,
     }
     
     return initial_state_dict
         
 
-# --- Runner setup ---
-runner = Runner(
-    agent=root_agent,
-    app_name=app_name,
-    session_service=session_service
+# --- Root agent and runner, built on first use ---
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    """Returns the Runner for the root agent, building both on first use."""
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                # ADK's agent and runner modules are only needed once the app serves.
+                from google.adk.agents import Agent
+                from google.adk.runners import Runner
+
+                root_agent = Agent(
+                    name="account_agent",
+                    model=AGENT_MODEL,
+                    global_instruction="Account Management BOT",
+                    instruction=get_instruction(),
+                    tools=[
+                        create_account,
+                        update_email,
+                        update_password,
+                        update_contact,
+                        update_address,
+
+                    ],
+                    before_tool_callback=before_tool_callback,
+                    output_key="conversation"
+                )
+                _runner = Runner(
+                    agent=root_agent,
+                    app_name=app_name,
+                    session_service=get_session_service()
+                )
+    return _runner
+
+
+# --- Startup warm-up: runs after the app is ready, so a slow DB cannot block start-up ---
+async def warm_up():
+    logger = get_logger()
+    started = time.perf_counter()
+    # Building the agent imports most of ADK, and calibrating the bcrypt cost
+    # takes a few hashes; keep both off the event loop.
+    await asyncio.to_thread(get_runner)
+    await asyncio.to_thread(calibrate_hasher)
+    try:
+        await get_async_db().connect()
+    except Exception as e:
+        logger.warning(f"Database not reachable during warm-up, the pool opens on first use: {e}")
+    logger.info(f"Warm-up finished in {(time.perf_counter() - started) * 1000:.0f} ms.")
+
+
+# --- Lifespan: build dependencies at startup, release them at shutdown ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Handlers are configured once; setup_logger only selects the session file.
+    configure_logging()
+    warm_up_task = asyncio.create_task(warm_up()) if STARTUP_WARMUP else None
+    yield
+    # Flush sessions, release the async DB pool, hashing workers, SMTP outbox, OTP and rate limit stores.
+    if warm_up_task is not None and not warm_up_task.done():
+        warm_up_task.cancel()
+    await close_session_service()
+    await get_async_db().close()
+    close_hasher()
+    close_outbox()
+    close_otp_manager()
+    close_rate_limiter()
+
+
+# --- FastAPI setup ---
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
 )
+app.add_middleware(RequestMetricsMiddleware)
+
+# --- Metrics: gauges and component stats, read only when /metrics is scraped ---
+metrics = get_metrics()
+metrics.gauge("active_sessions", "Sessions resident in memory (used within SESSION_IDLE_TTL).",
+              lambda: get_session_service().stats()["cache"]["resident"])
+metrics.gauge("pending_otps", "OTP challenges waiting for verification in the OTP store.",
+              lambda: get_otp_manager().store.count())
+metrics.add_stats("sessions", lambda: get_session_service().stats())
+metrics.add_stats("db_pool", lambda: get_async_db().pool_stats())
+metrics.add_stats("profile_cache", lambda: get_profile_cache().stats())
+metrics.add_stats("hasher", lambda: get_hasher().stats())
+metrics.add_stats("outbox", lambda: get_outbox().stats())
+metrics.add_stats("otp", lambda: get_otp_manager().stats())
+metrics.add_stats("rate_limit", lambda: get_rate_limiter().stats())
+metrics.add_stats("router", lambda: get_router().stats())
+metrics.add_stats("response_cache", lambda: get_response_cache().stats())
+metrics.add_stats("logs", log_stats)
+
+# --- Helper: Reply for the turn, falling back to the agent's saved output ---
+async def final_response(user_id, session_id, response):
+    if response:
+        return response
+    state = await get_session_service().get_state(app_name=app_name, user_id=user_id, session_id=session_id)
+    return state.get("conversation", "Sorry, I didn't understand that.")
+
+# --- Helper: Per-client admission control ---
+def client_ip(request: Request):
+    forwarded = request.headers.get("x-forwarded-for") if RATE_LIMIT_TRUST_PROXY else None
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else None
+
+
+async def enforce_rate_limit(request: Request, name, user_id=None):
+    """Raises 429 with Retry-After when the client IP's or user's ``name`` bucket is empty."""
+    retry_after = await get_rate_limiter().acquire(name, f"ip:{client_ip(request)}", f"user:{user_id}")
+    if retry_after:
+        get_logger().warning(f"Rate limited {name} for user {user_id} from {client_ip(request)}")
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests. Please slow down.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+def require_admin(request: Request):
+    """
+    Raises 403 unless the request carries ``Authorization: Bearer <ADMIN_TOKEN>``
+    or, when no token is configured, comes straight from localhost.
+    """
+    if ADMIN_TOKEN:
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            return
+    # The socket peer, not X-Forwarded-For: a proxy in front would make every client local.
+    elif request.client and request.client.host in ("127.0.0.1", "::1"):
+        return
+    get_logger().warning(f"Rejected admin request {request.method} {request.url.path} from {client_ip(request)}")
+    raise HTTPException(status_code=403, detail="Forbidden")
 
 # --- Helper: Generate new session IDs ---
 def generate_session_id():
@@ -94,11 +225,12 @@ def generate_session_id():
 async def create_session_endpoint(request: Request):
     data = await request.json()
     user_id = data.get("user_id", "1234")
+    await enforce_rate_limit(request, "session", user_id)
     session_id = generate_session_id()
     
     state = get_initial_state(user_id, session_id)
 
-    session = await session_service.create_session(
+    session = await get_session_service().create_session(
         app_name=app_name, user_id=user_id, state=state, session_id=session_id
     )
    
@@ -106,118 +238,393 @@ async def create_session_endpoint(request: Request):
     logger = get_logger()
     logger.info(f"create_session_endpoint: Session Id: {session_id}")
     logger.info(f"create_session_endpoint: Session created for user: {user_id}")
-    logger.info(f"create_session_endpoint: Created Session for user: {vars(session)}")
+    trace(TRACE_FULL, "create_session_endpoint: Created Session for user: {}".format, vars(session))
     return {"session_id": session_id, "initial_message": state.get("conversation")}
 
 
-@app.post("/chat")
-async def chat_with_agent(request: Request):
+# --- Endpoint: Switch trace verbosity for one session ---
+@app.post("/trace/{session_id}")
+async def set_trace_tier(session_id: str, request: Request):
+    require_admin(request)
+    data = await request.json()
+    tier = data.get("tier", "full")
+    if tier not in TIER_NAMES:
+        raise HTTPException(status_code=400, detail=f"Unknown trace tier: {tier}")
+    get_tracer().set_session_tier(session_id, TIER_NAMES[tier])
+    return {"session_id": session_id, "tier": tier}
+
+
+@app.delete("/trace/{session_id}")
+async def clear_trace_tier(session_id: str, request: Request):
+    require_admin(request)
+    get_tracer().clear_session_tier(session_id)
+    return {"session_id": session_id, "tier": None}
+
+
+# --- Endpoint: Log file handles and disk usage, for alerting ---
+@app.get("/logs/stats")
+async def get_log_stats(request: Request):
+    require_admin(request)
+    return log_stats()
+
+
+# --- Endpoint: Resident sessions, cache evictions and write-behind counters ---
+@app.get("/sessions/stats")
+async def get_session_stats(request: Request):
+    require_admin(request)
+    return get_session_service().stats()
+
+
+# --- Endpoint: Fast-path share of chat turns and latency per path ---
+@app.get("/router/stats")
+async def get_router_stats(request: Request):
+    require_admin(request)
+    return get_router().stats()
+
+
+# --- Endpoint: Requests allowed and rate limited per limit ---
+@app.get("/ratelimit/stats")
+async def get_rate_limit_stats(request: Request):
+    require_admin(request)
+    return get_rate_limiter().stats()
+
+
+# --- Endpoint: OTP challenges issued, verified, locked and swept ---
+@app.get("/otp/stats")
+async def get_otp_stats(request: Request):
+    require_admin(request)
+    return get_otp_manager().stats()
+
+
+# --- Endpoint: Response cache hit rate and LLM time saved ---
+@app.get("/cache/stats")
+async def get_response_cache_stats(request: Request):
+    require_admin(request)
+    return get_response_cache().stats()
+
+
+# --- Endpoint: Prometheus metrics: latency histograms, counters and component stats ---
+@app.get("/metrics")
+async def get_prometheus_metrics(request: Request):
+    require_admin(request)
+    # Gauges may query the OTP store; render off the event loop.
+    body = await asyncio.to_thread(get_metrics().render)
+    return Response(body, media_type="text/plain; version=0.0.4")
+
+
+# --- Endpoint: Session log lines after a byte offset ---
+@app.get("/logs/{session_id}")
+async def tail_session_log(session_id: str, request: Request, offset: int = 0, file_id: str = None, limit: int = 64 * 1024):
+    # Session logs include raw chat text, credentials among it.
+    require_admin(request)
     try:
-        data = await request.json()
-        user_id = data.get("user_id", "1234")
-        session_id = data.get("session_id")
-        message = data.get("message")
+        result = await asyncio.to_thread(read_session_log, session_id, max(offset, 0), file_id, min(limit, 1024 * 1024))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Log file not found for this session.")
+    return result
 
-        if not message:
-            raise HTTPException(status_code=400, detail="No message provided")
 
-        # --- Load or Create Session ---
-        if not session_id:
-            session_id = generate_session_id()
+# --- Endpoint: Push new session log lines as server-sent events ---
+@app.get("/logs/{session_id}/stream")
+async def stream_session_log(session_id: str, request: Request, offset: int = 0, file_id: str = None):
+    require_admin(request)
+    if not SESSION_ID_PATTERN.match(session_id):
+        raise HTTPException(status_code=400, detail=f"Invalid session id: {session_id!r}")
+    # Reconnecting EventSource clients resume from the last "offset:file_id" they saw.
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and ":" in last_event_id:
+        last_offset, last_file_id = last_event_id.split(":", 1)
+        try:
+            offset, file_id = int(last_offset), last_file_id
+        except ValueError:
+            # Malformed id: replay the current log from the start.
+            offset, file_id = 0, None
 
-        session = await session_service.get_session(
-            app_name=app_name, user_id=user_id, session_id=session_id
-        )
-        if not session:
-            # Session not found: create it
-            state = get_initial_state(user_id, session_id)
-            session = await session_service.create_session(
-                app_name=app_name, user_id=user_id, state=state, session_id=session_id
-            )
+    async def events():
+        position, current_id, idle = max(offset, 0), file_id, 0.0
+        while not await request.is_disconnected():
+            result = await asyncio.to_thread(read_session_log, session_id, position, current_id)
+            if result and result["lines"]:
+                position, current_id, idle = result["offset"], result["file_id"], 0.0
+                payload = json.dumps({"lines": result["lines"], "reset": result["reset"]})
+                yield f"id: {position}:{current_id}\ndata: {payload}\n\n"
+                continue
+            if result:
+                position, current_id = result["offset"], result["file_id"]
+            await asyncio.sleep(LOG_STREAM_POLL_SECONDS)
+            idle += LOG_STREAM_POLL_SECONDS
+            if idle >= 15:
+                # Comment line keeps proxies from closing a quiet stream.
+                idle = 0.0
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+# --- Helper: Run a tool call extracted by the router without the agent ---
+async def fast_path_turn(user_id, session_id, message, route):
+    """
+    Authenticates and starts OTP for ``route`` the way before_tool_callback
+    does for the agent (create_account runs directly), then records the
+    message and reply in the session history. Returns the reply text.
+    """
+    session = await get_session_service().get_session(
+        app_name=app_name, user_id=user_id, session_id=session_id,
+        config=GetSessionConfig(num_recent_events=0),
+    )
+    # Writes land in the first map and are persisted as one state delta.
+    state = ChainMap({}, session.state)
+    args = dict(route.args)
+    if route.tool == "create_account":
+        reply = await create_account(SimpleNamespace(state=state), **args)
+    else:
+        result = await authorize_tool(route.tool, args, state)
+        if isinstance(result, dict):
+            reply = result.get("message") or result.get("error")
         else:
-            state = session.state
+            reply = result or "Sorry, I couldn't process that request."
+    state["conversation"] = reply
+    await append_turn(session, "fast-path", message, reply, dict(state.maps[0]))
+    return reply
 
-        # --- Setup Logging ---
-        setup_logger(session_id)
-        logger = get_logger()
-        logger.info(f"[CHAT] User requested ({user_id}) says: {message}")
 
-        
-        otp_status = state.get("otp_status", None)
-        logger.info(f"Current OTP  STATUS for {user_id} {otp_status}")
-              
-        # 2-Factor Verification
-        if otp_status is not None:
-            if state["otp_status"] == "OTP_PENDING":
-                logger.info(f"OTP_PENDING for with tool name {state['pending_tool']} and arguments = {state['pending_args']}")
-                tool_name = state["pending_tool"]
-                logger.info(f"Verifying OTP for with tool name {state['pending_tool']} and arguments = {state['pending_args']}")
-                result = verify_otp(state, message, tool_name)
-                logger.info(f"verify_otp Result :   {result}")
-                status = result["status"]
-                session.state["otp_status"] = status
-                if state["otp_status"] == "OPT_VERIFIED_SUCCESS":
-                    #state["otp_status"] = None
-                    logger.info(f"OPT_VERIFIED_SUCCESS for with tool name {state['pending_tool']} and arguments = {state['pending_args']}")
-                    pending_args = state["pending_args"]
-                    result = update_customer_account(state)
-                    logger.info(f"update_customer_account - state = {state}")
-                    session.state = reset_state(state)
-                    logger.info(f"reset_state - session_service.state = {session.state}")
-                    message = "OTP Verification is Successful and so is the update Update Successful. Would you like to continue?" + get_instruction()
-                    session.state["conversation"] = {}
-                    session.state["conversation"] = message
-                else:
-                    message = "OTP Verification Failed. Would you like to continue?" + get_instruction()
-                    session_service.state = reset_state(state)
-                    session.state["conversation"] = {}
-                    session.state["conversation"] = message
-                
-                    
-                # Step 1: Clear OTP state
-                cleared_delta = {
-                    "pending_tool": None,
-                    "pending_args": None,
-                    "otp_status": None,
-                    "generated_otp": None,
-                    "otp_timestamp": None
-                }
-
-                # Step 2: Reset conversation
-                #system_message = get_instruction()
-                await session_service.append_event(
+# --- Helper: Record a turn answered without the runner ---
+async def append_turn(session, source, message, reply, state_delta=None):
+    """Appends the user message and reply to the session as the runner would."""
+    invocation_id = f"{source}-{uuid.uuid4().hex}"
+    delta = dict(state_delta or {})
+    delta["conversation"] = reply
+    await get_session_service().append_event(
+        session,
+        Event(invocation_id=invocation_id, author="user", timestamp=time.time(),
+              content=types.Content(role="user", parts=[types.Part(text=message)])),
+    )
+    await get_session_service().append_event(
+        session,
+        Event(invocation_id=invocation_id, author="account_agent", timestamp=time.time(),
+              actions=EventActions(state_delta=delta),
+              content=types.Content(role="model", parts=[types.Part(text=reply)])),
+    )
+
+
+# --- Helper: Agent run, answered from the response cache when possible ---
+async def agent_turn(user_id, session_id, message, streaming, stage, previous_reply, customer):
+    """
+    Yields what stream_agent_async yields for ``message``. Turns at a
+    stage and context seen before are answered from the response cache;
+    replies that called a tool or mention the customer are never stored.
+    """
+    cache = get_response_cache()
+    key = None
+    if cache.enabled:
+        if stage != "chat" or is_cacheable_message(message):
+            key = cache.key(stage, previous_reply, message)
+        else:
+            cache.bypass()
+    if key is not None:
+        reply = cache.get(key)
+        if reply is not None:
+            session = await get_session_service().get_session(
+                app_name=app_name, user_id=user_id, session_id=session_id,
+                config=GetSessionConfig(num_recent_events=0),
+            )
+            await append_turn(session, "response-cache", message, reply)
+            yield {"type": "final", "text": reply}
+            return
+
+    started = time.perf_counter()
+    used_tool = False
+    async for item in stream_agent_async(get_runner(), user_id, session_id, message, streaming):
+        if item["type"] == "tool_start":
+            used_tool = True
+        elif item["type"] == "final" and key is not None and item["text"] and not used_tool \
+                and not mentions_customer(item["text"], customer):
+            cache.put(key, item["text"], time.perf_counter() - started)
+        yield item
+
+
+# --- Helper: One chat turn as a stream of events ---
+async def chat_turn(user_id, session_id, message, streaming=False):
+    """
+    Handles one user message (OTP verification or an agent run) and yields
+    partial text and tool markers from the agent as it runs, then
+    {"type": "final", "response": ...}. /chat only keeps the final event;
+    /chat/stream forwards all of them.
+    """
+    started = time.perf_counter()
+    # Read-only view; the full session is only fetched when state must change.
+    state = await get_session_service().get_state(
+        app_name=app_name, user_id=user_id, session_id=session_id
+    )
+    if state is None:
+        # Session not found: create it
+        state = get_initial_state(user_id, session_id)
+        await get_session_service().create_session(
+            app_name=app_name, user_id=user_id, state=state, session_id=session_id
+        )
+
+    # --- Setup Logging ---
+    setup_logger(session_id)
+    logger = get_logger()
+    logger.info(f"[CHAT] User requested ({user_id}) says: {message}")
+
+
+    otp_status = state.get("otp_status", None)
+    logger.info(f"Current OTP  STATUS for {user_id} {otp_status}")
+
+    # 2-Factor Verification
+    if otp_status is not None:
+        if state["otp_status"] == "OTP_PENDING":
+            # Events are not needed here, so skip copying the history.
+            session = await get_session_service().get_session(
+                app_name=app_name, user_id=user_id, session_id=session_id,
+                config=GetSessionConfig(num_recent_events=0),
+            )
+            # Working copy: every change reaches the session through the
+            # event's state_delta, so the session store persists it.
+            state = dict(session.state)
+            logger.info(f"OTP_PENDING for with tool name {state['pending_tool']} and arguments = {state['pending_args']}")
+            tool_name = state["pending_tool"]
+            logger.info(f"Verifying OTP for with tool name {state['pending_tool']} and arguments = {state['pending_args']}")
+            result = await verify_otp(state, message, tool_name)
+            logger.info(f"verify_otp Result :   {result}")
+            status = result["status"]
+            if status == "OTP_PENDING":
+                # Wrong code with attempts left: keep the challenge and ask again.
+                await get_session_service().append_event(
                     session,
                     Event(
-                        invocation_id="manual-reset",
+                        invocation_id="otp-retry",
                         author="account_agent",
                         timestamp=time.time(),
-                        actions=EventActions(state_delta=cleared_delta),
-                        content=types.Content(parts=[types.Part(text=message)])
+                        actions=EventActions(state_delta={"conversation": result["message"]}),
+                        content=types.Content(parts=[types.Part(text=result["message"])])
                     )
                 )
-                session.state = get_initial_state(user_id, session_id)
-                await call_agent_async(runner, user_id, session_id, message)
-                logger.info(f"[CALL_AGENT] OPT_VERIFIED_SUCCESS Completed for session_id: {session_id}")
-                    # Reload updated session state
-                updated_session = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
-                last_response = updated_session.state.get("conversation", "Sorry, I didn't understand that.")
-
-                return {"session_id": session_id, "response": last_response}
-        else:
-            # --- Normal Chat Processing ---
-            logger.info(f"Working on {message} for session_id: {session_id}")
-            await call_agent_async(runner, user_id, session_id, message)
-            logger.info(f"[CALL_AGENT] Completed for session_id: {session_id}")
-       
+                get_router().record("otp", time.perf_counter() - started)
+                yield {"type": "final", "session_id": session_id, "response": result["message"]}
+                return
+            # Clear the OTP state and record the reply in one event.
+            delta = {
+                "pending_tool": None,
+                "pending_args": None,
+                "otp_status": None
+            }
+            if status == "OPT_VERIFIED_SUCCESS":
+                logger.info(f"OPT_VERIFIED_SUCCESS for with tool name {state['pending_tool']} and arguments = {state['pending_args']}")
+                result = await update_customer_account(state)
+                trace(TRACE_FULL, "update_customer_account - state = {}".format, state)
+                delta["customer"] = state["customer"]
+                message = "OTP Verification is Successful and so is the update Update Successful. Would you like to continue?" + get_instruction()
+            else:
+                message = f"OTP Verification Failed. {result['message']} Would you like to continue?" + get_instruction()
+            delta["conversation"] = message
+
+            await get_session_service().append_event(
+                session,
+                Event(
+                    invocation_id="manual-reset",
+                    author="account_agent",
+                    timestamp=time.time(),
+                    actions=EventActions(state_delta=delta),
+                    content=types.Content(parts=[types.Part(text=message)])
+                )
+            )
+            response = None
+            stage = "otp_verified" if status == "OPT_VERIFIED_SUCCESS" else "otp_failed"
+            async for item in agent_turn(user_id, session_id, message, streaming, stage, None, state.get("customer")):
+                if item["type"] == "final":
+                    response = item["text"]
+                else:
+                    yield item
+            logger.info(f"[CALL_AGENT] OPT_VERIFIED_SUCCESS Completed for session_id: {session_id}")
+            last_response = await final_response(user_id, session_id, response)
+            get_router().record("otp", time.perf_counter() - started)
+
+            yield {"type": "final", "session_id": session_id, "response": last_response}
+        return
+
+    # --- Fast path: the message names a tool and all of its arguments ---
+    route = get_router().route(message) if FAST_PATH_ENABLED else None
+    if route is not None:
+        logger.info(f"[FAST_PATH] Routing to {route.tool} for session_id: {session_id}")
+        yield {"type": "tool_start", "tool": route.tool}
+        reply = await fast_path_turn(user_id, session_id, message, route)
+        yield {"type": "tool_end", "tool": route.tool}
+        get_router().record("fast", time.perf_counter() - started)
+        yield {"type": "final", "session_id": session_id, "response": reply}
+    else:
+        # --- Normal Chat Processing ---
+        logger.info(f"Working on {message} for session_id: {session_id}")
+        response = None
+        async for item in agent_turn(user_id, session_id, message, streaming, "chat",
+                                     state.get("conversation"), state.get("customer")):
+            if item["type"] == "final":
+                response = item["text"]
+            else:
+                yield item
+        logger.info(f"[CALL_AGENT] Completed for session_id: {session_id}")
+        last_response = await final_response(user_id, session_id, response)
+        get_router().record("agent", time.perf_counter() - started)
+
+        yield {"type": "final", "session_id": session_id, "response": last_response}
+
+
+@app.post("/chat")
+async def chat_with_agent(request: Request):
+    try:
+        data = await request.json()
+        user_id = data.get("user_id", "1234")
+        session_id = data.get("session_id")
+        message = data.get("message")
+
+        if not message:
+            raise HTTPException(status_code=400, detail="No message provided")
+        await enforce_rate_limit(request, "chat", user_id)
 
-            # Reload updated session state
-            updated_session = await session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
-            last_response = updated_session.state.get("conversation", "Sorry, I didn't understand that.")
+        # --- Load or Create Session ---
+        if not session_id:
+            session_id = generate_session_id()
 
-            return {"session_id": session_id, "response": last_response}
+        async for item in chat_turn(user_id, session_id, message):
+            if item["type"] == "final":
+                return {"session_id": session_id, "response": item["response"]}
         #---------------------------------
         
+    except HTTPException:
+        raise
     except Exception as e:
         msg = f"ERROR in chat_with_agent: {e}"
-        logger.error(msg)
+        get_logger().error(msg)
+
+
+# --- Endpoint: Chat turn streamed as server-sent events ---
+@app.post("/chat/stream")
+async def stream_chat_with_agent(request: Request):
+    data = await request.json()
+    user_id = data.get("user_id", "1234")
+    session_id = data.get("session_id") or generate_session_id()
+    message = data.get("message")
+    if not message:
+        raise HTTPException(status_code=400, detail="No message provided")
+    await enforce_rate_limit(request, "chat", user_id)
+
+    async def events():
+        try:
+            async for item in chat_turn(user_id, session_id, message, streaming=True):
+                yield f"event: {item['type']}\ndata: {json.dumps(item)}\n\n"
+        except Exception as e:
+            # Details stay in the log; the client only learns that the turn failed.
+            get_logger().error(f"ERROR in stream_chat_with_agent: {e}", exc_info=True)
+            error = {"type": "error", "message": "Something went wrong while processing your message. Please try again."}
+            yield f"event: error\ndata: {json.dumps(error)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Disable proxy buffering so the first tokens are not held back.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
@@ -19,7 +19,6 @@ class Customer:
         obj = cls(
             user_id=data.get("user_id"),
             session_id=data.get("session_id"),
-            session_service=None,
             app_name=data.get("app_name", "Customer Support Agent")
         )
         obj.session_state = data.get("session_state", {})
@@ -34,6 +33,9 @@ class Customer:
 
     def to_dict(self):
         return {
+            "user_id": self.user_id,
+            "session_id": self.session_id,
+            "app_name": self.app_name,
             "username": self.username,
             "password": self.password,
             "first_name": self.first_name,
@@ -2,19 +2,23 @@ from google.adk.tools.base_tool import BaseTool
 from google.adk.tools.tool_context import ToolContext
 from google.adk.agents.callback_context import CallbackContext
 from typing import Optional, Dict, Any
-import random
-import time
+import asyncio
 import re
 from services.logger import get_logger
-from services.utils import send_otp, update_customer_data
-from services.db_service import DBService
+from services.tracing import TRACE_FULL, trace
+import math
+import time
+from services.metrics import TOOL_CALLBACK_REJECTIONS, TOOL_CALLBACK_SECONDS
+from services.otp_manager import get_otp_manager
+from services.rate_limit import get_rate_limiter
+from services.utils import otp_challenge_id, send_otp, update_customer_data
+from services.async_db_service import get_async_db
 from google.genai import types
 
-db = DBService()
 logger = get_logger()
 
       
-def before_tool_callback(tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext) -> Optional[Dict[str, str]]:
+async def before_tool_callback(tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext) -> Optional[Dict[str, str]]:
     """
     A callback function executed before a tool is called.
 
@@ -22,8 +26,9 @@ def before_tool_callback(tool: BaseTool, args: Dict[str, Any], tool_context: Too
     the following steps:
     1.  Checks if the tool requires authentication (skips for 'create_account').
     2.  Validates that 'username' and 'password' are present in the tool arguments.
-    3.  Verifies the user's credentials against the database.
-    4.  If authentication is successful, it fetches the user's full details.
+    3.  Verifies the user's credentials and fetches the user's full details
+        in one database lookup.
+    4.  Rejects the call if authentication fails.
     5.  Populates the 'customer' object in the session state with the user's data.
     6.  Handles any exceptions during the process to prevent crashes.
 
@@ -39,11 +44,24 @@ def before_tool_callback(tool: BaseTool, args: Dict[str, Any], tool_context: Too
                         sends the error message back to the agent.
     """
     logger.info(f"before_tool: Executing for tool '{tool.name}'")
-    logger.info(f"before_tool:   args  {args}  and tool_context {vars(tool_context)}")
+    trace(TRACE_FULL, "before_tool:   args  {}  and tool_context {}".format, args, vars(tool_context))
+    start = time.perf_counter()
+    result = await authorize_tool(tool.name, args, tool_context.state)
+    TOOL_CALLBACK_SECONDS.observe(time.perf_counter() - start, tool.name)
+    if isinstance(result, dict) and "error" in result:
+        TOOL_CALLBACK_REJECTIONS.inc(tool.name)
+    return result
 
-    # Tools that do not require authentication can be skipped here.
-    tool_name = tool.name
-    
+
+async def authorize_tool(tool_name: str, args: Dict[str, Any], state) -> Optional[Dict[str, str]]:
+    """
+    Authenticates a tool call and starts OTP verification for it.
+
+    ``state`` is any mutable mapping of session state: the tool context's
+    state when called from before_tool_callback, or a plain mapping when the
+    fast-path router handles the call without the agent. Returns the same
+    values as before_tool_callback.
+    """
     # Creation of user doesnot need 2 factor verification
     if tool_name == "create_account":
         logger.info("Skipping authentication for 'create_account' tool.")
@@ -52,12 +70,10 @@ def before_tool_callback(tool: BaseTool, args: Dict[str, Any], tool_context: Too
     username = args.get("username")
     password = args.get("password")
     user_otp = args.get("user_otp_input", None)
-    state = tool_context.state
     state["pending_tool"] = tool_name
     state["pending_args"] = args
  
     if user_otp is not None:
-        state = tool_context.state
         if state["otp_status"] == "OPT_VERIFIED_SUCCESS":
             return None
 
@@ -69,30 +85,37 @@ def before_tool_callback(tool: BaseTool, args: Dict[str, Any], tool_context: Too
             return {"error": "Authentication failed. Please provide both username and password to proceed."}
 
         # --- First Level of Verification (Credentials) ---
+        # A single lookup both verifies the password and loads the profile.
+        # A failure is reserved before checking, so concurrent guesses cannot
+        # all pass; it is handed back unless the password turns out wrong.
+        limiter = get_rate_limiter()
+        retry_after = await limiter.acquire("password_failure", username)
+        if retry_after:
+            logger.warning(f"Too many failed sign-ins for user: {username}")
+            return {"error": f"Too many failed sign-in attempts. Please try again in {math.ceil(retry_after)} seconds."}
         logger.info(f"Attempting to verify credentials for user: {username}")
-        if not db.verify_user(username, password):
+        try:
+            user_details = await get_async_db().authenticate(username, password, raise_errors=True)
+        except Exception:
+            await limiter.refund("password_failure", username)
+            return {"error": "Sign-in is temporarily unavailable. Please try again shortly."}
+        if not user_details:
             logger.warning(f"Invalid credentials for user: {username}")
             return {"error": "Authentication failed. Invalid username or password."}
+        await limiter.refund("password_failure", username)
         
         logger.info(f"User '{username}' authenticated successfully via password.")
 
         # --- Populate Customer Data in Session State ---
-        customer = tool_context.state.get("customer")
+        customer = state.get("customer")
         if not customer:
-             logger.error("Critical: Customer object not found in tool_context state during authentication.")
+             logger.error("Critical: Customer object not found in session state during authentication.")
              return {"error": "A critical session error occurred. Please try starting a new conversation."}
-        
-        
-        user_details = db.get_user_details(username)
-        
-        if not user_details:
-            logger.error(f"Could not retrieve details for authenticated user: {username}")
-            return {"error": "Internal error: Failed to load your user profile after login."}
 
         customer = update_customer_data(user_details, customer)
 
         # Update the session state with the fully populated customer object
-        tool_context.state["customer"] = customer
+        state["customer"] = customer
         logger.info(f"Customer data for '{username}' has been loaded into the session.")
         
 
@@ -106,11 +129,13 @@ def before_tool_callback(tool: BaseTool, args: Dict[str, Any], tool_context: Too
         return {"error": "An unexpected internal error occurred during the authentication process."}
     # Level 2 verification
     try:
-        status = initiating_otp_send(tool_context, args)
+        status = await initiating_otp_send(state, args)
         if status is None:
             msg = f"Unable to send OTP for user {username}"
             logger.info(msg)
             return msg
+        if "error" in status:
+            return status
         return {
             "message": status["message"]}
        
@@ -122,11 +147,8 @@ def before_tool_callback(tool: BaseTool, args: Dict[str, Any], tool_context: Too
         # Return a generic error to the user
         return {"error": "An unexpected internal error occurred during the authentication process."}
 
-def initiating_otp_send(tool_context, args):
-    import time
-    import random
-
-    customer = tool_context.state.get("customer")
+async def initiating_otp_send(state, args):
+    customer = state.get("customer")
 
     user_email = customer.email
 
@@ -134,86 +156,20 @@ def initiating_otp_send(tool_context, args):
     if not user_email:
         return {"error": "No email is associated with this account."}
 
-    expected_otp = tool_context.state.get("generated_otp")
-    otp_timestamp = tool_context.state.get("otp_timestamp")
+    if state.get("otp_status") != "OTP_PENDING":
+        retry_after = await get_rate_limiter().acquire("otp_send", customer.username)
+        if retry_after:
+            logger.warning(f"OTP send budget exhausted for user: {customer.username}")
+            return {"error": f"Too many OTP requests. Please try again in {math.ceil(retry_after)} seconds."}
+        # Generate and send; the manager keeps only a hash of the code.
+        otp = await asyncio.to_thread(get_otp_manager().issue, otp_challenge_id(customer), customer.username)
 
-    if not expected_otp or not otp_timestamp:
-        # Generate and send
-        otp = str(random.randint(100000, 999999))
-
-        tool_context.state["generated_otp"] = otp
-        tool_context.state["otp_timestamp"] = time.time()
-        tool_context.state["otp_status"] = "OTP_PENDING"
+        state["otp_status"] = "OTP_PENDING"
         send_otp(user_email, otp)
-        logger.info(f"Sent OTP to {user_email}: {otp}")
+        logger.info(f"Sent OTP to {user_email}")
         return {
             #"status": "OTP_SENT",
             "message": f"An OTP was sent to {user_email}. Please enter it to continue."
         }
         
     return None
-
-
-from datetime import datetime, timedelta
-import os
-
-def verify_otp(state, username, user_otp_input, tool_name, args):
-    """
-    Verifies the OTP for a given username using session state.
-    Returns a structured response indicating next action.
-    """
-    logger.info(f"verify_otp for {username} ")
-    otp_expiry_minutes = int(os.getenv("OTP_EXPIRY_MINUTES", 5))
-
-    if not username:
-        return {
-            "status": "AUTH_REQUIRED",
-            "message": "Username is required for OTP verification."
-        }
-
-    otp_info = state.get(username)
-    logger.info(f"verify_otp : otp_info {otp_info}")
-    if not otp_info:
-        return {
-            "status": "AUTH_REQUIRED",
-            "message": "No OTP challenge found. Please start authentication again."
-        }
-
-    # Check OTP expiration
-    timestamp = otp_info.get("timestamp")
-    if not timestamp or datetime.now() > timestamp + timedelta(minutes=otp_expiry_minutes):
-        logger.info(f"OTP for {username} expired.")
-        state.pop(username, None)
-        return {
-            "status": "AUTH_REQUIRED",
-            "message": "Your OTP has expired. Please start authentication again."
-        }
-
-    # Check user input
-    
-
-    if user_otp_input != otp_info.get("otp"):
-        return {
-            "status": "OTP_PENDING",
-            "message": "Invalid OTP. Please try again."
-        }
-
-    # OTP verified successfully
-    state["otp_status"] = "OPT_VERIFIED_SUCCESS"
-    logger.info(f"OTP for {username} verified successfully.")
-    state.pop(username, None)
-
-    # Merge any original_args if saved
-    original_args = otp_info.get("original_args", {})
-    if original_args:
-        logger.debug(f"Merging original_args into current args: {original_args}")
-        args.update(original_args)
-
-    return {
-        "status": "OPT_VERIFIED_SUCCESS",
-        "message": f"OTP verified. Proceeding with {tool_name}.",
-        "args": args
-    }
-
-    
- 
@@ -1,15 +1,15 @@
 
 import json
 from services.logger import get_logger
-from services.db_service import DBService
+from services.tracing import TRACE_FULL, trace_enabled
+from services.async_db_service import get_async_db
 from google.adk.tools.tool_context import ToolContext
 
 # Initialize services
-db = DBService()
 logger = get_logger()
 
 
-def create_account(
+async def create_account(
         tool_context: ToolContext,
         username: str,
         password: str,
@@ -40,7 +40,7 @@ def create_account(
     """
     try:
         logger.info(f"Attempting to create account for username: {username}")
-        db.create_user(
+        await get_async_db().create_user(
             username=username, password=password, first_name=first_name, last_name=last_name, email=email, phone_number=phone_number, address=address
         )
         logger.info(f"Successfully created account for {username}.")
@@ -235,6 +235,10 @@ def inspect_session(tool_context: ToolContext) -> str:
     Returns:
         A string confirming that the session details have been logged.
     """
+    # Serializing the whole state and event history is only worth it when
+    # full tracing is on for this session.
+    if not trace_enabled(TRACE_FULL):
+        return "Session inspection is disabled at the current trace tier."
     session = tool_context.session
     logger.info("--- Inspecting Session ---")
     logger.info(f"Session ID: {session.id}, App: {session.app_name}, User: {session.user_id}")
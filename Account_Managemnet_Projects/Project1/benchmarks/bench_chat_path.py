@@ -0,0 +1,103 @@
+"""
+Per-turn cost of the /chat session handling as a session's history grows.
+
+    python -m benchmarks.bench_chat_path --history 0 100 1000 --turns 50
+
+Each turn simulates what /chat does around the agent: the runner's own
+get_session and two append_event calls, plus the endpoint's reads.
+"reload" is the old endpoint (get_session before the run and again
+after it to read state["conversation"]); "direct" reads a read-only
+state view up front and takes the reply from the run. Latency is timed
+without tracing; allocation is the tracemalloc peak per turn.
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from google.adk.events import Event, EventActions
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from account_agent.config.Customer import Customer
+from services.session_store import MemorySessionBackend, PersistentSessionService
+
+APP_NAME = "bench"
+USER_ID = "u"
+
+
+def _event(author, text, delta=None):
+    return Event(
+        invocation_id="bench",
+        author=author,
+        content=types.Content(role="user" if author == "user" else "model", parts=[types.Part(text=text)]),
+        actions=EventActions(state_delta=delta or {}),
+    )
+
+
+async def _agent_run(service, session_id, turn):
+    # What Runner.run_async does with the session for a one-reply turn.
+    session = await service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=session_id)
+    await service.append_event(session, _event("user", f"update my address {turn}"))
+    reply = f"Sure, what is the new address? ({turn})"
+    await service.append_event(session, _event("account_agent", reply, {"conversation": reply}))
+    return reply
+
+
+async def reload_turn(service, session_id, turn):
+    session = await service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=session_id)
+    session.state.get("otp_status")
+    await _agent_run(service, session_id, turn)
+    updated = await service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=session_id)
+    return updated.state.get("conversation")
+
+
+async def direct_turn(service, session_id, turn):
+    state = await service.get_state(app_name=APP_NAME, user_id=USER_ID, session_id=session_id)
+    state.get("otp_status")
+    return await _agent_run(service, session_id, turn)
+
+
+async def _session_with_history(service, history):
+    session_id = f"s-{time.time_ns()}"
+    customer = Customer(user_id=USER_ID, session_id=session_id, app_name=APP_NAME)
+    await service.create_session(app_name=APP_NAME, user_id=USER_ID, session_id=session_id,
+                                 state={"customer": customer, "otp_status": None})
+    session = await service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=session_id)
+    for i in range(history):
+        await service.append_event(session, _event("account_agent" if i % 2 else "user", f"message {i}"))
+    return session_id
+
+
+async def measure(label, service, turn_fn, history, turns):
+    session_id = await _session_with_history(service, history)
+    start = time.perf_counter()
+    for turn in range(turns):
+        await turn_fn(service, session_id, turn)
+    latency = (time.perf_counter() - start) / turns
+
+    session_id = await _session_with_history(service, history)
+    tracemalloc.start()
+    peaks = []
+    for turn in range(turns):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        await turn_fn(service, session_id, turn)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    print(f"{label:<28} history {history:6d}  {latency * 1e6:10.1f} us/turn  {sum(peaks) / turns / 1024:10.1f} KiB peak/turn")
+
+
+async def main(histories, turns):
+    for history in histories:
+        await measure("in-memory + reload", InMemorySessionService(), reload_turn, history, turns)
+        await measure("session store + reload", PersistentSessionService(MemorySessionBackend()), reload_turn, history, turns)
+        await measure("session store + direct", PersistentSessionService(MemorySessionBackend()), direct_turn, history, turns)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--history", type=int, nargs="+", default=[0, 100, 1000])
+    parser.add_argument("--turns", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.history, args.turns))
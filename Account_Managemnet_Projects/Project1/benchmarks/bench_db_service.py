@@ -0,0 +1,246 @@
+"""
+Latency of the DBService operations against a seeded local database,
+with stored baselines and a regression check.
+
+    python -m benchmarks.bench_db_service --accounts 10000 --save-baseline
+    python -m benchmarks.bench_db_service --accounts 10000 --baseline
+    python -m benchmarks.bench_db_service --accounts 1000000 --samples 2000 --ops verify_user get_user_email
+
+Runs offline against the Postgres given by DB_* (a local server), in its
+own table (--table, default bench_users) so the app's users are never
+touched. The table is seeded once with ``accounts`` users sharing one
+bcrypt hash at the configured cost, generated server-side, and reused by
+later runs; --reseed rebuilds it.
+
+Each operation runs ``samples`` times, one call at a time, on random
+seeded users. The profile cache is cleared before every call so each
+one reaches the database. Every call is split into bcrypt time (spent in
+the hasher's check_sync/hash_sync) and query time (the rest: pool
+checkout, round-trips, row decoding). Operations:
+  verify_user       bcrypt check + profile lookup
+  get_user_details  profile lookup
+  get_user_email    e-mail lookup
+  update_email      update_field(..., "email", ...)
+  update_password   update_field(..., "password", ...), bcrypt hash + update
+  create_user       bcrypt hash + insert (rows are deleted afterwards)
+
+--save-baseline writes the results to a JSON file (default
+benchmarks/baselines/db_service.json). --baseline compares against it and
+exits with status 1 when a p50 or p95 is more than --threshold slower
+and at least --min-delta-ms worse; bcrypt times are only compared when
+the baseline used the same cost.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(PROJECT_DIR, "benchmarks", "baselines", "db_service.json")
+PASSWORD = "bench-password"
+OPERATIONS = ("verify_user", "get_user_details", "get_user_email", "update_email", "update_password", "create_user")
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted ``values``."""
+    index = max(0, min(len(values) - 1, round(q / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+class HashTimer:
+    """Adds up the time the calling thread spends in the hasher's blocking calls."""
+
+    def __init__(self, hasher):
+        self.elapsed = 0.0
+        for name in ("check_sync", "hash_sync"):
+            setattr(hasher, name, self._timed(getattr(hasher, name)))
+
+    def _timed(self, method):
+        def timed(*args):
+            start = time.perf_counter()
+            try:
+                return method(*args)
+            finally:
+                self.elapsed += time.perf_counter() - start
+        return timed
+
+
+def seed(db, table, accounts, hasher, reseed):
+    """Fills ``table`` with users bench0 .. bench<accounts - 1>; returns the seconds it took."""
+    from services.queries import quote_ident
+    from benchmarks.fixtures import USERS_TABLE
+
+    started = time.perf_counter()
+    quoted = quote_ident(table)
+    with db.pool.connection() as conn, conn.cursor() as cursor:
+        if reseed:
+            cursor.execute(f"DROP TABLE IF EXISTS {quoted}")
+        cursor.execute(USERS_TABLE.format(table=quoted))
+        cursor.execute(f"SELECT count(*), min(password) FROM {quoted}")
+        existing, stored_hash = cursor.fetchone()
+        # One hash for every row; refreshed when the configured cost changes so
+        # verify_user does not start rehashing on login.
+        if stored_hash is None or not stored_hash.startswith(f"$2b${hasher.rounds:02d}$"):
+            stored_hash = hasher.hash_sync(PASSWORD)
+            cursor.execute(f"UPDATE {quoted} SET password = %s", (stored_hash,))
+        if existing < accounts:
+            cursor.execute(
+                f"INSERT INTO {quoted} (username, password, first_name, last_name, email, phone_number, address) "
+                "SELECT 'bench' || i, %s, 'Bench', 'User', 'bench' || i || '@example.test', '5550100', "
+                "i || ' Bench Street' FROM generate_series(0, %s) AS i ON CONFLICT (username) DO NOTHING",
+                (stored_hash, accounts - 1),
+            )
+        cursor.execute(f"ANALYZE {quoted}")
+        conn.commit()
+    return time.perf_counter() - started
+
+
+def cleanup(db, table, run_id):
+    from services.queries import quote_ident
+
+    with db.pool.connection() as conn, conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {quote_ident(table)} WHERE username LIKE %s", (f"new{run_id}_%",))
+        conn.commit()
+
+
+def make_calls(db, accounts, run_id):
+    """Returns operation name -> callable(i) running one call."""
+    pick = random.Random(42)
+
+    def user():
+        return f"bench{pick.randrange(accounts)}"
+
+    return {
+        "verify_user": lambda i: db.verify_user(user(), PASSWORD),
+        "get_user_details": lambda i: db.get_user_details(user()),
+        "get_user_email": lambda i: db.get_user_email(user()),
+        "update_email": lambda i: db.update_field(user(), "email", f"bench.{i}@example.test"),
+        "update_password": lambda i: db.update_field(user(), "password", PASSWORD),
+        "create_user": lambda i: db.create_user(
+            f"new{run_id}_{i}", PASSWORD, first_name="Bench", last_name="User",
+            email=f"new{run_id}_{i}@example.test", phone_number="5550100", address="1 Bench Street",
+        ),
+    }
+
+
+def measure(call, samples, warmup, timer, cache):
+    totals, hashing = [], []
+    for i in range(-warmup, samples):
+        cache.clear()
+        timer.elapsed = 0.0
+        start = time.perf_counter()
+        call(i)
+        total = time.perf_counter() - start
+        if i >= 0:
+            totals.append(total * 1000)
+            hashing.append(timer.elapsed * 1000)
+    queries = sorted(total - spent for total, spent in zip(totals, hashing))
+    totals.sort()
+    hashing.sort()
+    result = {"samples": samples}
+    for label, values in (("total", totals), ("bcrypt", hashing), ("query", queries)):
+        result[f"{label}_mean_ms"] = statistics.fmean(values)
+        for q in (50, 95, 99):
+            result[f"{label}_p{q}_ms"] = percentile(values, q)
+    return result
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Returns a list of regression descriptions."""
+    same_cost = baseline.get("meta", {}).get("bcrypt_rounds") == results["meta"]["bcrypt_rounds"]
+    if not same_cost:
+        print(f"Baseline bcrypt cost {baseline.get('meta', {}).get('bcrypt_rounds')} differs from "
+              f"{results['meta']['bcrypt_rounds']}; comparing query times only.")
+    regressions = []
+    for name, current in results["operations"].items():
+        previous = baseline.get("operations", {}).get(name)
+        if previous is None:
+            continue
+        for label in ("query", "bcrypt") if same_cost else ("query",):
+            for q in (50, 95):
+                key = f"{label}_p{q}_ms"
+                before, now = previous[key], current[key]
+                if now > before * (1 + threshold) and now - before >= min_delta_ms:
+                    regressions.append(f"{name} {key}: {before:.2f} -> {now:.2f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=10000, help="seeded users (10k to 1M)")
+    parser.add_argument("--samples", type=int, default=500, help="timed calls per operation")
+    parser.add_argument("--warmup", type=int, default=20, help="untimed calls per operation first")
+    parser.add_argument("--ops", nargs="+", choices=OPERATIONS, default=list(OPERATIONS))
+    parser.add_argument("--table", default="bench_users")
+    parser.add_argument("--reseed", action="store_true", help="drop and rebuild the seeded table")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, metavar="PATH")
+    parser.add_argument("--baseline", nargs="?", const=DEFAULT_BASELINE, metavar="PATH")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--min-delta-ms", type=float, default=0.2, help="ignore smaller slowdowns")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    # The query catalog is built for DB_TABLE_NAME when first used.
+    os.environ["DB_TABLE_NAME"] = args.table
+    from services.db_service import DBService
+    from services.hashing import get_hasher
+    from services.profile_cache import get_profile_cache
+
+    db = DBService()
+    hasher = get_hasher()
+    seconds = seed(db, args.table, args.accounts, hasher, args.reseed)
+    print(f"Seeded {args.table} with {args.accounts} accounts in {seconds:.1f} s (bcrypt cost {hasher.rounds})")
+
+    timer = HashTimer(hasher)
+    run_id = time.time_ns()
+    calls = make_calls(db, args.accounts, run_id)
+    results = {
+        "meta": {
+            "accounts": args.accounts,
+            "samples": args.samples,
+            "bcrypt_rounds": hasher.rounds,
+            "python": platform.python_version(),
+            "machine": platform.node(),
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "operations": {},
+    }
+    try:
+        for name in args.ops:
+            results["operations"][name] = measure(calls[name], args.samples, args.warmup, timer, get_profile_cache())
+    finally:
+        cleanup(db, args.table, run_id)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"\n{'operation':<18} {'total p50':>10} {'p95':>8} {'p99':>8} {'bcrypt p50':>11} "
+              f"{'query p50':>10} {'p95':>8} {'p99':>8}   (ms)")
+        for name, row in results["operations"].items():
+            print(f"{name:<18} {row['total_p50_ms']:10.2f} {row['total_p95_ms']:8.2f} {row['total_p99_ms']:8.2f} "
+                  f"{row['bcrypt_p50_ms']:11.2f} {row['query_p50_ms']:10.2f} {row['query_p95_ms']:8.2f} "
+                  f"{row['query_p99_ms']:8.2f}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved baseline to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline} (threshold {args.threshold:.0%}).")
+
+
+if __name__ == "__main__":
+    main()
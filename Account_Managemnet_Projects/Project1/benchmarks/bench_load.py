@@ -0,0 +1,252 @@
+"""
+End-to-end load test of /session and /chat with N concurrent users.
+
+    python -m benchmarks.bench_load --users 50 --rounds 2
+    python -m benchmarks.bench_load --users 200 --llm-latency 0.8 --fast-path
+    python -m benchmarks.bench_load --users 50 --json
+
+The app runs in-process behind httpx's ASGI transport, with its real
+session store, OTP manager, outbox and hashing. Only the outside world is
+replaced: the agent's model is benchmarks.fixtures.ScriptedLlm, OTP
+e-mails go to a local SmtpSink, and users live in the configured DB_*
+Postgres (a local one; the users table is created if missing and the
+seeded users are deleted afterwards).
+
+Each user opens a session, asks for the menu, then ``rounds`` times asks
+to update their e-mail with username, password and new address, waits
+for the OTP to reach the sink and sends it back. Phases:
+  session       POST /session
+  menu          POST /chat "hello" (agent, or the response cache)
+  tool          POST /chat with the update request (agent tool call and OTP send,
+                or the router's fast path with --fast-path)
+  otp_delivery  from the tool reply until the sink received the OTP
+  otp           POST /chat with the code (verification, update and agent reply)
+Replies that do not match the expected step count as errors. Rate limits
+are disabled unless --rate-limits is given; run in a temporary directory
+so the local stores and logs are not left behind.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from collections import defaultdict, namedtuple
+
+from benchmarks.fixtures import USERS_TABLE, ScriptedLlm, SmtpSink
+
+Sample = namedtuple("Sample", "phase endpoint start end ok")
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted ``values``."""
+    index = max(0, min(len(values) - 1, round(q / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def summarize(samples, key):
+    groups = defaultdict(list)
+    for sample in samples:
+        groups[getattr(sample, key)].append(sample)
+    summary = {}
+    for name, group in groups.items():
+        latencies = sorted((sample.end - sample.start) * 1000 for sample in group)
+        span = max(sample.end for sample in group) - min(sample.start for sample in group)
+        summary[name] = {
+            "count": len(group),
+            "errors": sum(not sample.ok for sample in group),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "mean_ms": statistics.fmean(latencies),
+            "rps": len(group) / span if span > 0 else 0.0,
+        }
+    return summary
+
+
+def print_table(title, summary):
+    print(f"\n{title:<14} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rps':>8}")
+    for name, row in summary.items():
+        print(f"{name:<14} {row['count']:6d} {row['errors']:6d} {row['p50_ms']:9.1f} "
+              f"{row['p95_ms']:9.1f} {row['p99_ms']:9.1f} {row['rps']:8.1f}")
+
+
+class LoadTest:
+    def __init__(self, client, sink, prefix, rounds):
+        self.client = client
+        self.sink = sink
+        self.prefix = prefix
+        self.rounds = rounds
+        self.samples = []
+
+    async def post(self, phase, path, payload, expect=None):
+        start = time.perf_counter()
+        body = None
+        try:
+            response = await self.client.post(path, json=payload)
+            if response.status_code == 200:
+                body = response.json()
+        except Exception as e:
+            print(f"{phase}: {e}")
+        ok = body is not None and (expect is None or expect in str(body.get("response") or ""))
+        self.samples.append(Sample(phase, path, start, time.perf_counter(), ok))
+        return body if ok else None
+
+    async def user(self, index):
+        username = f"{self.prefix}{index}"
+        password = f"pw-{username}"
+        email = f"{username}@example.test"
+
+        body = await self.post("session", "/session", {"user_id": username})
+        if body is None:
+            return
+        chat = {"user_id": username, "session_id": body["session_id"]}
+        await self.post("menu", "/chat", dict(chat, message="hello"))
+
+        for round_number in range(self.rounds):
+            new_email = f"{username}.r{round_number}@example.test"
+            message = f"update email username {username} password {password} new email {new_email}"
+            if await self.post("tool", "/chat", dict(chat, message=message), expect="OTP") is None:
+                return
+            start = time.perf_counter()
+            code = await asyncio.to_thread(self.sink.wait_for, email)
+            self.samples.append(Sample("otp_delivery", "smtp", start, time.perf_counter(), code is not None))
+            if code is None:
+                return
+            if await self.post("otp", "/chat", dict(chat, message=code), expect="Successful") is None:
+                return
+            email = new_email
+
+
+async def seed(prefix, users):
+    from services.async_db_service import get_async_db
+    from services.queries import quote_ident
+    from services.settings import get_settings
+
+    db = get_async_db()
+    pool = await db._get_pool()
+    await pool.execute(USERS_TABLE.format(table=quote_ident(get_settings().db_table_name)))
+    semaphore = asyncio.Semaphore(16)
+
+    async def create(index):
+        username = f"{prefix}{index}"
+        async with semaphore:
+            await db.create_user(username, f"pw-{username}", first_name="Load", last_name="Test",
+                                 email=f"{username}@example.test", phone_number="5550100", address="1 Test Street")
+
+    await asyncio.gather(*(create(index) for index in range(users)))
+
+
+async def cleanup(prefix):
+    from services.async_db_service import get_async_db
+    from services.queries import quote_ident
+    from services.settings import get_settings
+
+    pool = await get_async_db()._get_pool()
+    await pool.execute(
+        f"DELETE FROM {quote_ident(get_settings().db_table_name)} WHERE username LIKE $1", f"{prefix}%"
+    )
+
+
+async def run(args, sink):
+    import httpx
+
+    # The app reads its configuration at import time.
+    import account_agent.app as app_module
+    from google.adk.models import LLMRegistry
+
+    LLMRegistry.register(ScriptedLlm)
+    ScriptedLlm.latency = args.llm_latency
+    prefix = f"lt{int(time.time()) % 100000}u"
+
+    async with app_module.lifespan(app_module.app):
+        await asyncio.to_thread(app_module.get_runner)
+        started = time.perf_counter()
+        await seed(prefix, args.users)
+        print(f"Seeded {args.users} users in {time.perf_counter() - started:.1f} s")
+        try:
+            transport = httpx.ASGITransport(app=app_module.app)
+            # Stats endpoints are admin-only: ASGITransport connects as 127.0.0.1, plus the token if one is set.
+            token = os.environ.get("ADMIN_TOKEN")
+            headers = {"Authorization": f"Bearer {token}"} if token else None
+            async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=120, headers=headers) as client:
+                test = LoadTest(client, sink, prefix, args.rounds)
+                started = time.perf_counter()
+                await asyncio.gather(*(test.user(index) for index in range(args.users)))
+                elapsed = time.perf_counter() - started
+                router_stats = (await client.get("/router/stats")).json()
+                cache_stats = (await client.get("/cache/stats")).json()
+        finally:
+            await cleanup(prefix)
+
+    return {
+        "users": args.users,
+        "rounds": args.rounds,
+        "elapsed_s": elapsed,
+        "requests_per_second": sum(sample.endpoint != "smtp" for sample in test.samples) / elapsed,
+        "llm_calls": ScriptedLlm.calls,
+        "emails_delivered": sink.delivered,
+        "endpoints": summarize(test.samples, "endpoint"),
+        "phases": summarize(test.samples, "phase"),
+        "router": router_stats,
+        "response_cache": cache_stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="concurrent simulated users")
+    parser.add_argument("--rounds", type=int, default=1, help="update + OTP cycles per user")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds the fake model sleeps per call")
+    parser.add_argument("--fast-path", action="store_true", help="let the router answer fully specified requests")
+    parser.add_argument("--no-response-cache", action="store_true")
+    parser.add_argument("--rate-limits", action="store_true", help="keep the configured rate limits")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    sink = SmtpSink().start()
+    os.environ.update({
+        "AGENT_MODEL": "loadtest-scripted",
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(sink.port),
+        "SMTP_USE_TLS": "0",
+        "SMTP_PASSWORD": "",
+        "EMAIL_SENDER": "loadtest@localhost",
+        "STARTUP_WARMUP": "false",
+        "FAST_PATH_ENABLED": "true" if args.fast_path else "false",
+    })
+    if args.no_response_cache:
+        os.environ["RESPONSE_CACHE_MAX_ENTRIES"] = "0"
+    if not args.rate_limits:
+        for name in ("CHAT", "SESSION", "OTP_SEND", "PASSWORD_FAILURE"):
+            os.environ[f"RATE_LIMIT_{name}"] = "0"
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update({
+            "SESSION_STORE_PATH": os.path.join(tmp, "sessions.db"),
+            "OTP_STORE_PATH": os.path.join(tmp, "otp.db"),
+            "RATE_LIMIT_STORE_PATH": os.path.join(tmp, "ratelimit.db"),
+        })
+        os.chdir(tmp)
+        try:
+            results = asyncio.run(run(args, sink))
+        finally:
+            os.chdir(cwd)
+            sink.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"\n{results['users']} users x {results['rounds']} rounds in {results['elapsed_s']:.2f} s, "
+          f"{results['requests_per_second']:.1f} requests/s, {results['llm_calls']} LLM calls, "
+          f"{results['emails_delivered']} e-mails, fast-path share "
+          f"{results['router'].get('fast_path_fraction', 0.0):.0%}, "
+          f"response cache hit rate {results['response_cache']['hit_rate']:.0%}")
+    print_table("endpoint", results["endpoints"])
+    print_table("phase", results["phases"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Cost of OTP issue, verify and expiry with many outstanding challenges.
+
+    python -m benchmarks.bench_otp --outstanding 1000 10000
+    python -m benchmarks.bench_otp --db
+
+Issues ``outstanding`` challenges, verifies a sample of them (half with
+a wrong code first), then lets the rest expire. The sweeper removes
+challenges as they come due, so "sweep lag" is how long after the last
+expiry the last one was gone. --db adds the postgres store on the
+configured DB_* database.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from services.otp_manager import OTPManager, PostgresOTPStore, SQLiteOTPStore
+
+
+def run(label, store, outstanding, sample):
+    run_id = time.time_ns()
+    ttl = 2.0 + outstanding / 5000
+    manager = OTPManager(store, ttl=ttl, sweep_interval=3600)
+
+    start = time.perf_counter()
+    codes = {f"{run_id}-{i}": manager.issue(f"{run_id}-{i}") for i in range(outstanding)}
+    issue = (time.perf_counter() - start) / outstanding
+    issued_at = time.time()
+
+    ids = list(codes)[:sample]
+    start = time.perf_counter()
+    for i, challenge_id in enumerate(ids):
+        if i % 2:
+            manager.verify(challenge_id, "wrong")
+        manager.verify(challenge_id, codes[challenge_id])
+    verify = (time.perf_counter() - start) / len(ids)
+
+    remaining = outstanding - len(ids)
+    time.sleep(max(0.0, issued_at + ttl - time.time()))
+    start = time.perf_counter()
+    while manager.stats()["tracked"]:
+        time.sleep(0.01)
+    sweep = time.perf_counter() - start
+    manager.close()
+    print(f"{label:<10} outstanding {outstanding:7d}  issue {issue * 1e6:8.1f} us  "
+          f"verify {verify * 1e6:8.1f} us  sweep lag for {remaining} expired {sweep * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--outstanding", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--sample", type=int, default=500)
+    parser.add_argument("--db", action="store_true", help="also benchmark the postgres store")
+    args = parser.parse_args()
+
+    for outstanding in args.outstanding:
+        sample = min(args.sample, outstanding)
+        with tempfile.TemporaryDirectory() as tmp:
+            run("sqlite", SQLiteOTPStore(os.path.join(tmp, "otp.db")), outstanding, sample)
+        if args.db:
+            run("postgres", PostgresOTPStore(), outstanding, sample)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Per-call overhead of DBService statements before and after the query catalog.
+
+    python -m benchmarks.bench_query_catalog --iterations 20000
+    python -m benchmarks.bench_query_catalog --iterations 2000 --db --username <existing_user>
+
+Without --db only the client-side cost of building the statement is measured.
+With --db each variant also runs the lookup against the configured database:
+"composed" sends the text built by sql.SQL(...).format(...) as the old code
+did, "prepared" runs the catalog statement through EXECUTE.
+"""
+import argparse
+import os
+import time
+
+from psycopg2 import sql
+from psycopg2.extras import DictCursor
+
+from services.queries import get_catalog
+
+
+def _report(label, elapsed, iterations):
+    print(f"{label:<32} {elapsed / iterations * 1e6:10.2f} us/call")
+
+
+def _compose_profile_query():
+    return sql.SQL("SELECT * FROM {} WHERE username = %s").format(
+        sql.Identifier(os.getenv("DB_TABLE_NAME"))
+    )
+
+
+def bench_composition(iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        _compose_profile_query()
+    _report("compose per call (before)", time.perf_counter() - start, iterations)
+
+    catalog = get_catalog()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        catalog.execute_sql["select_profile"]
+    _report("catalog lookup (after)", time.perf_counter() - start, iterations)
+
+
+def bench_database(iterations, username):
+    from services.db_service import DBService
+
+    db = DBService()
+    with db.pool.connection() as conn, conn.cursor(cursor_factory=DictCursor) as cursor:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            cursor.execute(_compose_profile_query(), (username,))
+            cursor.fetchone()
+        _report("select_profile composed", time.perf_counter() - start, iterations)
+
+        db._execute(conn, cursor, "select_profile", (username,))
+        cursor.fetchone()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            db._execute(conn, cursor, "select_profile", (username,))
+            cursor.fetchone()
+        _report("select_profile prepared", time.perf_counter() - start, iterations)
+        conn.rollback()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--db", action="store_true", help="also time round-trips against the database")
+    parser.add_argument("--username", default="benchmark_user")
+    args = parser.parse_args()
+
+    bench_composition(args.iterations)
+    if args.db:
+        bench_database(args.iterations, args.username)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Per-turn latency of the session services used by the /chat path.
+
+    python -m benchmarks.bench_session_store --sessions 50 --turns 40
+    python -m benchmarks.bench_session_store --db
+
+A turn is what the runner does for one message: get_session, then
+append_event for the user message and for the agent reply with a
+state delta. "memory" is ADK's InMemorySessionService, "sqlite" and
+"postgres" are PersistentSessionService with write-behind; their
+shutdown flush is timed separately. --db adds the postgres backend on
+the configured DB_* database.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from google.adk.events import Event, EventActions
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from account_agent.config.Customer import Customer
+from services.session_store import PersistentSessionService, PostgresSessionBackend, SQLiteSessionBackend
+
+APP_NAME = "bench"
+
+
+def _event(author, text, delta=None):
+    return Event(
+        invocation_id="bench",
+        author=author,
+        content=types.Content(role="user" if author == "user" else "model", parts=[types.Part(text=text)]),
+        actions=EventActions(state_delta=delta or {}),
+    )
+
+
+async def run(label, service, sessions, turns):
+    run_id = str(time.time_ns())
+    ids = [f"{run_id}-{i}" for i in range(sessions)]
+    for sid in ids:
+        customer = Customer(user_id="u", session_id=sid, app_name=APP_NAME)
+        await service.create_session(app_name=APP_NAME, user_id="u", session_id=sid,
+                                     state={"customer": customer, "otp_status": None})
+
+    latencies = []
+    for turn in range(turns):
+        for sid in ids:
+            start = time.perf_counter()
+            session = await service.get_session(app_name=APP_NAME, user_id="u", session_id=sid)
+            await service.append_event(session, _event("user", f"update my address {turn}"))
+            await service.append_event(session, _event("account_agent", "Sure, what is the new address?",
+                                                       {"conversation": f"reply {turn}", "pending_tool": None}))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    if hasattr(service, "close"):
+        await service.close()
+    flush = time.perf_counter() - start
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1e6
+    p95 = latencies[int(len(latencies) * 0.95)] * 1e6
+    mean = statistics.fmean(latencies) * 1e6
+    print(f"{label:<10} mean {mean:9.1f} us  p50 {p50:9.1f} us  p95 {p95:9.1f} us  final flush {flush * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--db", action="store_true", help="also benchmark the postgres backend")
+    args = parser.parse_args()
+
+    asyncio.run(run("memory", InMemorySessionService(), args.sessions, args.turns))
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = SQLiteSessionBackend(os.path.join(tmp, "sessions.db"))
+        asyncio.run(run("sqlite", PersistentSessionService(backend), args.sessions, args.turns))
+    if args.db:
+        asyncio.run(run("postgres", PersistentSessionService(PostgresSessionBackend()), args.sessions, args.turns))
+
+
+if __name__ == "__main__":
+    main()
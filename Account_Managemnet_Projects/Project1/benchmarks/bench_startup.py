@@ -0,0 +1,71 @@
+"""
+Cold-start time of the account_agent app.
+
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --unreachable-db
+
+Each run starts a fresh interpreter and reports:
+  import  - time to import account_agent.app
+  ready   - time until the lifespan start-up finished (the app accepts requests)
+  first   - time until the first request (GET /sessions/stats) was answered
+Times are measured from interpreter start-up, and medians are printed.
+--unreachable-db points DB_HOST at a blackhole address to show that
+start-up does not wait on the database. Runs happen in a temporary
+directory so log files and local stores are not left behind.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, os, time
+start = time.perf_counter()
+import account_agent.app as app_module
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+# /sessions/stats is admin-only: send the token if set, else connect as localhost.
+token = os.environ.get("ADMIN_TOKEN")
+headers = {"Authorization": f"Bearer {token}"} if token else None
+with TestClient(app_module.app, client=("127.0.0.1", 50000), headers=headers) as client:
+    ready = time.perf_counter()
+    client.get("/sessions/stats")
+    first = time.perf_counter()
+print("RESULT " + json.dumps({"import": imported - start, "ready": ready - start, "first": first - start}))
+"""
+
+
+def run_once(env):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(env, SESSION_STORE_PATH=os.path.join(tmp, "sessions.db"),
+                   OTP_STORE_PATH=os.path.join(tmp, "otp.db"))
+        result = subprocess.run([sys.executable, "-c", CHILD], cwd=tmp, env=env,
+                                capture_output=True, text=True, timeout=300)
+    for line in result.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    raise RuntimeError(f"Start-up run failed:\n{result.stderr[-2000:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--unreachable-db", action="store_true", help="point DB_HOST at an address that never answers")
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=PROJECT_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    if args.unreachable_db:
+        env["DB_HOST"] = "10.255.255.1"
+    runs = [run_once(env) for _ in range(args.runs)]
+    for phase in ("import", "ready", "first"):
+        values = [run[phase] * 1000 for run in runs]
+        print(f"{phase:<7} median {statistics.median(values):8.1f} ms  min {min(values):8.1f} ms  max {max(values):8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Local stand-ins for the services the app talks to, for load tests that
+must run without Gemini, Cloud SQL or a real mail server.
+
+ScriptedLlm  - a model that answers with the router's reading of the
+               user message: a tool call when the message names a tool and
+               all of its arguments, the tool's reply after the call, the
+               OTP outcome the app passes on, and a fixed menu otherwise.
+               Register it and set AGENT_MODEL to a "loadtest-..." name.
+SmtpSink     - an SMTP server on localhost that accepts every message and
+               keeps the OTP codes per recipient.
+USERS_TABLE  - DDL for the users table, for an empty local Postgres.
+"""
+import asyncio
+import re
+import socketserver
+import threading
+import time
+from collections import defaultdict
+from typing import ClassVar
+
+from google.adk.models import BaseLlm, LlmResponse
+from google.genai import types
+
+from services.router import get_router
+
+MENU = (
+    "I can help you with create_account, update_password, update_email, "
+    "update_contact and update_address. Which one would you like to use?"
+)
+
+USERS_TABLE = """CREATE TABLE IF NOT EXISTS {table} (
+    id SERIAL PRIMARY KEY,
+    username VARCHAR(50) UNIQUE NOT NULL,
+    password VARCHAR(255) NOT NULL,
+    first_name VARCHAR(50),
+    last_name VARCHAR(50),
+    email VARCHAR(100),
+    phone_number VARCHAR(20),
+    address TEXT)"""
+
+
+def _reply(text):
+    return LlmResponse(content=types.Content(role="model", parts=[types.Part(text=text)]))
+
+
+class ScriptedLlm(BaseLlm):
+    """
+    Deterministic model for load tests. ``latency`` seconds are slept per
+    call to stand in for the real model's response time.
+    """
+
+    latency: ClassVar[float] = 0.0
+    calls: ClassVar[int] = 0
+
+    @classmethod
+    def supported_models(cls):
+        return [r"loadtest-.*"]
+
+    async def generate_content_async(self, llm_request, stream=False):
+        ScriptedLlm.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        content = llm_request.contents[-1] if llm_request.contents else None
+        parts = content.parts if content and content.parts else []
+
+        for part in parts:
+            if part.function_response:
+                response = part.function_response.response or {}
+                text = response.get("message") or response.get("error") or response.get("result")
+                yield _reply(str(text or "Done."))
+                return
+
+        text = "".join(part.text for part in parts if part.text)
+        route = get_router().route(text)
+        if route is None:
+            # The app hands the OTP outcome to the agent to relay; repeat its first line.
+            yield _reply(text.strip().splitlines()[0] if text.startswith("OTP Verification") else MENU)
+            return
+        yield LlmResponse(content=types.Content(role="model", parts=[
+            types.Part(function_call=types.FunctionCall(name=route.tool, args=dict(route.args)))
+        ]))
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    """Just enough of RFC 5321 for smtplib without TLS or AUTH."""
+
+    def _send(self, line):
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def handle(self):
+        sink = self.server.sink
+        recipients = []
+        self._send("220 localhost smtp sink")
+        for raw in self.rfile:
+            command = raw.decode("utf-8", "replace").strip()
+            verb = command[:4].upper()
+            if verb in ("EHLO", "HELO"):
+                self._send("250 localhost")
+            elif verb == "MAIL":
+                recipients = []
+                self._send("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command.split(":", 1)[1].strip().strip("<>").lower())
+                self._send("250 OK")
+            elif verb == "DATA":
+                self._send("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                for data in self.rfile:
+                    if data in (b".\r\n", b".\n"):
+                        break
+                    lines.append(data.decode("utf-8", "replace"))
+                sink.deliver(recipients, "".join(lines))
+                self._send("250 OK")
+            elif verb in ("RSET", "NOOP"):
+                self._send("250 OK")
+            elif verb == "QUIT":
+                self._send("221 Bye")
+                return
+            else:
+                self._send("502 Command not implemented")
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SmtpSink:
+    """
+    Threaded SMTP server on 127.0.0.1. ``wait_for(recipient)`` blocks until
+    an OTP for that address arrives and returns the code; each code is
+    handed out once.
+    """
+
+    OTP_PATTERN = re.compile(r"Your OTP is: (\d+)")
+
+    def __init__(self, port=0):
+        self._server = _Server(("127.0.0.1", port), _SmtpHandler)
+        self._server.sink = self
+        self.port = self._server.server_address[1]
+        self._codes = defaultdict(list)
+        self._cond = threading.Condition()
+        self.delivered = 0
+        self._thread = threading.Thread(target=self._server.serve_forever, name="smtp-sink", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def deliver(self, recipients, body):
+        match = self.OTP_PATTERN.search(body)
+        with self._cond:
+            self.delivered += 1
+            if match:
+                for recipient in recipients:
+                    self._codes[recipient].append(match.group(1))
+            self._cond.notify_all()
+
+    def wait_for(self, recipient, timeout=30.0):
+        """Returns the oldest unclaimed OTP sent to ``recipient``, or None on timeout."""
+        deadline = time.monotonic() + timeout
+        recipient = recipient.lower()
+        with self._cond:
+            while not self._codes[recipient]:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return self._codes[recipient].pop(0)
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
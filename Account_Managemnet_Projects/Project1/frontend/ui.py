@@ -1,12 +1,53 @@
 import streamlit as st
 import requests
-import random
+import json
 import os
+import random
+from collections import deque
 
 API_BASE = "http://localhost:8000"
+# Most recent log lines kept in the sidebar viewer
+LOG_VIEW_LINES = 500
+# Log endpoints are admin-only; without a token the API accepts localhost only.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+ADMIN_HEADERS = {"Authorization": f"Bearer {ADMIN_TOKEN}"} if ADMIN_TOKEN else {}
 
 st.title("🤖 Account Management Chatbot")
 
+def sse_events(response):
+    """Yields (event, data) pairs from a text/event-stream response."""
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+
+
+def render_stream(placeholder, payload):
+    """Streams a chat turn into ``placeholder`` and returns the final reply."""
+    text, status = "", ""
+    with requests.post(f"{API_BASE}/chat/stream", json=payload, stream=True) as res:
+        res.raise_for_status()
+        for event, data in sse_events(res):
+            if event == "text":
+                text += data["text"]
+            elif event == "tool_start":
+                status = f"_Running {data['tool']}..._"
+            elif event == "tool_end":
+                status = ""
+            elif event == "final":
+                return data["response"]
+            elif event == "error":
+                return f"Error: {data['message']}"
+            placeholder.markdown(text + ("\n\n" + status if status else "") + " ▌")
+    return text
+
+
 # --- User and Session ID Management ---
 if "user_id" not in st.session_state:
     st.session_state.user_id = str(random.randint(1000, 9999))
@@ -31,6 +72,12 @@ if "chat_history" not in st.session_state:
 if "show_logs" not in st.session_state:
     st.session_state.show_logs = False
 
+# --- Log Tail State: only lines past log_offset are fetched on each rerun ---
+if "log_lines" not in st.session_state:
+    st.session_state.log_lines = deque(maxlen=LOG_VIEW_LINES)
+    st.session_state.log_offset = 0
+    st.session_state.log_file_id = None
+
 # --- Sidebar: Toggle Button and Log Viewer ---
 with st.sidebar:
     st.markdown("## Session Logs")
@@ -39,19 +86,27 @@ with st.sidebar:
 
     if st.session_state.show_logs:
         st.markdown("### Session Log File")
-        log_file_path = f"logs/{st.session_state.session_id}_app.log"
-
-        if os.path.exists(log_file_path):
-            try:
-                with open(log_file_path, "r") as f:
-                    log_contents = f.read()
+        try:
+            res = requests.get(
+                f"{API_BASE}/logs/{st.session_state.session_id}",
+                params={"offset": st.session_state.log_offset, "file_id": st.session_state.log_file_id},
+                headers=ADMIN_HEADERS,
+            )
+            if res.status_code == 404:
+                st.warning("Log file not found for this session.")
+            else:
+                res.raise_for_status()
+                data = res.json()
+                if data["reset"]:
+                    st.session_state.log_lines.clear()
+                st.session_state.log_lines.extend(data["lines"])
+                st.session_state.log_offset = data["offset"]
+                st.session_state.log_file_id = data["file_id"]
 
                 with st.expander(f"Log File: {st.session_state.session_id}_app.log", expanded=True):
-                    st.text(log_contents)
-            except Exception as e:
-                st.error(f"Error reading log file: {e}")
-        else:
-            st.warning("Log file not found for this session.")
+                    st.text("\n".join(st.session_state.log_lines))
+        except Exception as e:
+            st.error(f"Error reading log file: {e}")
 
 # --- Display Chat in Main Window ---
 for entry in st.session_state.chat_history:
@@ -65,20 +120,17 @@ if user_input := st.chat_input("Type your message..."):
     with st.chat_message("user"):
         st.markdown(user_input)
 
-    try:
-        res = requests.post(
-            f"{API_BASE}/chat",
-            json={
+    with st.chat_message("assistant"):
+        placeholder = st.empty()
+        reply = ""
+        try:
+            reply = render_stream(placeholder, {
                 "user_id": st.session_state.user_id,
                 "session_id": st.session_state.session_id,
                 "message": user_input
-            }
-        )
-        res.raise_for_status()
-        reply = res.json().get("response", "No response")
-    except Exception as e:
-        reply = f"Error: {e}"
+            })
+        except Exception as e:
+            reply = f"Error: {e}"
+        placeholder.markdown(reply or "No response")
 
-    st.session_state.chat_history.append({"sender": "assistant", "message": reply})
-    with st.chat_message("assistant"):
-        st.markdown(reply)
+    st.session_state.chat_history.append({"sender": "assistant", "message": reply or "No response"})
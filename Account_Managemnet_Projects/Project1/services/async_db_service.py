@@ -0,0 +1,350 @@
+import asyncio
+import asyncpg
+from services.logger import get_logger
+from services.hashing import get_hasher
+from services.metrics import DB_SECONDS, timed
+from services.profile_cache import get_profile_cache
+from services.queries import ALLOWED_UPDATE_FIELDS, USER_COLUMNS, get_catalog
+from services.settings import get_settings
+
+logger = get_logger()
+
+
+class AsyncDBService:
+    """
+    asyncio counterpart of DBService for the FastAPI request path.
+
+    Exposes the same methods as DBService but awaits every round-trip on an
+    asyncpg pool, so a slow Cloud SQL query no longer blocks the event loop.
+    The synchronous DBService is kept for scripts and CLI tools.
+
+    Statements come from the shared QueryCatalog; asyncpg prepares each one
+    server-side the first time a pooled connection runs it and keeps it in
+    the connection's statement cache.
+    """
+
+    def __init__(self):
+        self.pool = None
+        self.settings = get_settings()
+        self.catalog = get_catalog()
+        # Rehash-on-login tasks, kept referenced until they finish.
+        self._background = set()
+        self._rehashing = set()
+        self._pool_lock = asyncio.Lock()
+
+    async def _get_pool(self):
+        if self.pool is None:
+            async with self._pool_lock:
+                if self.pool is None:
+                    settings = self.settings
+                    try:
+                        self.pool = await asyncpg.create_pool(
+                            database=settings.db_name,
+                            user=settings.db_user,
+                            password=settings.db_password,
+                            host=settings.db_host,
+                            port=settings.db_port,
+                            ssl=settings.db_sslmode,  # Enforces SSL/TLS connection for Google Cloud SQL
+                            min_size=settings.db_pool_min_size,
+                            max_size=settings.db_pool_max_size,
+                            statement_cache_size=settings.db_statement_cache_size,
+                        )
+                        logger.info("Async database pool established.")
+                    except (OSError, asyncpg.PostgresError) as e:
+                        logger.error(f"Error: Could not connect to the database. {e}")
+                        raise
+        return self.pool
+
+    async def connect(self):
+        """Opens the pool ahead of the first query, e.g. from the start-up warm-up."""
+        await self._get_pool()
+
+    async def _fetchrow(self, name, *args):
+        pool = await self._get_pool()
+        async with pool.acquire(timeout=self.settings.db_pool_timeout) as conn:
+            return await conn.fetchrow(self.catalog.statements[name], *args)
+
+    async def _execute(self, name, *args):
+        pool = await self._get_pool()
+        async with pool.acquire(timeout=self.settings.db_pool_timeout) as conn:
+            return await conn.execute(self.catalog.statements[name], *args)
+
+    async def _password_matches(self, username, password, stored_password):
+        """
+        Compares the provided password with the stored hash.
+        Supports bcrypt hashes and plaintext fallback for legacy data.
+        """
+        logger.info(f"Using verification with username and password for: {username}")
+        hasher = get_hasher()
+        matched = False
+        try:
+            if await hasher.check(password, stored_password):
+                logger.info(f"User verified with bcrypt: {username}")
+                matched = True
+        except ValueError:
+            logger.warning(f"Stored password for {username} is not a bcrypt hash. Trying plaintext match.")
+            if password == stored_password:
+                logger.warning(f"User verified with plaintext password: {username}")
+                matched = True
+        if matched and hasher.needs_rehash(stored_password) and username not in self._rehashing:
+            hasher.count("weak_hashes_seen")
+            self._rehashing.add(username)
+            task = asyncio.create_task(self._rehash(username, password, stored_password))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+        return matched
+
+    async def _rehash(self, username, password, stored_password):
+        """
+        Upgrades a plaintext or under-cost password after a successful login.
+        Runs as a background task so the login response does not wait for it.
+        """
+        hasher = get_hasher()
+        try:
+            hashed = await hasher.hash(password)
+            status = await self._execute("rehash_password", hashed, username, stored_password)
+            if int(status.split()[-1]):
+                get_profile_cache().invalidate(username)
+                hasher.count("rehash_upgraded")
+                logger.info(f"Upgraded password hash for user {username} to cost {hasher.rounds}")
+        except Exception as e:
+            hasher.count("rehash_failed")
+            logger.error(f"Error upgrading password hash for user {username}: {e}")
+        finally:
+            self._rehashing.discard(username)
+
+    @timed(DB_SECONDS, "count_weak_hashes")
+    async def count_weak_hashes(self):
+        """
+        Returns how many stored passwords are still plaintext or hashed
+        below the configured bcrypt cost.
+        """
+        row = await self._fetchrow("count_weak_hashes", get_hasher().rounds)
+        return dict(row)
+
+    async def _load_profile(self, username):
+        """
+        Returns the user row without the password hash, from the profile
+        cache when possible.
+        """
+        cache = get_profile_cache()
+        profile = cache.get(username)
+        if profile is not None:
+            return profile
+        row = await self._fetchrow("select_profile", username)
+        if row is None:
+            return None
+        profile = {key: value for key, value in row.items() if key != "password"}
+        cache.set(username, profile)
+        return profile
+
+    @timed(DB_SECONDS, "authenticate")
+    async def authenticate(self, username, password, raise_errors=False):
+        """
+        Verifies the credentials and returns the user's full row. Needs a
+        single query instead of verify_user followed by get_user_details; the
+        row is always read from the database, never from the profile cache,
+        and refreshes the cached profile. Returns None for an
+        unknown user or a wrong password; database and hashing errors
+        (e.g. HasherBusyError) also return None unless ``raise_errors``,
+        for callers that must not treat an outage as a wrong password.
+        """
+        try:
+            row = await self._fetchrow("select_profile", username)
+            if row and await self._password_matches(username, password, row["password"]):
+                get_profile_cache().set(username, row)
+                return dict(row)
+        except Exception as e:
+            logger.error(f"Error verifying user {username}: {e}")
+            if raise_errors:
+                raise
+            return None
+
+        logger.warning(f"Invalid credentials for user: {username}")
+        return None
+
+    @timed(DB_SECONDS, "verify_user")
+    async def verify_user(self, username, password):
+        """
+        Verifies a user by comparing the provided password with the stored hash.
+        Supports bcrypt hashes and plaintext fallback for legacy data.
+        """
+        if await self.authenticate(username, password):
+            return {"username": username}
+        return None
+
+    def _validate_changes(self, username, changes):
+        if not changes:
+            logger.error(f"No fields to update for user {username}")
+            raise ValueError(f"No fields to update for user {username}")
+        for field in changes:
+            if field not in ALLOWED_UPDATE_FIELDS:
+                logger.error(f"Invalid field specified: {field}")
+                raise ValueError(f"Invalid field specified: {field}")
+
+    async def _prepare_changes(self, changes):
+        """
+        Returns the catalog field order and values, with passwords hashed.
+        """
+        fields = [field for field in ALLOWED_UPDATE_FIELDS if field in changes]
+        values = []
+        for field in fields:
+            if field == "password":
+                values.append(await get_hasher().hash(changes[field]))
+            else:
+                values.append(changes[field])
+        return fields, values
+
+    @timed(DB_SECONDS, "update_field")
+    async def update_field(self, username, field, value):
+        """
+        Updates a single allowed field for a user.
+        Returns True only if a row was actually updated.
+        """
+        return bool(await self.update_fields(username, {field: value}))
+
+    @timed(DB_SECONDS, "update_fields")
+    async def update_fields(self, username, changes):
+        """
+        Updates several allowed fields for a user in a single UPDATE.
+
+        ``changes`` maps field names to new values; a password is hashed
+        before it is stored. Returns the number of rows updated (0 if the user
+        does not exist), or None if the update failed.
+        """
+        self._validate_changes(username, changes)
+        fields, values = await self._prepare_changes(changes)
+
+        try:
+            status = await self._execute(self.catalog.update_name(*fields), *values, username)
+            get_profile_cache().invalidate(username)
+            # asyncpg returns the command tag, e.g. "UPDATE 1".
+            affected = int(status.split()[-1])
+            if affected:
+                logger.info(f"Updated {', '.join(fields)} for user {username}")
+            else:
+                logger.warning(f"No user {username} to update {', '.join(fields)} for")
+            return affected
+        except Exception as e:
+            logger.error(f"Error updating {', '.join(fields)} for user {username}: {e}")
+        return None
+
+    @timed(DB_SECONDS, "update_fields_batch")
+    async def update_fields_batch(self, changes_by_user):
+        """
+        Applies many users' changes in one transaction, for back-office jobs.
+
+        ``changes_by_user`` maps usernames to ``{field: value}`` dicts. Users
+        changing the same set of fields are updated together by a single
+        statement. Returns a dict mapping each username to the number of rows
+        updated (0 for unknown users). All changes are validated before
+        anything is written, and a database error rolls back the whole batch.
+        """
+        groups = {}
+        for username, changes in changes_by_user.items():
+            self._validate_changes(username, changes)
+            fields, values = await self._prepare_changes(changes)
+            groups.setdefault(tuple(fields), []).append((username, values))
+
+        results = dict.fromkeys(changes_by_user, 0)
+        pool = await self._get_pool()
+        async with pool.acquire(timeout=self.settings.db_pool_timeout) as conn:
+            async with conn.transaction():
+                for fields, rows in groups.items():
+                    columns = [[username for username, _ in rows]]
+                    columns += [[values[i] for _, values in rows] for i in range(len(fields))]
+                    statement = self.catalog.statements["batch_" + self.catalog.update_name(*fields)]
+                    for record in await conn.fetch(statement, *columns):
+                        results[record["username"]] += 1
+
+        cache = get_profile_cache()
+        for username in changes_by_user:
+            cache.invalidate(username)
+        logger.info(
+            f"Batch update applied to {sum(1 for n in results.values() if n)} "
+            f"of {len(results)} users"
+        )
+        return results
+
+    @timed(DB_SECONDS, "create_user")
+    async def create_user(self, username, password, **kwargs):
+        """
+        Creates a new user with hashed password and optional fields.
+        """
+        if not username or not password:
+            logger.error("Username and password are required to create a user.")
+            raise ValueError("Username and password are required to create a user.")
+
+        hashed_pw = await get_hasher().hash(password)
+
+        all_fields = {
+            "username": username,
+            "password": hashed_pw,
+            "first_name": kwargs.get("first_name"),
+            "last_name": kwargs.get("last_name"),
+            "email": kwargs.get("email"),
+            "phone_number": kwargs.get("phone_number"),
+            "address": kwargs.get("address")
+        }
+
+        try:
+            await self._execute("insert_user", *[all_fields[column] for column in USER_COLUMNS])
+            get_profile_cache().invalidate(username)
+            logger.info(f"Created user {username}")
+        except Exception as e:
+            logger.error(f"Error creating user {username}: {e}")
+
+    @timed(DB_SECONDS, "get_user_email")
+    async def get_user_email(self, username):
+        """
+        Returns the email address for a given username.
+        """
+        try:
+            result = await self._fetchrow("select_email", username)
+            if result:
+                logger.info(f"Retrieved email for user {username}")
+                return result[0]
+        except Exception as e:
+            logger.error(f"Error retrieving email for user {username}: {e}")
+        return None
+
+    @timed(DB_SECONDS, "get_user_details")
+    async def get_user_details(self, username):
+        """
+        Returns all user details as a dictionary.
+        """
+        try:
+            row = await self._load_profile(username)
+            if row:
+                logger.info(f"Retrieved details for user {username}")
+                return row
+        except Exception as e:
+            logger.error(f"Error retrieving details for user {username}: {e}")
+        return None
+
+    def pool_stats(self):
+        """
+        Returns the size of the asyncpg pool, or an empty dict before it opens.
+        """
+        pool = self.pool
+        if pool is None:
+            return {}
+        return {"size": pool.get_size(), "idle": pool.get_idle_size(),
+                "min_size": pool.get_min_size(), "max_size": pool.get_max_size()}
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+            logger.info("Async database pool closed.")
+
+
+_async_db = None
+
+
+def get_async_db():
+    """Returns the process-wide AsyncDBService; its pool opens on first await."""
+    global _async_db
+    if _async_db is None:
+        _async_db = AsyncDBService()
+    return _async_db
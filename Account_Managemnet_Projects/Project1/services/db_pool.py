@@ -0,0 +1,212 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import ThreadedConnectionPool
+from services.logger import get_logger
+from services.settings import get_settings
+
+logger = get_logger()
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection could be checked out within the timeout."""
+
+
+class _PooledConnection(extensions.connection):
+    """psycopg2 connection that remembers the statements PREPAREd on it."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class _RetainingConnectionPool(ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool that keeps returned connections idle up to
+    ``maxconn``. psycopg2 closes any connection returned while ``minconn``
+    are already idle, which would make most checkouts reconnect; ``minconn``
+    here only controls how many connections are opened up front.
+    """
+
+    def _putconn(self, conn, key=None, close=False):
+        minconn = self.minconn
+        self.minconn = self.maxconn
+        try:
+            super()._putconn(conn, key, close)
+        finally:
+            self.minconn = minconn
+
+
+class DBPool:
+    """
+    Thread-safe pool of psycopg2 connections shared by every DBService.
+
+    Connections are borrowed with ``with pool.connection() as conn:`` and are
+    always returned, rolled back if a transaction was left open. The number of
+    concurrent checkouts is capped at ``maxconn``; callers wait up to
+    ``timeout`` seconds for a free slot instead of opening new connections.
+    """
+
+    def __init__(self, minconn, maxconn, timeout=5.0, health_check_idle=30.0, **conn_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_idle = health_check_idle
+        conn_kwargs.setdefault("connection_factory", _PooledConnection)
+        self._pool = _RetainingConnectionPool(minconn, maxconn, **conn_kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self._stats = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "discarded": 0,
+            "in_use": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+        }
+        logger.info(f"Database pool established (min={minconn}, max={maxconn}).")
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        # Freshly opened connections and recently used ones skip the round-trip.
+        if last_used is None or time.monotonic() - last_used < self.health_check_idle:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            logger.warning(f"Discarding unhealthy pooled connection: {e}")
+            return False
+
+    def _checkout(self):
+        # A pool of maxconn connections never needs more than maxconn attempts
+        # to either find a healthy connection or open a fresh one.
+        for _ in range(self.maxconn + 1):
+            conn = self._pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+        raise psycopg2.OperationalError("Could not obtain a healthy database connection.")
+
+    def _forget(self, conn):
+        self._last_used.pop(id(conn), None)
+
+    def _discard(self, conn):
+        self._forget(conn)
+        self._pool.putconn(conn, close=True)
+        with self._lock:
+            self._stats["discarded"] += 1
+
+    def _release(self, conn):
+        if conn.closed:
+            self._discard(conn)
+            return
+        try:
+            if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            self._discard(conn)
+            return
+        self._last_used[id(conn)] = time.monotonic()
+        self._pool.putconn(conn)
+        if conn.closed:
+            # psycopg2 closed it (e.g. lost server session); its id() may be
+            # reused by the next connection, so drop the bookkeeping now.
+            self._forget(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrows a connection from the pool and returns it on exit."""
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            logger.error(f"Timed out after {self.timeout}s waiting for a database connection.")
+            raise PoolTimeoutError(f"No database connection available within {self.timeout}s")
+
+        conn = None
+        try:
+            conn = self._checkout()
+            waited = time.perf_counter() - start
+            with self._lock:
+                self._stats["checkouts"] += 1
+                self._stats["in_use"] += 1
+                self._stats["wait_time_total"] += waited
+                self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+            try:
+                yield conn
+            finally:
+                with self._lock:
+                    self._stats["in_use"] -= 1
+                self._release(conn)
+        finally:
+            self._slots.release()
+
+    def prepared_statements(self, conn):
+        """
+        Returns the set of statement names already PREPAREd on ``conn``.
+        Prepared statements live as long as the server session, so the set
+        is kept on the connection object and dies with it.
+        """
+        return conn.prepared
+
+    def stats(self):
+        """Returns a snapshot of pool usage counters."""
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot["min_size"] = self.minconn
+        snapshot["max_size"] = self.maxconn
+        snapshot["idle"] = len(self._pool._pool)
+        snapshot["open"] = len(self._pool._pool) + len(self._pool._used)
+        return snapshot
+
+    def close(self):
+        self._pool.closeall()
+        self._last_used.clear()
+        logger.info("Database pool closed.")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                settings = get_settings()
+                try:
+                    _pool = DBPool(
+                        minconn=settings.db_pool_min_size,
+                        maxconn=settings.db_pool_max_size,
+                        timeout=settings.db_pool_timeout,
+                        health_check_idle=settings.db_pool_health_check_idle,
+                        dbname=settings.db_name,
+                        user=settings.db_user,
+                        password=settings.db_password,
+                        host=settings.db_host,
+                        port=settings.db_port,
+                        sslmode=settings.db_sslmode  # Enforces SSL/TLS connection for Google Cloud SQL
+                    )
+                except psycopg2.OperationalError as e:
+                    logger.error(f"Error: Could not connect to the database. {e}")
+                    raise
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -1,14 +1,26 @@
-import os
-import bcrypt
-import psycopg2
-from psycopg2 import sql
+import csv
+import io
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+
+from psycopg2 import errors, extensions
 from psycopg2.extras import DictCursor
-from dotenv import load_dotenv
 from services.logger import get_logger
+from services.db_pool import get_pool
+from services.queries import ALLOWED_UPDATE_FIELDS, USER_COLUMNS, get_catalog
+from services.hashing import get_hasher, hash_many
+from services.metrics import DB_SECONDS, timed
+from services.profile_cache import get_profile_cache
 
-# Load environment variables
-load_dotenv()
 logger = get_logger()
+
+# Background worker for rehash-on-login, and the users it is upgrading
+# (shared by all DBService instances) so repeated logins queue one rehash.
+_rehash_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rehash")
+_rehashing = set()
+_rehashing_lock = threading.Lock()
 '''
 class DBService:
     def __init__(self):
@@ -47,87 +59,243 @@ class DBService:
 
 '''
 class DBService:
-    def __init__(self):
+    def __init__(self, pool=None):
+        # Every DBService borrows from the same process-wide pool, so creating
+        # several instances no longer opens several connections.
+        self.pool = pool or get_pool()
+        self.catalog = get_catalog()
+
+    def _execute(self, conn, cursor, name, params):
+        """
+        Runs a catalog statement as a server-side prepared statement,
+        PREPAREing it the first time it is used on this connection.
+        """
+        prepared = self.pool.prepared_statements(conn)
+        starts_transaction = conn.get_transaction_status() == extensions.TRANSACTION_STATUS_IDLE
+        if name not in prepared:
+            cursor.execute(f"PREPARE {name} AS {self.catalog.statements[name]}")
+            prepared.add(name)
         try:
-            self.conn = psycopg2.connect(
-                dbname=os.getenv("DB_NAME"),
-                user=os.getenv("DB_USER"),
-                password=os.getenv("DB_PASSWORD"),
-                host=os.getenv("DB_HOST"),
-                port=os.getenv("DB_PORT", 5432),
-                sslmode="require"  # Enforces SSL/TLS connection for Google Cloud SQL
-            )
-            logger.info("Database connection established.")
-        except psycopg2.OperationalError as e:
-            logger.error(f"Error: Could not connect to the database. {e}")
-            raise
-    
+            cursor.execute(self.catalog.execute_sql[name], params)
+        except errors.InvalidSqlStatementName:
+            # The server lost the statement (e.g. DEALLOCATE ALL). Re-PREPARE
+            # when nothing else in the aborted transaction needs replaying.
+            prepared.discard(name)
+            if not starts_transaction:
+                raise
+            logger.warning(f"Prepared statement {name} missing on server; preparing it again")
+            conn.rollback()
+            cursor.execute(f"PREPARE {name} AS {self.catalog.statements[name]}")
+            prepared.add(name)
+            cursor.execute(self.catalog.execute_sql[name], params)
 
-    def verify_user(self, username, password):
+    def _password_matches(self, username, password, stored_password):
         """
-        Verifies a user by comparing the provided password with the stored hash.
+        Compares the provided password with the stored hash.
         Supports bcrypt hashes and plaintext fallback for legacy data.
         """
+        logger.info(f"Using verification with username and password for: {username}")
+        hasher = get_hasher()
+        matched = False
+        try:
+            if hasher.check_sync(password, stored_password):
+                logger.info(f"User verified with bcrypt: {username}")
+                matched = True
+        except ValueError:
+            logger.warning(f"Stored password for {username} is not a bcrypt hash. Trying plaintext match.")
+            if password == stored_password:
+                logger.warning(f"User verified with plaintext password: {username}")
+                matched = True
+        if matched and hasher.needs_rehash(stored_password):
+            with _rehashing_lock:
+                if username in _rehashing:
+                    return matched
+                _rehashing.add(username)
+            hasher.count("weak_hashes_seen")
+            _rehash_executor.submit(self._rehash, username, password, stored_password)
+        return matched
+
+    def _rehash(self, username, password, stored_password):
+        """
+        Upgrades a plaintext or under-cost password after a successful login.
+        Runs in the background so the login response does not wait for it.
+        """
+        hasher = get_hasher()
+        try:
+            hashed = hasher.hash_sync(password)
+            with self.pool.connection() as conn, conn.cursor() as cursor:
+                self._execute(conn, cursor, "rehash_password", (hashed, username, stored_password))
+                upgraded = cursor.rowcount
+                conn.commit()
+            if upgraded:
+                get_profile_cache().invalidate(username)
+                hasher.count("rehash_upgraded")
+                logger.info(f"Upgraded password hash for user {username} to cost {hasher.rounds}")
+        except Exception as e:
+            hasher.count("rehash_failed")
+            logger.error(f"Error upgrading password hash for user {username}: {e}")
+        finally:
+            with _rehashing_lock:
+                _rehashing.discard(username)
+
+    @timed(DB_SECONDS, "sync_count_weak_hashes")
+    def count_weak_hashes(self):
+        """
+        Returns how many stored passwords are still plaintext or hashed
+        below the configured bcrypt cost.
+        """
+        with self.pool.connection() as conn, conn.cursor(cursor_factory=DictCursor) as cursor:
+            self._execute(conn, cursor, "count_weak_hashes", (get_hasher().rounds,))
+            return dict(cursor.fetchone())
+
+    def _load_profile(self, username):
+        """
+        Returns the user row without the password hash, from the profile
+        cache when possible.
+        """
+        cache = get_profile_cache()
+        profile = cache.get(username)
+        if profile is not None:
+            return profile
+        with self.pool.connection() as conn, conn.cursor(cursor_factory=DictCursor) as cursor:
+            self._execute(conn, cursor, "select_profile", (username,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        profile = dict(row)
+        cache.set(username, profile)
+        profile.pop("password", None)
+        return profile
+
+    @timed(DB_SECONDS, "sync_authenticate")
+    def authenticate(self, username, password):
+        """
+        Verifies the credentials and returns the user's full row. Needs a
+        single query instead of verify_user followed by get_user_details;
+        the row is always read from the database, never from the profile
+        cache, and refreshes the cached profile.
+        """
         try:
-            with self.conn.cursor(cursor_factory=DictCursor) as cursor:
-                cursor.execute(
-                    sql.SQL("SELECT username, password FROM {} WHERE username = %s").format(
-                        sql.Identifier(os.getenv("DB_TABLE_NAME"))
-                    ),
-                    (username,)
-                )
-                user_record = cursor.fetchone()
-                if user_record:
-                    stored_password = user_record["password"]
-                    logger.info(f"Using verification with username and password for: {username}")
-                    try:
-                        if bcrypt.checkpw(password.encode('utf-8'), stored_password.encode('utf-8')):
-                            logger.info(f"User verified with bcrypt: {username}")
-                            return {"username": username}
-                    except ValueError:
-                        logger.warning(f"Stored password for {username} is not a bcrypt hash. Trying plaintext match.")
-                        if password == stored_password:
-                            logger.warning(f"User verified with plaintext password: {username}")
-                            return {"username": username}
+            with self.pool.connection() as conn, conn.cursor(cursor_factory=DictCursor) as cursor:
+                self._execute(conn, cursor, "select_profile", (username,))
+                row = cursor.fetchone()
+            # The connection is back in the pool before bcrypt runs.
+            if row and self._password_matches(username, password, row["password"]):
+                profile = dict(row)
+                get_profile_cache().set(username, profile)
+                return profile
         except Exception as e:
             logger.error(f"Error verifying user {username}: {e}")
 
         logger.warning(f"Invalid credentials for user: {username}")
         return None
 
+    @timed(DB_SECONDS, "sync_verify_user")
+    def verify_user(self, username, password):
+        """
+        Verifies a user by comparing the provided password with the stored hash.
+        Supports bcrypt hashes and plaintext fallback for legacy data.
+        """
+        if self.authenticate(username, password):
+            return {"username": username}
+        return None
+
     # ------------- END verify_user
 
 
+    def _validate_changes(self, username, changes):
+        if not changes:
+            logger.error(f"No fields to update for user {username}")
+            raise ValueError(f"No fields to update for user {username}")
+        for field in changes:
+            if field not in ALLOWED_UPDATE_FIELDS:
+                logger.error(f"Invalid field specified: {field}")
+                raise ValueError(f"Invalid field specified: {field}")
+
+    def _prepare_changes(self, changes):
+        """
+        Returns the catalog field order and values, with passwords hashed.
+        """
+        fields = [field for field in ALLOWED_UPDATE_FIELDS if field in changes]
+        values = [
+            get_hasher().hash_sync(changes[field]) if field == "password" else changes[field]
+            for field in fields
+        ]
+        return fields, values
+
+    @timed(DB_SECONDS, "sync_update_field")
     def update_field(self, username, field, value):
         """
         Updates a single allowed field for a user.
+        Returns True only if a row was actually updated.
+        """
+        return bool(self.update_fields(username, {field: value}))
+
+    @timed(DB_SECONDS, "sync_update_fields")
+    def update_fields(self, username, changes):
         """
-        allowed_fields = ["email", "password", "phone_number", "address"]
-        if field not in allowed_fields:
-            logger.error(f"Invalid field specified: {field}")
-            raise ValueError(f"Invalid field specified: {field}")
+        Updates several allowed fields for a user in a single UPDATE.
 
-        if field == "password":
-            hashed_pw = bcrypt.hashpw(value.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-            value_to_update = hashed_pw
-        else:
-            value_to_update = value
+        ``changes`` maps field names to new values; a password is hashed
+        before it is stored. Returns the number of rows updated (0 if the user
+        does not exist), or None if the update failed.
+        """
+        self._validate_changes(username, changes)
+        fields, values = self._prepare_changes(changes)
 
         try:
-            with self.conn.cursor() as cursor:
-                query = sql.SQL("UPDATE {table} SET {column} = %s WHERE username = %s").format(
-                    table=sql.Identifier(os.getenv("DB_TABLE_NAME")),
-                    column=sql.Identifier(field)
-                )
-                cursor.execute(query, (value_to_update, username))
-                self.conn.commit()
-                logger.info(f"Updated {field} for user {username}")
-                return True
+            with self.pool.connection() as conn, conn.cursor() as cursor:
+                self._execute(conn, cursor, self.catalog.update_name(*fields), (*values, username))
+                affected = cursor.rowcount
+                conn.commit()
+                get_profile_cache().invalidate(username)
+                if affected:
+                    logger.info(f"Updated {', '.join(fields)} for user {username}")
+                else:
+                    logger.warning(f"No user {username} to update {', '.join(fields)} for")
+                return affected
         except Exception as e:
-            logger.error(f"Error updating {field} for user {username}: {e}")
+            logger.error(f"Error updating {', '.join(fields)} for user {username}: {e}")
             #return False
-            self.conn.rollback()
+        return None
+
+    @timed(DB_SECONDS, "sync_update_fields_batch")
+    def update_fields_batch(self, changes_by_user):
+        """
+        Applies many users' changes in one transaction, for back-office jobs.
+
+        ``changes_by_user`` maps usernames to ``{field: value}`` dicts. Users
+        changing the same set of fields are updated together by a single
+        statement. Returns a dict mapping each username to the number of rows
+        updated (0 for unknown users). All changes are validated before
+        anything is written, and a database error rolls back the whole batch.
+        """
+        groups = {}
+        for username, changes in changes_by_user.items():
+            self._validate_changes(username, changes)
+            fields, values = self._prepare_changes(changes)
+            groups.setdefault(tuple(fields), []).append((username, values))
+
+        results = dict.fromkeys(changes_by_user, 0)
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            for fields, rows in groups.items():
+                columns = [[username for username, _ in rows]]
+                columns += [[values[i] for _, values in rows] for i in range(len(fields))]
+                self._execute(conn, cursor, "batch_" + self.catalog.update_name(*fields), columns)
+                for (username,) in cursor.fetchall():
+                    results[username] += 1
+            conn.commit()
+
+        cache = get_profile_cache()
+        for username in changes_by_user:
+            cache.invalidate(username)
+        logger.info(
+            f"Batch update applied to {sum(1 for n in results.values() if n)} "
+            f"of {len(results)} users"
+        )
+        return results
 
+    @timed(DB_SECONDS, "sync_create_user")
     def create_user(self, username, password, **kwargs):
         """
         Creates a new user with hashed password and optional fields.
@@ -136,7 +304,7 @@ class DBService:
             logger.error("Username and password are required to create a user.")
             raise ValueError("Username and password are required to create a user.")
 
-        hashed_pw = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        hashed_pw = get_hasher().hash_sync(password)
 
         all_fields = {
             "username": username,
@@ -148,37 +316,106 @@ class DBService:
             "address": kwargs.get("address")
         }
 
-        columns = list(all_fields.keys())
-        values = list(all_fields.values())
+        values = [all_fields[column] for column in USER_COLUMNS]
 
         try:
-            with self.conn.cursor() as cursor:
-                query = sql.SQL(
-                    "INSERT INTO {table} ({fields}) VALUES ({placeholders})"
-                ).format(
-                    table=sql.Identifier(os.getenv("DB_TABLE_NAME")),
-                    fields=sql.SQL(", ").join(map(sql.Identifier, columns)),
-                    placeholders=sql.SQL(", ").join(sql.Placeholder() * len(columns))
-                )
-                cursor.execute(query, values)
-                self.conn.commit()
+            with self.pool.connection() as conn, conn.cursor() as cursor:
+                self._execute(conn, cursor, "insert_user", values)
+                conn.commit()
+                get_profile_cache().invalidate(username)
                 logger.info(f"Created user {username}")
         except Exception as e:
             logger.error(f"Error creating user {username}: {e}")
-            self.conn.rollback()
 
+    @timed(DB_SECONDS, "sync_create_users_bulk")
+    def create_users_bulk(self, records, chunk_size=5000, rounds=None, max_workers=None, accept_hashes=False):
+        """
+        Creates many users at once, e.g. when migrating a legacy customer base.
+
+        ``records`` is an iterable of dicts with the create_user fields and an
+        optional ``line`` used in the report. Passwords are hashed on a process
+        pool while the previous chunk is loaded with COPY, and each chunk is
+        inserted in its own transaction. Duplicate usernames and invalid rows
+        (including records carrying a ``parse_error``) are reported per row
+        instead of aborting the batch. ``rounds`` defaults to the hasher's
+        cost; ``accept_hashes`` loads bcrypt-formatted passwords unchanged.
+
+        Returns a dict with the ``inserted`` count and ``conflicts``/``errors``
+        lists of {"line", "username", "reason"} entries.
+        """
+        report = {"inserted": 0, "conflicts": [], "errors": []}
+        rounds = rounds or get_hasher().rounds
+        records = iter(records)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            previous = None
+            while True:
+                chunk = list(islice(records, chunk_size))
+                if not chunk:
+                    break
+                rows = []
+                for record in chunk:
+                    if record.get("parse_error"):
+                        report["errors"].append(self._bulk_entry(record, record["parse_error"]))
+                    elif record.get("username") and record.get("password"):
+                        rows.append(record)
+                    else:
+                        report["errors"].append(self._bulk_entry(record, "Username and password are required to create a user."))
+                hashes = hash_many(executor, [str(record["password"]) for record in rows], rounds,
+                                   accept_hashes=accept_hashes)
+                # Load the previous chunk while this one is being hashed.
+                if previous:
+                    self._load_bulk_chunk(*previous, report)
+                previous = (rows, hashes)
+            if previous:
+                self._load_bulk_chunk(*previous, report)
+
+        logger.info(
+            f"Bulk create finished: {report['inserted']} inserted, "
+            f"{len(report['conflicts'])} conflicts, {len(report['errors'])} errors"
+        )
+        return report
+
+    @staticmethod
+    def _bulk_entry(record, reason):
+        return {"line": record.get("line"), "username": record.get("username"), "reason": reason}
+
+    def _load_bulk_chunk(self, rows, hashes, report):
+        if not rows:
+            return
+        statements = self.catalog.bulk_statements
+        try:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for record, hashed in zip(rows, hashes):
+                writer.writerow([hashed if column == "password" else record.get(column) for column in USER_COLUMNS])
+            buffer.seek(0)
+            with self.pool.connection() as conn, conn.cursor() as cursor:
+                cursor.execute(statements["create_stage"])
+                cursor.copy_expert(statements["copy_stage"], buffer)
+                cursor.execute(statements["insert_from_stage"])
+                inserted = Counter(row[0] for row in cursor.fetchall())
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Error loading bulk chunk of {len(rows)} users: {e}")
+            report["errors"].extend(self._bulk_entry(record, str(e)) for record in rows)
+            return
+
+        for record in rows:
+            username = record["username"]
+            if inserted[username] > 0:
+                inserted[username] -= 1
+                report["inserted"] += 1
+            else:
+                report["conflicts"].append(self._bulk_entry(record, "Username already exists."))
+
+    @timed(DB_SECONDS, "sync_get_user_email")
     def get_user_email(self, username):
         """
         Returns the email address for a given username.
         """
         try:
-            with self.conn.cursor() as cursor:
-                cursor.execute(
-                    sql.SQL("SELECT email FROM {} WHERE username = %s").format(
-                        sql.Identifier(os.getenv("DB_TABLE_NAME"))
-                    ),
-                    (username,)
-                )
+            with self.pool.connection() as conn, conn.cursor() as cursor:
+                self._execute(conn, cursor, "select_email", (username,))
                 result = cursor.fetchone()
                 if result:
                     logger.info(f"Retrieved email for user {username}")
@@ -187,28 +424,27 @@ class DBService:
             logger.error(f"Error retrieving email for user {username}: {e}")
         return None
 
+    @timed(DB_SECONDS, "sync_get_user_details")
     def get_user_details(self, username):
         """
         Returns all user details as a dictionary.
         """
         try:
-            with self.conn.cursor(cursor_factory=DictCursor) as cursor:
-                cursor.execute(
-                    sql.SQL("SELECT * FROM {} WHERE username = %s").format(
-                        sql.Identifier(os.getenv("DB_TABLE_NAME"))
-                    ),
-                    (username,)
-                )
-                row = cursor.fetchone()
-                if row:
-                    logger.info(f"Retrieved details for user {username}")
-                    return dict(row)
+            row = self._load_profile(username)
+            if row:
+                logger.info(f"Retrieved details for user {username}")
+                return row
         except Exception as e:
             logger.error(f"Error retrieving details for user {username}: {e}")
         return None
 
+    def pool_stats(self):
+        """
+        Returns checkout, wait-time and size counters of the shared pool.
+        """
+        return self.pool.stats()
+
     def close(self):
-        if self.conn:
-            self.conn.close()
-            logger.info("Database connection closed.")
+        # The pool is shared by the whole process; see services.db_pool.close_pool.
+        logger.info("DBService released; shared pool stays open.")
 
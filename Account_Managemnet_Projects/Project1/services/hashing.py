@@ -0,0 +1,296 @@
+import os
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from services.settings import load_env
+from services.logger import get_logger
+from services.metrics import BCRYPT_SECONDS
+
+# Load environment variables
+load_env()
+logger = get_logger()
+
+
+class HasherBusyError(Exception):
+    """Raised when more hashing jobs are queued than HASH_POOL_MAX_PENDING allows."""
+
+
+# Worker functions live at module level so a process pool can pickle them.
+# Each returns its result together with the CPU time spent in the worker.
+def _hashpw(password, rounds):
+    start = time.perf_counter()
+    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+    return hashed, time.perf_counter() - start
+
+
+def _checkpw(password, stored_password):
+    start = time.perf_counter()
+    matched = bcrypt.checkpw(password.encode('utf-8'), stored_password.encode('utf-8'))
+    return matched, time.perf_counter() - start
+
+
+def _hashpw_rounds(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def is_bcrypt_hash(value):
+    return value.startswith(("$2a$", "$2b$", "$2y$")) and len(value) == 60
+
+
+def _time_hash(rounds):
+    start = time.perf_counter()
+    bcrypt.hashpw(b"calibration-probe", bcrypt.gensalt(rounds))
+    return time.perf_counter() - start
+
+
+def calibrate_rounds(target_ms, min_rounds=10, max_rounds=16):
+    """
+    Returns the highest bcrypt cost whose hash time on this machine stays
+    within ``target_ms``. Each extra round doubles the work, so one probe at
+    ``min_rounds`` predicts the others and the chosen cost is checked once.
+    """
+    target = target_ms / 1000
+    probe = min(_time_hash(min_rounds), _time_hash(min_rounds))
+    rounds = min_rounds
+    while rounds < max_rounds and probe * 2 ** (rounds + 1 - min_rounds) <= target:
+        rounds += 1
+    if rounds > min_rounds and _time_hash(rounds) > target:
+        rounds -= 1
+    logger.info(f"Calibrated bcrypt cost {rounds} for a {target_ms} ms target (probe {probe * 1000:.1f} ms at cost {min_rounds}).")
+    return rounds
+
+
+CALIBRATION_TABLE = """CREATE TABLE IF NOT EXISTS bcrypt_calibration (
+    target_ms DOUBLE PRECISION PRIMARY KEY,
+    rounds INTEGER NOT NULL,
+    calibrated_at TIMESTAMPTZ NOT NULL DEFAULT now())"""
+
+
+def shared_calibration(target_ms, pool=None):
+    """
+    Returns the bcrypt cost for ``target_ms`` shared by every worker: the
+    first worker to calibrate stores its result in the database and all
+    later ones read it, so workers never disagree about the cost and
+    rehash each other's hashes. Delete the row to recalibrate (e.g. after
+    moving to different hardware). Falls back to calibrating locally if
+    the database cannot be reached. Blocking.
+    """
+    try:
+        from services.db_pool import get_pool
+
+        pool = pool or get_pool()
+        with pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(CALIBRATION_TABLE)
+            cursor.execute("SELECT rounds FROM bcrypt_calibration WHERE target_ms = %s", (target_ms,))
+            row = cursor.fetchone()
+            conn.commit()
+        if row is not None:
+            logger.info(f"Using stored bcrypt cost {row[0]} for a {target_ms} ms target.")
+            return row[0]
+        rounds = calibrate_rounds(target_ms)
+        with pool.connection() as conn, conn.cursor() as cursor:
+            # Another worker may have stored its result meanwhile; its value wins.
+            cursor.execute(
+                "INSERT INTO bcrypt_calibration (target_ms, rounds) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                (target_ms, rounds),
+            )
+            cursor.execute("SELECT rounds FROM bcrypt_calibration WHERE target_ms = %s", (target_ms,))
+            rounds = cursor.fetchone()[0]
+            conn.commit()
+        return rounds
+    except Exception as e:
+        logger.warning(f"Could not share the bcrypt calibration, calibrating locally: {e}")
+        return calibrate_rounds(target_ms)
+
+
+def hash_many(executor, passwords, rounds=12, chunksize=64, accept_hashes=False):
+    """
+    Submits a batch of passwords to a process pool and returns an iterator of
+    hashes in input order. The work is queued immediately, so the caller can
+    do other I/O while it runs. With ``accept_hashes``, values that are
+    already bcrypt hashes are kept as-is, so exports from systems that hash
+    passwords are not hashed twice; otherwise every value is hashed. Meant
+    for bulk jobs; request handling goes through PasswordHasher.
+    """
+    passwords = list(passwords)
+    keep = [accept_hashes and is_bcrypt_hash(value) for value in passwords]
+    pending = [value for value, kept in zip(passwords, keep) if not kept]
+    results = executor.map(_hashpw_rounds, pending, [rounds] * len(pending), chunksize=chunksize)
+    return (value if kept else next(results) for value, kept in zip(passwords, keep))
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification on a bounded worker pool.
+
+    ``hash``/``check`` are awaitable for the FastAPI path, ``hash_sync`` and
+    ``check_sync`` block the calling thread for scripts. At most
+    ``max_workers`` hashes run at once; beyond ``max_pending`` queued jobs new
+    work is rejected with HasherBusyError instead of growing the queue.
+    New hashes use ``rounds``; ``needs_rehash`` flags stored values that
+    should be upgraded to it. A hasher created with ``settled=False`` is
+    waiting for ``set_rounds`` (see calibrate_hasher) and upgrades no bcrypt
+    hashes until then, so a provisional cost never triggers rehashing.
+    """
+
+    def __init__(self, max_workers=None, max_pending=256, use_processes=False, rounds=12, settled=True):
+        self.rounds = rounds
+        self.settled = settled
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.use_processes = use_processes
+        if use_processes:
+            # Imported here: multiprocessing adds noticeably to app start-up.
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            # bcrypt releases the GIL while hashing, so threads scale across cores.
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "rejected": 0,
+            "in_flight": 0,
+            "work_time_total": 0.0,
+            "latency_total": 0.0,
+            "latency_max": 0.0,
+            "weak_hashes_seen": 0,
+            "rehash_upgraded": 0,
+            "rehash_failed": 0,
+        }
+
+    def _submit(self, operation, fn, *args):
+        with self._lock:
+            if self._stats["in_flight"] >= self.max_pending:
+                self._stats["rejected"] += 1
+                raise HasherBusyError(f"Password hashing queue is full ({self.max_pending} pending)")
+            self._stats["submitted"] += 1
+            self._stats["in_flight"] += 1
+        submitted_at = time.perf_counter()
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda f: self._record(f, submitted_at, operation))
+        return future
+
+    def _record(self, future, submitted_at, operation):
+        latency = time.perf_counter() - submitted_at
+        work_time = 0.0
+        if not future.cancelled() and future.exception() is None:
+            work_time = future.result()[1]
+            BCRYPT_SECONDS.observe(work_time, operation)
+        with self._lock:
+            self._stats["in_flight"] -= 1
+            self._stats["completed"] += 1
+            self._stats["work_time_total"] += work_time
+            self._stats["latency_total"] += latency
+            self._stats["latency_max"] = max(self._stats["latency_max"], latency)
+
+    def set_rounds(self, rounds):
+        """Sets the final cost for new hashes and enables rehashing below it."""
+        self.rounds = rounds
+        self.settled = True
+
+    def needs_rehash(self, stored_password):
+        """
+        True for plaintext legacy values and, once the cost is settled,
+        bcrypt hashes below it.
+        """
+        if not is_bcrypt_hash(stored_password):
+            return True
+        return self.settled and int(stored_password[4:6]) < self.rounds
+
+    def count(self, name):
+        """Increments one of the rehash counters reported by stats()."""
+        with self._lock:
+            self._stats[name] += 1
+
+    async def hash(self, password):
+        """Returns a bcrypt hash of ``password`` without blocking the event loop."""
+        result, _ = await asyncio.wrap_future(self._submit("hash", _hashpw, password, self.rounds))
+        return result
+
+    async def check(self, password, stored_password):
+        """
+        Returns True if ``password`` matches ``stored_password``.
+        Raises ValueError if the stored value is not a bcrypt hash.
+        """
+        result, _ = await asyncio.wrap_future(self._submit("check", _checkpw, password, stored_password))
+        return result
+
+    def hash_sync(self, password):
+        return self._submit("hash", _hashpw, password, self.rounds).result()[0]
+
+    def check_sync(self, password, stored_password):
+        return self._submit("check", _checkpw, password, stored_password).result()[0]
+
+    def stats(self):
+        """Returns queue depth, throughput and latency counters."""
+        with self._lock:
+            snapshot = dict(self._stats)
+        completed = snapshot["completed"] or 1
+        snapshot["max_workers"] = self.max_workers
+        snapshot["rounds"] = self.rounds
+        snapshot["settled"] = int(self.settled)
+        snapshot["queue_depth"] = max(0, snapshot["in_flight"] - self.max_workers)
+        snapshot["latency_avg"] = snapshot["latency_total"] / completed
+        snapshot["work_time_avg"] = snapshot["work_time_total"] / completed
+        return snapshot
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+_calibration_lock = threading.Lock()
+
+
+def get_hasher():
+    """
+    Returns the process-wide PasswordHasher configured from HASH_POOL_* settings.
+    Never calibrates: with HASH_TARGET_MS (and no HASH_ROUNDS) it starts at
+    cost 12, unsettled, until calibrate_hasher() runs.
+    """
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                max_workers = int(os.getenv("HASH_POOL_WORKERS", 0)) or None
+                fixed = os.getenv("HASH_ROUNDS")
+                _hasher = PasswordHasher(
+                    max_workers=max_workers,
+                    max_pending=int(os.getenv("HASH_POOL_MAX_PENDING", 256)),
+                    use_processes=os.getenv("HASH_POOL_KIND", "thread") == "process",
+                    rounds=int(fixed) if fixed else 12,
+                    settled=bool(fixed) or not os.getenv("HASH_TARGET_MS"),
+                )
+                logger.info(f"Password hasher started with {_hasher.max_workers} workers at bcrypt cost {_hasher.rounds}.")
+    return _hasher
+
+
+def calibrate_hasher():
+    """
+    Settles the process-wide hasher's cost when HASH_TARGET_MS is set and
+    HASH_ROUNDS is not, using the cost shared through the database (see
+    shared_calibration). Blocking: the app runs it in its start-up warm-up
+    off the event loop, scripts call it before hashing. Returns the cost.
+    """
+    hasher = get_hasher()
+    with _calibration_lock:
+        if not hasher.settled:
+            hasher.set_rounds(shared_calibration(float(os.getenv("HASH_TARGET_MS"))))
+            logger.info(f"Password hasher settled at bcrypt cost {hasher.rounds}.")
+    return hasher.rounds
+
+
+def close_hasher():
+    """Stops the hasher's workers, if it was started."""
+    global _hasher
+    with _hasher_lock:
+        if _hasher is not None:
+            _hasher.close()
+            _hasher = None
@@ -1,12 +1,27 @@
+import atexit
+import contextvars
+import gzip
 import logging
-import sys
+import logging.handlers
 import os
+import queue
+import re
+import shutil
+import sys
+import threading
+import time
+from collections import OrderedDict
 # logger_util.py
 
-import logging
-import sys
-import os
-from datetime import datetime
+
+# Session id of the request being handled. asyncio tasks copy the context,
+# so each request routes its records to its own file.
+session_id_var = contextvars.ContextVar("session_id", default=None)
+
+LOG_DIR = "logs"
+FILE_FORMAT = "%(asctime)s - %(name)s - %(levelname)-8s - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
 
 
 class ColorFormatter(logging.Formatter):
@@ -27,39 +42,363 @@ class ColorFormatter(logging.Formatter):
         logging.CRITICAL: BOLD_RED + format_str + RESET,
     }
 
+    FORMATTERS = {level: logging.Formatter(fmt, datefmt=DATE_FORMAT) for level, fmt in FORMATS.items()}
+    DEFAULT_FORMATTER = logging.Formatter(format_str, datefmt=DATE_FORMAT)
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno, self.format_str)
-        formatter = logging.Formatter(log_fmt, datefmt="%Y-%m-%d %H:%M:%S")
-        return formatter.format(record)
+        return self.FORMATTERS.get(record.levelno, self.DEFAULT_FORMATTER).format(record)
 
-def setup_logger(session_id: str):
-    """Initializes the logger for the app with both console and file output."""
-    logger = logging.getLogger('adk_app')
-    logger.setLevel(logging.INFO)
-    logger.propagate = False
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    if logger.hasHandlers():
+
+class SessionContextFilter(logging.Filter):
+    """Stamps each record with the session id of the request that logged it."""
+
+    def filter(self, record):
+        record.session_id = session_id_var.get()
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that drops records instead of blocking when the queue is
+    full, so a slow disk can never stall request handling.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class SessionFileHandler(logging.Handler):
+    """
+    Writes each record to logs/{session_id}_app.log, or logs/app.log for
+    records logged outside a session. Runs on the listener thread only.
+
+    At most ``max_open`` files are kept open; the least recently used one is
+    closed when another session needs a handle, and LogMaintenance closes
+    handles idle for ``idle_close`` seconds. A file is rotated to
+    ``<name>.<timestamp>`` once it reaches ``max_bytes`` or has been open
+    for ``max_age`` seconds (0 disables either check).
+    """
+
+    def __init__(self, log_dir=LOG_DIR, max_open=128, idle_close=300.0, max_bytes=10 * 1024 * 1024, max_age=86400.0):
+        super().__init__()
+        self.log_dir = log_dir
+        self.max_open = max_open
+        self.idle_close = idle_close
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.formatter = logging.Formatter(FILE_FORMAT, datefmt=DATE_FORMAT)
+        # session_id -> [FileHandler, last_used, opened_at], oldest first
+        self._handlers = OrderedDict()
+        self._stats = {"opened": 0, "evicted": 0, "idle_closed": 0, "rotated": 0}
+        os.makedirs(log_dir, exist_ok=True)
+
+    def path_for(self, session_id):
+        name = f"{session_id}_app.log" if session_id else "app.log"
+        return os.path.join(self.log_dir, name)
+
+    def _handler_for(self, session_id, now):
+        entry = self._handlers.get(session_id)
+        if entry is not None:
+            self._handlers.move_to_end(session_id)
+            return entry
+        if len(self._handlers) >= self.max_open:
+            _, (oldest, _, _) = self._handlers.popitem(last=False)
+            oldest.close()
+            self._stats["evicted"] += 1
+        handler = logging.FileHandler(self.path_for(session_id), mode="a")
+        handler.setFormatter(self.formatter)
+        entry = [handler, now, time.time()]
+        self._handlers[session_id] = entry
+        self._stats["opened"] += 1
+        return entry
+
+    def emit(self, record):
+        try:
+            session_id = getattr(record, "session_id", None)
+            entry = self._handler_for(session_id, time.monotonic())
+            handler = entry[0]
+            handler.emit(record)
+            entry[1] = time.monotonic()
+            if (self.max_bytes and handler.stream.tell() >= self.max_bytes) or (
+                self.max_age and time.time() - entry[2] >= self.max_age
+            ):
+                self._rotate(session_id)
+        except Exception:
+            self.handleError(record)
+
+    def _rotate(self, session_id):
+        handler, _, _ = self._handlers.pop(session_id)
+        handler.close()
+        rotate_file(handler.baseFilename)
+        self._stats["rotated"] += 1
+
+    def close_idle(self):
+        """Closes handles unused for ``idle_close`` seconds. Returns how many were closed."""
+        cutoff = time.monotonic() - self.idle_close
+        with self.lock:
+            idle = [sid for sid, (_, last_used, _) in self._handlers.items() if last_used < cutoff]
+            for session_id in idle:
+                self._handlers.pop(session_id)[0].close()
+            self._stats["idle_closed"] += len(idle)
+        return len(idle)
+
+    def rotate_if_closed(self, path):
+        """
+        Renames ``path`` to a rotated segment unless a session is writing to
+        it. Holding the handler lock means a record arriving meanwhile opens
+        a fresh file instead of writing to the renamed one.
+        """
+        with self.lock:
+            path = os.path.abspath(path)
+            if any(entry[0].baseFilename == path for entry in self._handlers.values()):
+                return None
+            return rotate_file(path)
+
+    def stats(self):
+        with self.lock:
+            snapshot = dict(self._stats)
+            snapshot["open_handles"] = len(self._handlers)
+        snapshot["max_open"] = self.max_open
+        return snapshot
+
+    def close(self):
+        with self.lock:
+            for handler, _, _ in self._handlers.values():
+                handler.close()
+            self._handlers.clear()
+        super().close()
+
+
+def rotate_file(path):
+    """Renames a log file to ``<path>.<timestamp>`` and returns the new path."""
+    rotated = f"{path}.{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 1_000_000_000:09d}"
+    try:
+        os.rename(path, rotated)
+    except FileNotFoundError:
+        return None
+    return rotated
+
+
+class LogMaintenance:
+    """
+    Background thread that keeps the log directory bounded: every
+    ``interval`` seconds it closes idle session handles, rotates files that
+    have not been written for ``compress_after`` seconds, gzips rotated
+    segments, and deletes logs older than ``retention_days``. The last scan's
+    file count and disk usage are reported by stats().
+    """
+
+    def __init__(self, handler, interval=60.0, compress_after=3600.0, retention_days=7.0):
+        self.handler = handler
+        self.interval = interval
+        self.compress_after = compress_after
+        self.retention = retention_days * 86400
+        self._lock = threading.Lock()
+        self._stats = {"compressed": 0, "pruned": 0, "files": 0, "disk_bytes": 0, "last_run": None}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="log-maintenance", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                get_logger().error(f"Log maintenance failed: {e}", exc_info=True)
+
+    def run_once(self):
+        self.handler.close_idle()
+        now = time.time()
+        compressed = pruned = files = disk_bytes = 0
+        with os.scandir(self.handler.log_dir) as entries:
+            paths = [entry.path for entry in entries if entry.is_file() and ".log" in entry.name]
+        for path in paths:
+            try:
+                age = now - os.path.getmtime(path)
+                if path.endswith(".log"):
+                    cold = self.compress_after and age >= self.compress_after
+                    expired = self.retention and age > self.retention
+                    if cold or expired:
+                        # Live files are only touched once no session holds them open.
+                        path = self.handler.rotate_if_closed(path) or path
+                    if path.endswith(".log"):
+                        files += 1
+                        disk_bytes += os.path.getsize(path)
+                        continue
+                if self.retention and age > self.retention:
+                    os.remove(path)
+                    pruned += 1
+                    continue
+                if not path.endswith(".gz"):
+                    path = compress_file(path)
+                    compressed += 1
+                files += 1
+                disk_bytes += os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+        with self._lock:
+            self._stats["compressed"] += compressed
+            self._stats["pruned"] += pruned
+            self._stats["files"] = files
+            self._stats["disk_bytes"] = disk_bytes
+            self._stats["last_run"] = now
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+def compress_file(path):
+    """Gzips ``path`` to ``path.gz``, keeping its mtime, and removes the original."""
+    target = path + ".gz"
+    with open(path, "rb") as src, gzip.open(target, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    mtime = os.path.getmtime(path)
+    os.utime(target, (mtime, mtime))
+    os.remove(path)
+    return target
+
+
+_listener = None
+_queue_handler = None
+_file_handler = None
+_maintenance = None
+_configure_lock = threading.Lock()
+
+
+def configure_logging():
+    """
+    Configures the 'adk_app' logger once per process: records are queued by
+    the calling thread and written to console and per-session files by a
+    background listener thread.
+    """
+    global _listener, _queue_handler, _file_handler, _maintenance
+    if _listener is not None:
+        return
+    with _configure_lock:
+        if _listener is not None:
+            return
+        logger = logging.getLogger('adk_app')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
         logger.handlers.clear()
 
-    # Create logs directory
-    log_dir = "logs"
-    os.makedirs(log_dir, exist_ok=True)
-
-    # Console Handler with colors
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(ColorFormatter())
-    logger.addHandler(console_handler)
-
-    # File Handler
-    log_path = os.path.join(log_dir, f"{session_id}_app.log")
-    file_handler = logging.FileHandler(log_path, mode="a")
-    file_formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)-8s - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S"
-    )
-    file_handler.setFormatter(file_formatter)
-    logger.addHandler(file_handler)
+        log_queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", 10000)))
+        _queue_handler = NonBlockingQueueHandler(log_queue)
+        _queue_handler.addFilter(SessionContextFilter())
+        logger.addHandler(_queue_handler)
+
+        # Console Handler with colors
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(ColorFormatter())
+
+        _file_handler = SessionFileHandler(
+            max_open=int(os.getenv("LOG_MAX_OPEN_FILES", 128)),
+            idle_close=float(os.getenv("LOG_IDLE_CLOSE_SECONDS", 300)),
+            max_bytes=int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+            max_age=float(os.getenv("LOG_ROTATE_SECONDS", 86400)),
+        )
+        _listener = logging.handlers.QueueListener(
+            log_queue, console_handler, _file_handler, respect_handler_level=True
+        )
+        _listener.start()
+        _maintenance = LogMaintenance(
+            _file_handler,
+            interval=float(os.getenv("LOG_MAINTENANCE_INTERVAL", 60)),
+            compress_after=float(os.getenv("LOG_COMPRESS_AFTER_SECONDS", 3600)),
+            retention_days=float(os.getenv("LOG_RETENTION_DAYS", 7)),
+        )
+        _maintenance.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flushes queued records and closes every log file."""
+    global _listener, _maintenance
+    with _configure_lock:
+        if _listener is None:
+            return
+        _maintenance.stop()
+        _maintenance = None
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def setup_logger(session_id: str):
+    """Routes the current request's log records to logs/{session_id}_app.log."""
+    configure_logging()
+    session_id_var.set(session_id)
+
 
 def get_logger():
     """Returns the configured logger."""
     return logging.getLogger("adk_app")
+
+
+def dropped_records():
+    """Number of records dropped because the log queue was full."""
+    return _queue_handler.dropped if _queue_handler else 0
+
+
+def log_stats():
+    """
+    Open session file handles, rotation/compression/pruning counters and
+    the log directory's file count and disk usage as of the last
+    maintenance run.
+    """
+    if _file_handler is None:
+        return {}
+    snapshot = _file_handler.stats()
+    if _maintenance is not None:
+        snapshot.update(_maintenance.stats())
+    snapshot["dropped_records"] = dropped_records()
+    return snapshot
+
+
+def read_session_log(session_id, offset=0, file_id=None, limit=64 * 1024):
+    """
+    Returns complete lines of logs/{session_id}_app.log starting at byte
+    ``offset``, reading at most ``limit`` bytes, as
+    ``{"lines", "offset", "file_id", "reset"}``. Pass the returned offset and
+    file_id back to continue where the last call stopped. If the file was
+    rotated since (different file_id, or shorter than ``offset``) reading
+    restarts at 0 and ``reset`` is True. Returns None if the session has no
+    log file yet; raises ValueError for malformed session ids.
+    """
+    if not SESSION_ID_PATTERN.match(session_id):
+        raise ValueError(f"Invalid session id: {session_id!r}")
+    path = os.path.join(LOG_DIR, f"{session_id}_app.log")
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        st = os.fstat(f.fileno())
+        current_id = f"{st.st_dev}:{st.st_ino}"
+        reset = (file_id is not None and file_id != current_id) or offset > st.st_size
+        if reset:
+            offset = 0
+        f.seek(offset)
+        chunk = f.read(limit)
+    # Only hand out whole lines; a partial last line is re-read next time.
+    end = chunk.rfind(b"\n") + 1
+    if end == 0 and len(chunk) == limit:
+        end = len(chunk)
+    lines = chunk[:end].decode("utf-8", errors="replace").splitlines()
+    return {"lines": lines, "offset": offset + end, "file_id": current_id, "reset": reset}
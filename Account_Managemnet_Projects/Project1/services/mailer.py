@@ -0,0 +1,273 @@
+import os
+import queue
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+from services.settings import load_env
+from services.logger import get_logger
+from services.metrics import SMTP_SEND_SECONDS
+
+# Load environment variables
+load_env()
+logger = get_logger()
+
+
+def is_transient(error):
+    """
+    True for failures worth retrying on a fresh connection: 4xx replies,
+    dropped connections and socket errors. 5xx replies (including refused
+    recipients) and other SMTP errors are permanent. SMTPException is an
+    OSError subclass, so the SMTP cases are checked first.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    return not isinstance(error, smtplib.SMTPException)
+
+
+class SMTPConnectionPool:
+    """
+    Small pool of connected (and, when a password is set, authenticated)
+    SMTP sessions reused across messages, so each OTP no longer pays the
+    TCP + STARTTLS + AUTH handshake.
+    """
+
+    def __init__(self, host, port, sender, password=None, use_tls=True, size=2, idle_check=60.0, timeout=10.0):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.password = password
+        self.use_tls = use_tls
+        self.size = size
+        self.idle_check = idle_check
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._stats = {"connects": 0, "reuses": 0, "discarded": 0}
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            server.starttls()
+        if self.password:
+            server.login(self.sender, self.password)
+        with self._lock:
+            self._stats["connects"] += 1
+        return server
+
+    def acquire(self):
+        """Returns a live SMTP session, reusing an idle one when possible."""
+        while True:
+            try:
+                server, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            # Servers drop idle sessions; probe ones that sat unused for a while.
+            if time.monotonic() - last_used < self.idle_check:
+                with self._lock:
+                    self._stats["reuses"] += 1
+                return server
+            try:
+                server.noop()
+                with self._lock:
+                    self._stats["reuses"] += 1
+                return server
+            except OSError:
+                self.discard(server)
+
+    def release(self, server):
+        if self._idle.qsize() >= self.size:
+            self.discard(server)
+            return
+        self._idle.put((server, time.monotonic()))
+
+    def discard(self, server):
+        with self._lock:
+            self._stats["discarded"] += 1
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot["idle"] = self._idle.qsize()
+        return snapshot
+
+    def close(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self.discard(server)
+
+
+class OTPOutbox:
+    """
+    Queue of outgoing OTP emails delivered by background worker threads.
+
+    ``enqueue`` returns as soon as the message is queued; workers send it
+    over a shared SMTPConnectionPool, retrying transient failures with
+    exponential backoff.
+    """
+
+    def __init__(self, smtp_pool, workers=2, max_retries=3, backoff=1.0, max_queue=1000):
+        self.smtp_pool = smtp_pool
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "dropped": 0,
+            "sent": 0,
+            "failed": 0,
+            "retries": 0,
+            "send_time_total": 0.0,
+            "delivery_latency_total": 0.0,
+            "delivery_latency_max": 0.0,
+        }
+        self._workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._run, name=f"otp-outbox-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def enqueue(self, recipient_email, otp):
+        """Queues an OTP email. Returns False if the outbox is full."""
+        msg = EmailMessage()
+        msg.set_content(f"Your OTP is: {otp}")
+        msg['Subject'] = 'Your OTP for Account Verification'
+        msg['From'] = self.smtp_pool.sender
+        msg['To'] = recipient_email
+        try:
+            self._queue.put_nowait((msg, time.monotonic()))
+        except queue.Full:
+            self._count("dropped")
+            logger.error(f"OTP outbox full; dropping OTP email to {recipient_email}")
+            return False
+        self._count("enqueued")
+        return True
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            msg, enqueued_at = item
+            try:
+                self._deliver(msg, enqueued_at)
+            except Exception as e:
+                # Keep the worker alive; an unexpected error loses this email only.
+                self._count("failed")
+                logger.error(f"send_otp: Unexpected error delivering OTP email to {msg['To']}: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, msg, enqueued_at):
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._count("retries")
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            server = None
+            try:
+                server = self.smtp_pool.acquire()
+                start = time.perf_counter()
+                server.send_message(msg)
+                send_time = time.perf_counter() - start
+                self.smtp_pool.release(server)
+            except OSError as e:
+                if not is_transient(e):
+                    # The session is still usable after a rejected message.
+                    if server is not None:
+                        self.smtp_pool.release(server)
+                    logger.error(f"OTP email to {msg['To']} rejected: {e}")
+                    break
+                if server is not None:
+                    self.smtp_pool.discard(server)
+                logger.warning(f"OTP email to {msg['To']} failed (attempt {attempt + 1}): {e}")
+                continue
+
+            latency = time.monotonic() - enqueued_at
+            SMTP_SEND_SECONDS.observe(send_time)
+            with self._lock:
+                self._stats["sent"] += 1
+                self._stats["send_time_total"] += send_time
+                self._stats["delivery_latency_total"] += latency
+                self._stats["delivery_latency_max"] = max(self._stats["delivery_latency_max"], latency)
+            logger.info(f"send_otp: Delivered OTP email to {msg['To']} in {latency:.3f}s")
+            return True
+
+        self._count("failed")
+        logger.error(f"send_otp: Giving up on OTP email to {msg['To']}")
+        return False
+
+    def stats(self):
+        """Returns queue depth, delivery counters and latency totals."""
+        with self._lock:
+            snapshot = dict(self._stats)
+        sent = snapshot["sent"] or 1
+        snapshot["queue_depth"] = self._queue.qsize()
+        snapshot["send_time_avg"] = snapshot["send_time_total"] / sent
+        snapshot["delivery_latency_avg"] = snapshot["delivery_latency_total"] / sent
+        snapshot["smtp"] = self.smtp_pool.stats()
+        return snapshot
+
+    def flush(self):
+        """Blocks until every queued email has been delivered or given up on."""
+        self._queue.join()
+
+    def close(self):
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self.smtp_pool.close()
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox():
+    """Returns the process-wide OTPOutbox configured from SMTP_* / OTP_OUTBOX_* settings."""
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                smtp_pool = SMTPConnectionPool(
+                    host=os.getenv("SMTP_SERVER"),
+                    port=int(os.getenv("SMTP_PORT", 587)),
+                    sender=os.getenv("EMAIL_SENDER"),
+                    password=os.getenv("SMTP_PASSWORD"),
+                    use_tls=os.getenv("SMTP_USE_TLS", "1") == "1",
+                    size=int(os.getenv("SMTP_POOL_SIZE", 2)),
+                )
+                _outbox = OTPOutbox(
+                    smtp_pool,
+                    workers=int(os.getenv("OTP_OUTBOX_WORKERS", 2)),
+                    max_retries=int(os.getenv("OTP_OUTBOX_MAX_RETRIES", 3)),
+                    backoff=float(os.getenv("OTP_OUTBOX_BACKOFF", 1)),
+                    max_queue=int(os.getenv("OTP_OUTBOX_MAX_QUEUE", 1000)),
+                )
+    return _outbox
+
+
+def close_outbox():
+    global _outbox
+    with _outbox_lock:
+        if _outbox is not None:
+            _outbox.close()
+            _outbox = None
@@ -0,0 +1,274 @@
+import bisect
+import functools
+import inspect
+import math
+import threading
+import time
+
+from services.logger import get_logger
+
+logger = get_logger()
+
+PREFIX = "account_agent_"
+# Seconds; from a cached lookup (well under a millisecond) to a slow agent turn.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    Observations bucketed per label set. ``observe`` is a bisect and three
+    additions under a lock, so it can sit on every request, tool call and
+    hash without showing up in latency.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def lines(self):
+        with self._lock:
+            snapshot = [(values, list(counts), total) for values, (counts, total) in self._series.items()]
+        for values, counts, total in sorted(snapshot):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, values, ("le", _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, values)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Counter:
+    """Monotonic count per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = PREFIX + name + "_total"
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def lines(self):
+        with self._lock:
+            snapshot = dict(self._values)
+        for values, count in sorted(snapshot.items()):
+            yield f"{self.name}{_format_labels(self.labels, values)} {_format_value(count)}"
+
+
+class Gauge:
+    """Value read from ``fn`` at scrape time; nothing is recorded on the hot path."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, fn):
+        self.name = PREFIX + name
+        self.help = help
+        self.fn = fn
+
+    def lines(self):
+        yield f"{self.name} {_format_value(self.fn())}"
+
+
+class StatsGauge:
+    """
+    The numeric leaves of the existing ``stats()`` dicts as one gauge family,
+    labelled by source and (dotted) key, so they can be scraped alongside
+    the histograms.
+    """
+
+    kind = "gauge"
+
+    def __init__(self):
+        self.name = PREFIX + "stats"
+        self.help = "Numeric values reported by the component stats() endpoints."
+        self.sources = {}
+
+    @staticmethod
+    def _flatten(stats, prefix=""):
+        for key, value in stats.items():
+            if isinstance(value, dict):
+                yield from StatsGauge._flatten(value, f"{prefix}{key}.")
+            elif isinstance(value, (int, float)):
+                yield f"{prefix}{key}", value
+
+    def lines(self):
+        for source, fn in self.sources.items():
+            try:
+                stats = fn() or {}
+            except Exception as e:
+                logger.warning(f"Metrics: could not read {source} stats: {e}")
+                continue
+            for key, value in self._flatten(stats):
+                yield f"{self.name}{_format_labels(('source', 'key'), (source, key))} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    """Histograms, counters and gauges rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+        self._stats = StatsGauge()
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, fn):
+        return self._add(Gauge(name, help, fn))
+
+    def add_stats(self, source, fn):
+        """Exports the numeric values of ``fn()`` (a stats() dict) under ``source``."""
+        self._stats.sources[source] = fn
+
+    def render(self):
+        """Returns the exposition text. Gauges and stats may block; call off the event loop."""
+        with self._lock:
+            metrics = list(self._metrics)
+        out = []
+        for metric in metrics + [self._stats]:
+            try:
+                lines = list(metric.lines())
+            except Exception as e:
+                logger.warning(f"Metrics: could not read {metric.name}: {e}")
+                continue
+            out.append(f"# HELP {metric.name} {metric.help}")
+            out.append(f"# TYPE {metric.name} {metric.kind}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics():
+    """Returns the process-wide MetricsRegistry."""
+    return _registry
+
+
+def timed(histogram, *label_values):
+    """Decorator observing the duration of a sync or async function in ``histogram``."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start, *label_values)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start, *label_values)
+        return wrapper
+    return decorator
+
+
+# --- Metrics recorded by the app and services ---
+REQUEST_SECONDS = _registry.histogram(
+    "http_request_seconds", "Request latency per endpoint (time to response headers).",
+    ("method", "route", "status"))
+AGENT_RUN_SECONDS = _registry.histogram("agent_run_seconds", "Duration of runner.run_async for one turn.")
+AGENT_RUN_EVENTS = _registry.histogram(
+    "agent_run_events", "Events yielded by runner.run_async for one turn.", buckets=COUNT_BUCKETS)
+AGENT_RUN_ERRORS = _registry.counter("agent_run_errors", "Agent runs that raised.")
+TOOL_CALLBACK_SECONDS = _registry.histogram(
+    "tool_callback_seconds", "before_tool_callback time per tool (authentication and OTP send).", ("tool",))
+TOOL_CALLBACK_REJECTIONS = _registry.counter(
+    "tool_callback_rejections", "Tool calls stopped by before_tool_callback with an error.", ("tool",))
+DB_SECONDS = _registry.histogram(
+    "db_seconds", "DBService method latency; sync DBService methods are prefixed sync_.", ("method",))
+BCRYPT_SECONDS = _registry.histogram(
+    "bcrypt_seconds", "bcrypt work time per operation, excluding queueing.", ("operation",))
+SEND_OTP_SECONDS = _registry.histogram("send_otp_seconds", "send_otp time (queueing the e-mail on the outbox).")
+SMTP_SEND_SECONDS = _registry.histogram("smtp_send_seconds", "SMTP send_message time per delivered OTP e-mail.")
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware observing REQUEST_SECONDS per method, route template and
+    status. Timing stops when the response headers go out, so a streaming
+    endpoint reports its time to first byte rather than the stream length.
+    Paths that match no route share the "unmatched" label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        recorded = False
+
+        def record(status):
+            nonlocal recorded
+            recorded = True
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(time.perf_counter() - start, scope["method"],
+                                    getattr(route, "path", "unmatched"), status)
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start" and not recorded:
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        except Exception:
+            if not recorded:
+                record(500)
+            raise
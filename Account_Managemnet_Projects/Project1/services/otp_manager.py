@@ -0,0 +1,358 @@
+import hashlib
+import heapq
+import hmac
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+from services.settings import load_env
+from services.logger import get_logger
+
+# Load environment variables
+load_env()
+logger = get_logger()
+
+# Status values; the verified one matches what the chat flow keeps in otp_status.
+OTP_VERIFIED = "OPT_VERIFIED_SUCCESS"
+OTP_PENDING = "OTP_PENDING"
+OTP_EXPIRED = "OTP_EXPIRED"
+OTP_LOCKED = "OTP_LOCKED"
+OTP_NOT_FOUND = "OTP_NOT_FOUND"
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS otp_challenges (
+        challenge_id TEXT PRIMARY KEY,
+        username TEXT,
+        salt TEXT NOT NULL,
+        digest TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        expires_at DOUBLE PRECISION NOT NULL)""",
+    "CREATE INDEX IF NOT EXISTS otp_challenges_expires_at ON otp_challenges (expires_at)",
+)
+
+
+def _digest(salt, code):
+    return hashlib.sha256(f"{salt}:{code}".encode("utf-8")).hexdigest()
+
+
+class SQLOTPStore(ABC):
+    """
+    Blocking storage for OTPManager. Only a salted hash of each code is
+    kept. Subclasses provide ``_connection()`` and the driver's placeholder.
+    """
+
+    placeholder = "?"
+
+    def _sql(self, statement):
+        return statement.replace("?", self.placeholder)
+
+    @abstractmethod
+    def _connection(self):
+        """Context manager yielding a DB-API connection for one unit of work."""
+
+    def create_schema(self):
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            for statement in SCHEMA:
+                cursor.execute(statement)
+            conn.commit()
+
+    def put(self, challenge_id, username, salt, digest, expires_at):
+        """Creates or replaces the challenge, resetting its attempt count."""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                self._sql(
+                    "INSERT INTO otp_challenges (challenge_id, username, salt, digest, attempts, expires_at) "
+                    "VALUES (?, ?, ?, ?, 0, ?) ON CONFLICT (challenge_id) DO UPDATE SET "
+                    "username = excluded.username, salt = excluded.salt, digest = excluded.digest, "
+                    "attempts = 0, expires_at = excluded.expires_at"
+                ),
+                (challenge_id, username, salt, digest, expires_at),
+            )
+            conn.commit()
+
+    def attempt(self, challenge_id, now, max_attempts):
+        """
+        Counts one attempt on a live challenge with attempts left and returns
+        (salt, digest, attempts), or None if there is no such challenge. The
+        increment is a single statement, so concurrent workers cannot both
+        use the last attempt.
+        """
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                self._sql(
+                    "UPDATE otp_challenges SET attempts = attempts + 1 "
+                    "WHERE challenge_id = ? AND expires_at > ? AND attempts < ? "
+                    "RETURNING salt, digest, attempts"
+                ),
+                (challenge_id, now, max_attempts),
+            )
+            row = cursor.fetchone()
+            conn.commit()
+        return row
+
+    def get(self, challenge_id):
+        """Returns (attempts, expires_at) or None."""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                self._sql("SELECT attempts, expires_at FROM otp_challenges WHERE challenge_id = ?"),
+                (challenge_id,),
+            )
+            return cursor.fetchone()
+
+    def delete(self, challenge_id):
+        """Returns True if the challenge existed, so a code is only consumed once."""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self._sql("DELETE FROM otp_challenges WHERE challenge_id = ?"), (challenge_id,))
+            deleted = cursor.rowcount == 1
+            conn.commit()
+        return deleted
+
+    def delete_due(self, due):
+        """
+        Deletes the (expires_at, challenge_id) pairs in ``due``. A challenge
+        re-issued since then has a later expiry and is left alone.
+        """
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                self._sql("DELETE FROM otp_challenges WHERE challenge_id = ? AND expires_at <= ?"),
+                [(challenge_id, expires_at) for expires_at, challenge_id in due],
+            )
+            conn.commit()
+
+    def delete_expired(self, now):
+        """Deletes every expired challenge via the expires_at index. Returns the count."""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self._sql("DELETE FROM otp_challenges WHERE expires_at <= ?"), (now,))
+            deleted = cursor.rowcount
+            conn.commit()
+        return deleted
+
+    def count(self):
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM otp_challenges")
+            return cursor.fetchone()[0]
+
+    def close(self):
+        pass
+
+
+class SQLiteOTPStore(SQLOTPStore):
+    """Single-file store for local development; shared by workers on one host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._lock = threading.Lock()
+        self.create_schema()
+
+    @contextmanager
+    def _connection(self):
+        with self._lock:
+            try:
+                yield self._conn
+            except Exception:
+                self._conn.rollback()
+                raise
+
+    def close(self):
+        self._conn.close()
+
+
+class PostgresOTPStore(SQLOTPStore):
+    """Store on the shared psycopg2 pool, for multi-worker deployments."""
+
+    placeholder = "%s"
+
+    def __init__(self, pool=None):
+        from services.db_pool import get_pool
+
+        self.pool = pool or get_pool()
+        self.create_schema()
+
+    @contextmanager
+    def _connection(self):
+        with self.pool.connection() as conn:
+            yield conn
+
+
+class OTPManager:
+    """
+    Issues and verifies one-time passwords kept in a store shared by all
+    workers.
+
+    Each challenge has a TTL and at most ``max_attempts`` verifications.
+    Codes are compared with hmac.compare_digest against a salted hash and
+    are consumed on success. Expired challenges are removed by a
+    background thread. It keeps a min-heap of the expiry times issued by
+    this process and sleeps until the earliest one, so no request has to
+    scan for expired rows. Every ``sweep_interval`` seconds it also does an
+    indexed range delete, which catches challenges issued by workers that
+    have since exited. All methods block; call them with asyncio.to_thread
+    from the event loop.
+    """
+
+    def __init__(self, store, ttl=300.0, max_attempts=3, digits=6, sweep_interval=60.0):
+        self.store = store
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.digits = digits
+        self.sweep_interval = sweep_interval
+        self._heap = []  # (expires_at, challenge_id)
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._stats = {"issued": 0, "verified": 0, "failed_attempts": 0, "expired": 0, "locked": 0, "swept": 0}
+        self._stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._sweep_loop, name="otp-sweeper", daemon=True)
+        self._thread.start()
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self._stats[name] += n
+
+    def issue(self, challenge_id, username=None):
+        """Creates (or replaces) the challenge and returns the code to send."""
+        code = f"{secrets.randbelow(10 ** self.digits):0{self.digits}d}"
+        salt = secrets.token_hex(8)
+        expires_at = time.time() + self.ttl
+        self.store.put(challenge_id, username, salt, _digest(salt, code), expires_at)
+        with self._cond:
+            heapq.heappush(self._heap, (expires_at, challenge_id))
+            if self._heap[0][1] == challenge_id:
+                self._cond.notify()
+        self._count("issued")
+        return code
+
+    def verify(self, challenge_id, code):
+        """
+        Checks ``code`` against the challenge. Returns {"status": ...,
+        "attempts_left": n}, where status is OTP_VERIFIED, OTP_PENDING
+        (wrong code, attempts left), OTP_EXPIRED, OTP_LOCKED or OTP_NOT_FOUND.
+        The challenge is deleted on every outcome except OTP_PENDING.
+        """
+        now = time.time()
+        row = self.store.attempt(challenge_id, now, self.max_attempts)
+        if row is None:
+            existing = self.store.get(challenge_id)
+            if existing is None:
+                return {"status": OTP_NOT_FOUND, "attempts_left": 0}
+            self.store.delete(challenge_id)
+            if existing[1] <= now:
+                self._count("expired")
+                return {"status": OTP_EXPIRED, "attempts_left": 0}
+            self._count("locked")
+            return {"status": OTP_LOCKED, "attempts_left": 0}
+
+        salt, digest, attempts = row
+        if hmac.compare_digest(digest, _digest(salt, str(code).strip())):
+            # Another worker may have consumed the same code a moment ago.
+            if not self.store.delete(challenge_id):
+                return {"status": OTP_NOT_FOUND, "attempts_left": 0}
+            self._count("verified")
+            return {"status": OTP_VERIFIED, "attempts_left": self.max_attempts - attempts}
+
+        self._count("failed_attempts")
+        attempts_left = self.max_attempts - attempts
+        if attempts_left <= 0:
+            self.store.delete(challenge_id)
+            self._count("locked")
+            return {"status": OTP_LOCKED, "attempts_left": 0}
+        return {"status": OTP_PENDING, "attempts_left": attempts_left}
+
+    def discard(self, challenge_id):
+        """Drops the challenge, e.g. when the user abandons the flow."""
+        self.store.delete(challenge_id)
+
+    def _sweep_loop(self):
+        next_full_sweep = time.time() + self.sweep_interval
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    now = time.time()
+                    if (self._heap and self._heap[0][0] <= now) or now >= next_full_sweep:
+                        break
+                    wake_at = min(self._heap[0][0], next_full_sweep) if self._heap else next_full_sweep
+                    self._cond.wait(wake_at - now)
+                if self._stopped:
+                    return
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap))
+            try:
+                if due:
+                    self.store.delete_due(due)
+                    self._count("swept", len(due))
+                if now >= next_full_sweep:
+                    next_full_sweep = now + self.sweep_interval
+                    swept = self.store.delete_expired(now)
+                    if swept:
+                        self._count("swept", swept)
+            except Exception as e:
+                logger.error(f"OTP expiry sweep failed: {e}")
+
+    def stats(self):
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        with self._cond:
+            snapshot["tracked"] = len(self._heap)
+        snapshot["ttl"] = self.ttl
+        snapshot["max_attempts"] = self.max_attempts
+        return snapshot
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join(timeout=5)
+        self.store.close()
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_otp_manager():
+    """
+    Returns the process-wide OTPManager on the store selected by OTP_STORE:
+    sqlite (default, OTP_STORE_PATH) or postgres (the DB_* database).
+    """
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                kind = os.getenv("OTP_STORE", "sqlite").lower()
+                if kind == "sqlite":
+                    store = SQLiteOTPStore(os.getenv("OTP_STORE_PATH", "otp.db"))
+                elif kind == "postgres":
+                    store = PostgresOTPStore()
+                else:
+                    raise ValueError(f"Unknown OTP_STORE: {kind}")
+                logger.info(f"Using {kind} OTP store.")
+                _manager = OTPManager(
+                    store,
+                    ttl=float(os.getenv("OTP_EXPIRY_MINUTES", 5)) * 60,
+                    max_attempts=int(os.getenv("OTP_MAX_ATTEMPTS", 3)),
+                    sweep_interval=float(os.getenv("OTP_SWEEP_INTERVAL", 60)),
+                )
+    return _manager
+
+
+def close_otp_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is not None:
+            _manager.close()
+            _manager = None
@@ -0,0 +1,95 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from services.settings import load_env
+from services.logger import get_logger
+
+# Load environment variables
+load_env()
+logger = get_logger()
+
+
+class ProfileCache:
+    """
+    In-process TTL + LRU cache of user profile rows keyed by username.
+
+    Shared by DBService and AsyncDBService. Writes through either service
+    invalidate the entry, and the TTL bounds staleness from writes made by
+    other worker processes. Password hashes are never cached: authenticate
+    always reads the row, so a password changed through another worker
+    takes effect at once.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def get(self, username):
+        """Returns a copy of the cached profile, or None on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(username)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            expires_at, profile = entry
+            if expires_at <= now:
+                del self._data[username]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._data.move_to_end(username)
+            self._stats["hits"] += 1
+            return dict(profile)
+
+    def set(self, username, profile):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        profile = {key: value for key, value in profile.items() if key != "password"}
+        with self._lock:
+            self._data[username] = (time.monotonic() + self.ttl, profile)
+            self._data.move_to_end(username)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, username):
+        with self._lock:
+            if self._data.pop(username, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Returns hit/miss/eviction counters and the current size."""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["size"] = len(self._data)
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["maxsize"] = self.maxsize
+        snapshot["hit_rate"] = snapshot["hits"] / lookups if lookups else 0.0
+        return snapshot
+
+
+_profile_cache = None
+_profile_cache_lock = threading.Lock()
+
+
+def get_profile_cache():
+    """Returns the process-wide ProfileCache configured from PROFILE_CACHE_* settings."""
+    global _profile_cache
+    if _profile_cache is None:
+        with _profile_cache_lock:
+            if _profile_cache is None:
+                _profile_cache = ProfileCache(
+                    maxsize=int(os.getenv("PROFILE_CACHE_SIZE", 1024)),
+                    ttl=float(os.getenv("PROFILE_CACHE_TTL", 60)),
+                )
+    return _profile_cache
@@ -0,0 +1,104 @@
+import re
+import threading
+from itertools import combinations
+
+from services.settings import get_settings
+
+# Columns a user may change through update_field / update_fields.
+ALLOWED_UPDATE_FIELDS = ("email", "password", "phone_number", "address")
+
+# Columns written by create_user, in insert order.
+USER_COLUMNS = ("username", "password", "first_name", "last_name", "email", "phone_number", "address")
+
+
+def quote_ident(name):
+    """Quotes a table or column name the way sql.Identifier does for psycopg2."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+class QueryCatalog:
+    """
+    Precomposed SQL for every DBService statement.
+
+    Statements use $n placeholders so the same text works for asyncpg and
+    for PREPARE on psycopg2 connections. ``statements`` maps a statement name
+    to its SQL; ``execute_sql`` maps it to the matching psycopg2
+    ``EXECUTE name (%s, ...)`` call. ``bulk_statements`` holds the staging
+    table and COPY statements used by create_users_bulk.
+    """
+
+    def __init__(self, table_name):
+        table = quote_ident(table_name)
+        self.statements = {
+            "select_profile": f"SELECT * FROM {table} WHERE username = $1",
+            "select_email": f"SELECT email FROM {table} WHERE username = $1",
+            # Only replaces the hash that was verified, so a concurrent
+            # password change is never overwritten by a login rehash.
+            "rehash_password": f"UPDATE {table} SET password = $1 WHERE username = $2 AND password = $3",
+            "count_weak_hashes": (
+                "SELECT count(*) FILTER (WHERE password !~ '^\\$2[aby]\\$[0-9]{2}\\$') AS plaintext, "
+                "count(*) FILTER (WHERE CASE WHEN password ~ '^\\$2[aby]\\$[0-9]{2}\\$' "
+                "THEN substring(password from 5 for 2)::int < $1 ELSE false END) AS under_cost "
+                f"FROM {table}"
+            ),
+            "insert_user": "INSERT INTO {table} ({columns}) VALUES ({placeholders})".format(
+                table=table,
+                columns=", ".join(quote_ident(column) for column in USER_COLUMNS),
+                placeholders=", ".join(f"${i}" for i in range(1, len(USER_COLUMNS) + 1)),
+            ),
+        }
+        # One UPDATE per combination of allowed fields (15 in total), each in
+        # a single-user form and a batch form that updates many users from
+        # parallel text arrays and returns the usernames it touched.
+        for size in range(1, len(ALLOWED_UPDATE_FIELDS) + 1):
+            for fields in combinations(ALLOWED_UPDATE_FIELDS, size):
+                name = self.update_name(*fields)
+                assignments = ", ".join(f"{quote_ident(field)} = ${i}" for i, field in enumerate(fields, start=1))
+                self.statements[name] = f"UPDATE {table} SET {assignments} WHERE username = ${size + 1}"
+
+                assignments = ", ".join(f"{quote_ident(field)} = v.{quote_ident(field)}" for field in fields)
+                arrays = ", ".join(f"${i}::text[]" for i in range(1, size + 2))
+                value_columns = ", ".join(quote_ident(field) for field in fields)
+                self.statements[f"batch_{name}"] = (
+                    f"UPDATE {table} AS t SET {assignments} "
+                    f"FROM unnest({arrays}) AS v(username, {value_columns}) "
+                    "WHERE t.username = v.username RETURNING t.username"
+                )
+
+        # COPY and DDL cannot be PREPAREd; create_users_bulk runs these as-is.
+        columns = ", ".join(quote_ident(column) for column in USER_COLUMNS)
+        stage_columns = ", ".join(f"{quote_ident(column)} text" for column in USER_COLUMNS)
+        self.bulk_statements = {
+            "create_stage": f"CREATE TEMP TABLE IF NOT EXISTS bulk_user_stage ({stage_columns}) ON COMMIT DELETE ROWS",
+            "copy_stage": f"COPY bulk_user_stage ({columns}) FROM STDIN WITH (FORMAT csv)",
+            "insert_from_stage": (
+                f"INSERT INTO {table} ({columns}) SELECT {columns} FROM bulk_user_stage "
+                "ON CONFLICT (username) DO NOTHING RETURNING username"
+            ),
+        }
+
+        self.execute_sql = {}
+        for name, statement in self.statements.items():
+            # Escaped dollars (\$) inside regex literals are not placeholders.
+            params = ", ".join(["%s"] * len(set(re.findall(r"(?<!\\)\$\d+", statement))))
+            self.execute_sql[name] = f"EXECUTE {name} ({params})"
+
+    @staticmethod
+    def update_name(*fields):
+        """Returns the statement name for updating ``fields``, in any order."""
+        ordered = [field for field in ALLOWED_UPDATE_FIELDS if field in fields]
+        return "update_" + "_".join(ordered)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """Returns the process-wide QueryCatalog built from DB_TABLE_NAME."""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = QueryCatalog(get_settings().db_table_name)
+    return _catalog
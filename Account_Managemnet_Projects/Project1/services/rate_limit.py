@@ -0,0 +1,355 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from services.settings import load_env
+from services.logger import get_logger
+
+# Load environment variables
+load_env()
+logger = get_logger()
+
+# name -> default "count/seconds"; a bucket holds ``count`` tokens and refills over ``seconds``.
+DEFAULT_LIMITS = {
+    "chat": "30/60",
+    "session": "10/60",
+    "otp_send": "5/900",
+    "password_failure": "5/900",
+}
+
+
+def parse_limit(value):
+    """Parses "count/seconds" into (rate per second, burst), or None when disabled."""
+    if not value or value.strip() in ("0", "off"):
+        return None
+    count, seconds = value.split("/")
+    return int(count) / float(seconds), int(count)
+
+
+class MemoryBucketStore:
+    """
+    Per-process buckets. Each key costs one float (its theoretical arrival
+    time); keys are kept in LRU order and the oldest are dropped past
+    ``max_keys``. A dropped key starts again with a full bucket, which is
+    what an idle key would have anyway.
+    """
+
+    durable = False
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._tats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, bucket, now, increment, tolerance):
+        with self._lock:
+            base = max(self._tats.get(bucket, now), now)
+            allowed = base + increment - now <= tolerance
+            if allowed:
+                self._tats[bucket] = base + increment
+                self._tats.move_to_end(bucket)
+                if len(self._tats) > self.max_keys:
+                    self._tats.popitem(last=False)
+            return allowed, base
+
+    def peek(self, bucket):
+        with self._lock:
+            return self._tats.get(bucket)
+
+    def refund(self, bucket, now, increment):
+        with self._lock:
+            tat = self._tats.get(bucket)
+            if tat is not None:
+                self._tats[bucket] = max(tat - increment, now)
+
+    def prune(self, now):
+        with self._lock:
+            expired = [bucket for bucket, tat in self._tats.items() if tat <= now]
+            for bucket in expired:
+                del self._tats[bucket]
+        return len(expired)
+
+    def __len__(self):
+        return len(self._tats)
+
+    def close(self):
+        pass
+
+
+class SQLBucketStore(ABC):
+    """
+    Buckets in a table shared by all workers. Each check is one upsert that
+    computes the new state from the stored one, so concurrent workers
+    cannot overspend a bucket. Subclasses provide ``_connection()`` and the
+    driver's placeholder.
+    """
+
+    durable = True
+    placeholder = "?"
+
+    # Shared bucket state: tat is when the bucket will be full again.
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS rate_limits (
+            bucket TEXT PRIMARY KEY,
+            tat DOUBLE PRECISION NOT NULL,
+            allowed BOOLEAN NOT NULL)""",
+        "CREATE INDEX IF NOT EXISTS rate_limits_tat ON rate_limits (tat)",
+    )
+
+    def _sql(self, statement):
+        return statement.replace("?", self.placeholder)
+
+    @abstractmethod
+    def _connection(self):
+        """Context manager yielding a DB-API connection for one unit of work."""
+
+    def create_schema(self):
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            for statement in self.SCHEMA:
+                cursor.execute(statement)
+            conn.commit()
+
+    def acquire(self, bucket, now, increment, tolerance):
+        base = "(CASE WHEN rate_limits.tat > ? THEN rate_limits.tat ELSE ? END)"
+        allowed = f"{base} + ? - ? <= ?"
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                self._sql(
+                    "INSERT INTO rate_limits (bucket, tat, allowed) VALUES (?, ?, ?) "
+                    f"ON CONFLICT (bucket) DO UPDATE SET allowed = {allowed}, "
+                    f"tat = CASE WHEN {allowed} THEN {base} + ? ELSE rate_limits.tat END "
+                    "RETURNING tat, allowed"
+                ),
+                (
+                    bucket, now + increment, increment <= tolerance,
+                    now, now, increment, now, tolerance,
+                    now, now, increment, now, tolerance, now, now, increment,
+                ),
+            )
+            tat, was_allowed = cursor.fetchone()
+            conn.commit()
+        # The returned tat is the new one when allowed, the old one otherwise.
+        return bool(was_allowed), (tat - increment if was_allowed else max(tat, now))
+
+    def peek(self, bucket):
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self._sql("SELECT tat FROM rate_limits WHERE bucket = ?"), (bucket,))
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def refund(self, bucket, now, increment):
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                self._sql("UPDATE rate_limits SET tat = CASE WHEN tat - ? > ? THEN tat - ? ELSE ? END WHERE bucket = ?"),
+                (increment, now, increment, now, bucket),
+            )
+            conn.commit()
+
+    def prune(self, now):
+        """Deletes buckets that are full again; they behave like absent ones."""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self._sql("DELETE FROM rate_limits WHERE tat <= ?"), (now,))
+            deleted = cursor.rowcount
+            conn.commit()
+        return deleted
+
+    def __len__(self):
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM rate_limits")
+            return cursor.fetchone()[0]
+
+    def close(self):
+        pass
+
+
+class SQLiteBucketStore(SQLBucketStore):
+    """Single-file store for several workers on one host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._lock = threading.Lock()
+        self.create_schema()
+
+    @contextmanager
+    def _connection(self):
+        with self._lock:
+            try:
+                yield self._conn
+            except Exception:
+                self._conn.rollback()
+                raise
+
+    def close(self):
+        self._conn.close()
+
+
+class PostgresBucketStore(SQLBucketStore):
+    """Store on the shared psycopg2 pool, for multi-worker deployments."""
+
+    placeholder = "%s"
+
+    def __init__(self, pool=None):
+        from services.db_pool import get_pool
+
+        self.pool = pool or get_pool()
+        self.create_schema()
+
+    @contextmanager
+    def _connection(self):
+        with self.pool.connection() as conn:
+            yield conn
+
+
+class RateLimiter:
+    """
+    Named token buckets, one per (limit, key) pair, e.g. ("chat", client IP).
+
+    Buckets are kept in GCRA form: one timestamp per key, updated in O(1)
+    per check. A limit "count/seconds" allows bursts of ``count`` and
+    refills at count/seconds tokens per second. Limits missing from
+    ``limits`` are not enforced. ``acquire`` and ``retry_after`` return 0.0
+    when the request may proceed, otherwise the seconds until it may.
+    Budgets charged only on failure are reserved with ``acquire`` before
+    the attempt and handed back with ``refund`` when it succeeds, so
+    concurrent attempts cannot all get past the check.
+    """
+
+    def __init__(self, store, limits, prune_interval=60.0):
+        self.store = store
+        self.limits = {name: limit for name, limit in limits.items() if limit}
+        self.prune_interval = prune_interval
+        self._next_prune = time.time() + prune_interval
+        self._stats = {name: {"allowed": 0, "limited": 0, "refunded": 0} for name in self.limits}
+        self._stats_lock = threading.Lock()
+
+    def _check(self, name, keys, cost, consume):
+        limit = self.limits.get(name)
+        if limit is None:
+            return 0.0
+        rate, burst = limit
+        increment, tolerance = cost / rate, burst / rate
+        now = time.time()
+        if now >= self._next_prune:
+            self._next_prune = now + self.prune_interval
+            self.store.prune(now)
+        retry_after = 0.0
+        charged = []
+        for key in keys:
+            if key is None:
+                continue
+            bucket = f"{name}:{key}"
+            # Once any key denies, the rest are only inspected for retry_after.
+            if consume and not retry_after:
+                allowed, base = self.store.acquire(bucket, now, increment, tolerance)
+                if allowed:
+                    charged.append(bucket)
+            else:
+                tat = self.store.peek(bucket)
+                base = max(tat or now, now)
+                allowed = base + increment - now <= tolerance
+            if not allowed:
+                retry_after = max(retry_after, base + increment - tolerance - now)
+        if consume and retry_after:
+            # A denied request costs nothing: give back what earlier keys paid.
+            for bucket in charged:
+                self.store.refund(bucket, now, increment)
+        if consume:
+            with self._stats_lock:
+                self._stats[name]["limited" if retry_after else "allowed"] += 1
+        return retry_after
+
+    def _refund(self, name, keys, cost):
+        limit = self.limits.get(name)
+        if limit is None:
+            return
+        now = time.time()
+        for key in keys:
+            if key is not None:
+                self.store.refund(f"{name}:{key}", now, cost / limit[0])
+        with self._stats_lock:
+            self._stats[name]["refunded"] += 1
+
+    async def _call(self, fn, *args):
+        # Shared stores block on I/O; the memory store returns immediately.
+        if self.store.durable:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def acquire(self, name, *keys, cost=1):
+        """Takes ``cost`` tokens from the ``name`` bucket of each key."""
+        return await self._call(self._check, name, keys, cost, True)
+
+    async def retry_after(self, name, *keys, cost=1):
+        """Like acquire, but only checks."""
+        return await self._call(self._check, name, keys, cost, False)
+
+    async def refund(self, name, *keys, cost=1):
+        """Gives back ``cost`` tokens taken by a successful ``acquire``."""
+        await self._call(self._refund, name, keys, cost)
+
+    def stats(self):
+        with self._stats_lock:
+            snapshot = {name: dict(counts) for name, counts in self._stats.items()}
+        for name, (rate, burst) in self.limits.items():
+            snapshot[name]["rate_per_second"] = rate
+            snapshot[name]["burst"] = burst
+        if not self.store.durable:
+            snapshot["tracked_keys"] = len(self.store)
+        return snapshot
+
+    def close(self):
+        self.store.close()
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Returns the process-wide RateLimiter. RATE_LIMIT_<NAME> overrides the
+    "count/seconds" defaults (0 disables a limit); RATE_LIMIT_STORE selects
+    memory (default), sqlite (RATE_LIMIT_STORE_PATH) or postgres.
+    """
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                kind = os.getenv("RATE_LIMIT_STORE", "memory").lower()
+                if kind == "memory":
+                    store = MemoryBucketStore(int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000)))
+                elif kind == "sqlite":
+                    store = SQLiteBucketStore(os.getenv("RATE_LIMIT_STORE_PATH", "ratelimit.db"))
+                elif kind == "postgres":
+                    store = PostgresBucketStore()
+                else:
+                    raise ValueError(f"Unknown RATE_LIMIT_STORE: {kind}")
+                limits = {
+                    name: parse_limit(os.getenv(f"RATE_LIMIT_{name.upper()}", default))
+                    for name, default in DEFAULT_LIMITS.items()
+                }
+                logger.info(f"Using {kind} rate limit store.")
+                _limiter = RateLimiter(store, limits)
+    return _limiter
+
+
+def close_rate_limiter():
+    global _limiter
+    with _limiter_lock:
+        if _limiter is not None:
+            _limiter.close()
+            _limiter = None
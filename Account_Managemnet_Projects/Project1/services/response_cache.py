@@ -0,0 +1,133 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from services.settings import load_env
+from services.logger import get_logger
+from services.router import get_router
+
+load_env()
+logger = get_logger()
+
+MAX_CACHEABLE_LENGTH = 120
+# Messages with digits or "@" are likely to carry account data.
+USER_DATA_PATTERN = re.compile(r"[\d@]")
+
+
+def normalize_message(message):
+    """Lowercases, drops punctuation and collapses whitespace."""
+    return " ".join(re.sub(r"[^\w\s]", " ", message.lower()).split())
+
+
+def is_cacheable_message(message):
+    """
+    True for short messages without anything that looks like account data
+    (numbers, e-mail addresses or labelled values such as "username bob").
+    """
+    if len(message) > MAX_CACHEABLE_LENGTH or USER_DATA_PATTERN.search(message):
+        return False
+    return not get_router().extract_slots(message)
+
+
+def mentions_customer(reply, customer):
+    """True if ``reply`` contains any identifying field of ``customer``."""
+    if customer is None:
+        return False
+    reply = reply.lower()
+    for field in ("username", "first_name", "last_name", "email", "address"):
+        value = getattr(customer, field, None)
+        if isinstance(value, str) and len(value) > 1 and value.lower() in reply:
+            return True
+    return False
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of agent replies for turns whose answer does not depend
+    on the user, such as "help" or the menu shown after OTP verification.
+
+    Entries are keyed on the conversation stage, a digest of the previous
+    agent reply (the context the model answers in) and the normalized
+    message. Each entry remembers how long the LLM took to produce it, so
+    hits can report the latency they saved. Not thread-safe; used from the
+    event loop only.
+    """
+
+    def __init__(self, max_entries=512, ttl=3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (reply, llm_seconds, stored_at), least recently used first
+        self._entries = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "bypassed": 0, "stores": 0,
+                       "evictions": 0, "expirations": 0, "saved_llm_seconds": 0.0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    @staticmethod
+    def key(stage, previous_reply, message):
+        context = hashlib.sha1(str(previous_reply or "").encode("utf-8")).hexdigest()
+        return stage, context, normalize_message(message)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self._stats["misses"] += 1
+            return None
+        if time.monotonic() - entry[2] > self.ttl:
+            del self._entries[key]
+            self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._stats["hits"] += 1
+        self._stats["saved_llm_seconds"] += entry[1]
+        return entry[0]
+
+    def put(self, key, reply, llm_seconds):
+        self._entries[key] = (reply, llm_seconds, time.monotonic())
+        self._entries.move_to_end(key)
+        self._stats["stores"] += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def bypass(self):
+        """Counts a turn that skipped the cache because it involved user data."""
+        self._stats["bypassed"] += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        snapshot = dict(self._stats)
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_rate"] = snapshot["hits"] / lookups if lookups else 0.0
+        snapshot["entries"] = len(self._entries)
+        snapshot["max_entries"] = self.max_entries
+        snapshot["ttl"] = self.ttl
+        return snapshot
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Returns the process-wide ResponseCache sized by RESPONSE_CACHE_MAX_ENTRIES
+    (0 disables it) and RESPONSE_CACHE_TTL.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(
+                    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 512)),
+                    ttl=float(os.getenv("RESPONSE_CACHE_TTL", 3600)),
+                )
+    return _cache
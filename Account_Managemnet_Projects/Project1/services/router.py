@@ -0,0 +1,163 @@
+import re
+import threading
+from collections import namedtuple
+
+from services.logger import get_logger
+
+logger = get_logger()
+
+Route = namedtuple("Route", ["tool", "args"])
+
+# "update my email", "change the phone number", "create an account", ...
+INTENT_PATTERNS = (
+    ("create_account", re.compile(r"\b(?:create|open|register|sign\s*up\s+for)\s+(?:a\s+|an\s+|new\s+|my\s+)*account\b", re.I)),
+    ("update_email", re.compile(r"\b(?:update|change|set|modify|edit)\s+(?:my\s+|the\s+)?(?:e-?mail)\b", re.I)),
+    ("update_password", re.compile(r"\b(?:update|change|set|modify|reset)\s+(?:my\s+|the\s+)?password\b", re.I)),
+    ("update_contact", re.compile(r"\b(?:update|change|set|modify|edit)\s+(?:my\s+|the\s+)?(?:phone|contact|mobile)(?:\s+number)?\b", re.I)),
+    ("update_address", re.compile(r"\b(?:update|change|set|modify|edit)\s+(?:my\s+|the\s+)?address\b", re.I)),
+)
+
+# Slot labels, longest first so "new password" wins over "password". A value
+# runs from its label to the next label (or the end of the message).
+LABELS = {
+    "new password": "new_password",
+    "current password": "password",
+    "old password": "password",
+    "new email": "new_email",
+    "new phone number": "new_phone_number",
+    "new phone": "new_phone_number",
+    "new contact number": "new_phone_number",
+    "new address": "new_address",
+    "first name": "first_name",
+    "last name": "last_name",
+    "user name": "username",
+    "username": "username",
+    "password": "password",
+    "e-mail": "email",
+    "email": "email",
+    "phone number": "phone_number",
+    "phone": "phone_number",
+    "contact number": "phone_number",
+    "contact": "phone_number",
+    "mobile": "phone_number",
+    "address": "address",
+}
+LABEL_PATTERN = re.compile(
+    r"\b(" + "|".join(label.replace(" ", r"\s+") for label in LABELS) + r")\b\s*(?:is\b|:|=|to\b)?\s*",
+    re.I,
+)
+
+VALIDATORS = {
+    "username": re.compile(r"[A-Za-z0-9_.-]{3,64}"),
+    "password": re.compile(r"\S{1,128}"),
+    "new_password": re.compile(r"\S{1,128}"),
+    "email": re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+"),
+    "new_email": re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+"),
+    "phone_number": re.compile(r"\+?[\d\s().-]{7,20}"),
+    "new_phone_number": re.compile(r"\+?[\d\s().-]{7,20}"),
+    "first_name": re.compile(r"[^\W\d_][\w' -]{0,63}"),
+    "last_name": re.compile(r"[^\W\d_][\w' -]{0,63}"),
+    "address": re.compile(r".{5,200}"),
+    "new_address": re.compile(r".{5,200}"),
+}
+
+# For update tools the field being changed can be given by its plain label
+# ("email to x@y.com") as well as the "new ..." one.
+NEW_VALUE_SLOTS = {
+    "update_email": ("new_email", "email"),
+    "update_contact": ("new_phone_number", "phone_number"),
+    "update_address": ("new_address", "address"),
+}
+
+TOOL_ARGS = {
+    "create_account": ("username", "password", "first_name", "last_name", "email", "phone_number", "address"),
+    "update_email": ("username", "password", "new_email"),
+    "update_password": ("username", "password", "new_password"),
+    "update_contact": ("username", "password", "new_phone_number"),
+    "update_address": ("username", "password", "new_address"),
+}
+
+
+class FastPathRouter:
+    """
+    Rule-based router for messages that fully specify a tool call, e.g.
+    "update my email to bob@x.com, username bob, password hunter2".
+
+    ``route`` returns a Route only when exactly one intent matches and every
+    argument of its tool was found and passes validation; anything else goes
+    to the agent. Turn counts and latency are tracked per path ("fast",
+    "agent", "otp") via ``record``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def detect_intent(self, message):
+        """Returns the single tool intent named in ``message``, or None."""
+        matches = [intent for intent, pattern in INTENT_PATTERNS if pattern.search(message)]
+        return matches[0] if len(matches) == 1 else None
+
+    def extract_slots(self, message):
+        """Returns {slot: value} for every labelled value in ``message``."""
+        labels = list(LABEL_PATTERN.finditer(message))
+        slots = {}
+        for i, match in enumerate(labels):
+            end = labels[i + 1].start() if i + 1 < len(labels) else len(message)
+            value = message[match.end():end].strip().rstrip(",;.").strip()
+            if value.lower() in ("and", ""):
+                continue
+            value = re.sub(r"\s+and$", "", value, flags=re.I)
+            slot = LABELS[re.sub(r"\s+", " ", match.group(1).lower())]
+            if slot in slots and slots[slot] != value:
+                # The same slot given twice with different values is ambiguous.
+                slots[slot] = None
+            else:
+                slots[slot] = value
+        return slots
+
+    def route(self, message):
+        intent = self.detect_intent(message)
+        if intent is None:
+            return None
+        slots = self.extract_slots(message)
+        for new_slot, plain_slot in [NEW_VALUE_SLOTS[intent]] if intent in NEW_VALUE_SLOTS else []:
+            slots.setdefault(new_slot, slots.pop(plain_slot, None))
+        args = {}
+        for name in TOOL_ARGS[intent]:
+            value = slots.get(name)
+            if not value or not VALIDATORS[name].fullmatch(value):
+                return None
+            args[name] = value
+        return Route(intent, args)
+
+    def record(self, path, seconds):
+        with self._lock:
+            stats = self._stats.setdefault(path, {"turns": 0, "latency_total": 0.0, "latency_max": 0.0})
+            stats["turns"] += 1
+            stats["latency_total"] += seconds
+            stats["latency_max"] = max(stats["latency_max"], seconds)
+
+    def stats(self):
+        """Turns and latency per path, plus the fraction handled on the fast path."""
+        with self._lock:
+            paths = {path: dict(stats) for path, stats in self._stats.items()}
+        total = sum(stats["turns"] for stats in paths.values())
+        for stats in paths.values():
+            stats["latency_avg"] = stats["latency_total"] / stats["turns"]
+        fast = paths.get("fast", {}).get("turns", 0)
+        return {"paths": paths, "turns": total, "fast_path_fraction": fast / total if total else 0.0}
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """Returns the process-wide FastPathRouter."""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = FastPathRouter()
+    return _router
@@ -0,0 +1,132 @@
+import time
+from collections import OrderedDict
+
+
+class SessionCache:
+    """
+    LRU map of resident sessions bounded by count and approximate size.
+
+    Entries unused for ``idle_ttl`` seconds expire; when either
+    ``max_sessions`` or ``max_bytes`` is exceeded the least recently used
+    entries are evicted. Keys for which ``can_evict(key)`` is False (e.g.
+    sessions with unflushed writes) are skipped, so the limits can be
+    exceeded until ``trim()`` runs after they become evictable.
+    Sizes are caller-supplied estimates, not measured memory. Not
+    thread-safe; the session service uses it from the event loop only.
+    """
+
+    def __init__(self, max_sessions=10000, max_bytes=256 * 1024 * 1024, idle_ttl=1800.0, can_evict=None):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.can_evict = can_evict or (lambda key: True)
+        # key -> [value, size, last_access], least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is None:
+            self._stats["misses"] += 1
+            return None
+        if self.idle_ttl and now - entry[2] > self.idle_ttl and self.can_evict(key):
+            self._remove(key)
+            self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+            return None
+        entry[2] = now
+        self._entries.move_to_end(key)
+        self._stats["hits"] += 1
+        return entry[0]
+
+    def put(self, key, value, size):
+        """Inserts or replaces ``key`` and evicts down to the limits."""
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = [value, size, time.monotonic()]
+        self._bytes += size
+        self._evict(protect=key)
+        return value
+
+    def peek(self, key):
+        """Returns the value for ``key`` without touching its LRU position or stats."""
+        entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def setdefault(self, key, value, size):
+        existing = self.get(key)
+        return existing if existing is not None else self.put(key, value, size)
+
+    def resize(self, key, delta):
+        """Adjusts the size estimate of ``key`` after it grew."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry[1] += delta
+            self._bytes += delta
+            if self._bytes > self.max_bytes:
+                self._evict(protect=key)
+
+    def pop(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._remove(key)
+        return entry[0]
+
+    def values(self):
+        return [entry[0] for entry in self._entries.values()]
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[1]
+
+    def trim(self):
+        """Evicts down to the limits, e.g. once pinned entries became evictable."""
+        self._evict()
+
+    def _evict(self, protect=None):
+        # ``protect`` is the entry being inserted or grown; evicting it would
+        # hand the caller a session the cache no longer tracks.
+        while len(self._entries) > self.max_sessions or self._bytes > self.max_bytes:
+            for key in self._entries:
+                if key != protect and self.can_evict(key):
+                    break
+            else:
+                return
+            self._remove(key)
+            self._stats["evictions"] += 1
+
+    def expire(self):
+        """Drops entries idle for longer than ``idle_ttl``. Returns how many were dropped."""
+        if not self.idle_ttl:
+            return 0
+        cutoff = time.monotonic() - self.idle_ttl
+        expired = []
+        # Entries are kept in access order, so the scan stops at the first live one.
+        for key, entry in self._entries.items():
+            if entry[2] >= cutoff:
+                break
+            if self.can_evict(key):
+                expired.append(key)
+        for key in expired:
+            self._remove(key)
+        self._stats["expirations"] += len(expired)
+        return len(expired)
+
+    def stats(self):
+        snapshot = dict(self._stats)
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_rate"] = snapshot["hits"] / lookups if lookups else 0.0
+        snapshot["resident"] = len(self._entries)
+        snapshot["bytes"] = self._bytes
+        snapshot["max_sessions"] = self.max_sessions
+        snapshot["max_bytes"] = self.max_bytes
+        return snapshot
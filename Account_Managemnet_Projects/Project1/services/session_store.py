@@ -0,0 +1,737 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from types import MappingProxyType
+from typing import Any, Optional
+
+from services.settings import load_env
+from google.adk.errors.already_exists_error import AlreadyExistsError
+from google.adk.errors.session_not_found_error import SessionNotFoundError
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+from google.adk.sessions.state import State
+from services.logger import get_logger
+from services.session_cache import SessionCache
+from services.tracing import get_tracer
+
+# Load environment variables
+load_env()
+logger = get_logger()
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS adk_sessions (
+        app_name TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        session_id TEXT NOT NULL,
+        state TEXT NOT NULL,
+        last_update_time DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (app_name, user_id, session_id))""",
+    "CREATE INDEX IF NOT EXISTS adk_sessions_last_update ON adk_sessions (last_update_time)",
+    """CREATE TABLE IF NOT EXISTS adk_session_events (
+        app_name TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        session_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        event TEXT NOT NULL,
+        PRIMARY KEY (app_name, user_id, session_id, seq))""",
+    # App-scoped state is stored with user_id = ''.
+    """CREATE TABLE IF NOT EXISTS adk_scoped_state (
+        app_name TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        state TEXT NOT NULL,
+        PRIMARY KEY (app_name, user_id))""",
+)
+
+# Never written to the backend: credentials anywhere in state or events are
+# blanked, and the tool call waiting for its OTP (whose args carry them) is
+# dropped, so a session reloaded from storage has no operation in flight.
+CREDENTIAL_KEYS = frozenset({"password", "new_password"})
+TRANSIENT_STATE_KEYS = ("pending_tool", "pending_args", "otp_status")
+
+# Classes allowed in stored state, by name; see register_state_type.
+_state_types = {}
+
+
+def register_state_type(cls):
+    """
+    Lets instances of ``cls`` be kept in persisted session state. The class
+    must provide ``to_dict()`` and ``from_dict(data)``; it is stored as a
+    tagged JSON object and rebuilt on load. Nothing else is instantiated
+    from stored data.
+    """
+    _state_types[cls.__name__] = cls
+    return cls
+
+
+def _redact(value):
+    if isinstance(value, dict):
+        return {key: None if key in CREDENTIAL_KEYS else _redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_redact(item) for item in value]
+    return value
+
+
+def _encode_object(value):
+    cls = type(value)
+    if _state_types.get(cls.__name__) is not cls:
+        raise TypeError(f"{cls.__name__} is not a registered session state type")
+    return {"__type__": cls.__name__, "value": _redact(value.to_dict())}
+
+
+def _decode_object(data):
+    if "__type__" in data and set(data) == {"__type__", "value"}:
+        cls = _state_types.get(data["__type__"])
+        if cls is None:
+            raise ValueError(f"Unknown session state type: {data['__type__']}")
+        return cls.from_dict(data["value"])
+    return data
+
+
+def _dumps(value):
+    return json.dumps(_redact(value), default=_encode_object, separators=(",", ":"))
+
+
+def _loads(text):
+    return json.loads(text, object_hook=_decode_object)
+
+
+def encode_state(state):
+    """JSON for ``state`` as stored: credentials blanked, pending tool call cleared."""
+    return _dumps({key: None if key in TRANSIENT_STATE_KEYS else value for key, value in state.items()})
+
+
+def encode_event(event):
+    """JSON for ``event`` as stored, with credentials in call args and state deltas blanked."""
+    data = event.model_dump(mode="json", exclude_none=True, exclude={"actions": {"state_delta"}})
+    if event.actions and event.actions.state_delta:
+        data.setdefault("actions", {})["state_delta"] = event.actions.state_delta
+    return _dumps(data)
+
+
+def decode_event(text):
+    return Event.model_validate(_loads(text))
+
+
+class SQLSessionBackend(ABC):
+    """
+    Blocking storage for PersistentSessionService. State and events are
+    stored as JSON text (see encode_state and encode_event), one row per
+    event. Subclasses provide ``_connection()`` and the driver's placeholder.
+    """
+
+    durable = True
+    placeholder = "?"
+
+    def _sql(self, statement):
+        return statement.replace("?", self.placeholder)
+
+    @abstractmethod
+    def _connection(self):
+        """Context manager yielding a DB-API connection for one unit of work."""
+
+    def create_schema(self):
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            for statement in SCHEMA:
+                cursor.execute(statement)
+            conn.commit()
+
+    def insert_session(self, app_name, user_id, session_id, state, last_update_time):
+        """Returns False if the session already exists."""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                self._sql(
+                    "INSERT INTO adk_sessions (app_name, user_id, session_id, state, last_update_time) "
+                    "VALUES (?, ?, ?, ?, ?) ON CONFLICT DO NOTHING"
+                ),
+                (app_name, user_id, session_id, state, last_update_time),
+            )
+            inserted = cursor.rowcount == 1
+            conn.commit()
+        return inserted
+
+    def load_session(self, app_name, user_id, session_id):
+        """Returns (state, last_update_time, [event_json, ...]) or None."""
+        key = (app_name, user_id, session_id)
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                self._sql(
+                    "SELECT state, last_update_time FROM adk_sessions "
+                    "WHERE app_name = ? AND user_id = ? AND session_id = ?"
+                ),
+                key,
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            cursor.execute(
+                self._sql(
+                    "SELECT event FROM adk_session_events "
+                    "WHERE app_name = ? AND user_id = ? AND session_id = ? ORDER BY seq"
+                ),
+                key,
+            )
+            events = [event for (event,) in cursor.fetchall()]
+        return row[0], row[1], events
+
+    def load_scoped_state(self, app_name, user_id):
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                self._sql("SELECT state FROM adk_scoped_state WHERE app_name = ? AND user_id = ?"),
+                (app_name, user_id),
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def list_sessions(self, app_name, user_id=None):
+        """Returns [(user_id, session_id, state, last_update_time), ...]."""
+        query = "SELECT user_id, session_id, state, last_update_time FROM adk_sessions WHERE app_name = ?"
+        params = [app_name]
+        if user_id is not None:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self._sql(query), params)
+            return cursor.fetchall()
+
+    def delete_session(self, app_name, user_id, session_id):
+        key = (app_name, user_id, session_id)
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                self._sql("DELETE FROM adk_session_events WHERE app_name = ? AND user_id = ? AND session_id = ?"), key
+            )
+            cursor.execute(
+                self._sql("DELETE FROM adk_sessions WHERE app_name = ? AND user_id = ? AND session_id = ?"), key
+            )
+            conn.commit()
+
+    def prune(self, before):
+        """Deletes sessions last updated before ``before`` and their events; returns how many."""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                self._sql(
+                    "DELETE FROM adk_session_events WHERE (app_name, user_id, session_id) IN "
+                    "(SELECT app_name, user_id, session_id FROM adk_sessions WHERE last_update_time < ?)"
+                ),
+                (before,),
+            )
+            cursor.execute(self._sql("DELETE FROM adk_sessions WHERE last_update_time < ?"), (before,))
+            pruned = cursor.rowcount
+            conn.commit()
+        return pruned
+
+    def write_batch(self, sessions, events, scoped):
+        """
+        Writes one flush of dirty sessions in a single transaction:
+        ``sessions`` are (app_name, user_id, session_id, state, last_update_time)
+        upserts, ``events`` are (app_name, user_id, session_id, seq, event_json)
+        appends and ``scoped`` are (app_name, user_id, state) upserts.
+        """
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            if sessions:
+                cursor.executemany(
+                    self._sql(
+                        "INSERT INTO adk_sessions (app_name, user_id, session_id, state, last_update_time) "
+                        "VALUES (?, ?, ?, ?, ?) ON CONFLICT (app_name, user_id, session_id) "
+                        "DO UPDATE SET state = excluded.state, last_update_time = excluded.last_update_time"
+                    ),
+                    sessions,
+                )
+            if events:
+                cursor.executemany(
+                    self._sql(
+                        "INSERT INTO adk_session_events (app_name, user_id, session_id, seq, event) "
+                        "VALUES (?, ?, ?, ?, ?) ON CONFLICT DO NOTHING"
+                    ),
+                    events,
+                )
+            if scoped:
+                cursor.executemany(
+                    self._sql(
+                        "INSERT INTO adk_scoped_state (app_name, user_id, state) VALUES (?, ?, ?) "
+                        "ON CONFLICT (app_name, user_id) DO UPDATE SET state = excluded.state"
+                    ),
+                    scoped,
+                )
+            conn.commit()
+
+    def close(self):
+        pass
+
+
+class SQLiteSessionBackend(SQLSessionBackend):
+    """Single-file backend for local development."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._lock = threading.Lock()
+        self.create_schema()
+
+    @contextmanager
+    def _connection(self):
+        with self._lock:
+            try:
+                yield self._conn
+            except Exception:
+                self._conn.rollback()
+                raise
+
+    def close(self):
+        self._conn.close()
+
+
+class PostgresSessionBackend(SQLSessionBackend):
+    """Backend on the shared psycopg2 pool, for multi-worker deployments."""
+
+    placeholder = "%s"
+
+    def __init__(self, pool=None):
+        from services.db_pool import get_pool
+
+        self.pool = pool or get_pool()
+        self.create_schema()
+
+    @contextmanager
+    def _connection(self):
+        # The pool rolls back anything left uncommitted on release.
+        with self.pool.connection() as conn:
+            yield conn
+
+
+class MemorySessionBackend:
+    """
+    Non-durable backend: sessions exist only in the service's cache, so
+    expired or evicted sessions are gone, as with InMemorySessionService.
+    """
+
+    durable = False
+
+    def insert_session(self, app_name, user_id, session_id, state, last_update_time):
+        return True
+
+    def load_session(self, app_name, user_id, session_id):
+        return None
+
+    def load_scoped_state(self, app_name, user_id):
+        return None
+
+    def list_sessions(self, app_name, user_id=None):
+        return []
+
+    def delete_session(self, app_name, user_id, session_id):
+        pass
+
+    def prune(self, before):
+        return 0
+
+    def write_batch(self, sessions, events, scoped):
+        pass
+
+    def close(self):
+        pass
+
+
+def _event_size(event):
+    """Rough resident size of an event: its text, call args and state delta plus fixed overhead."""
+    size = 512
+    if event.content and event.content.parts:
+        for part in event.content.parts:
+            size += len(part.text or "")
+            if part.function_call:
+                size += len(str(part.function_call.args))
+    if event.actions and event.actions.state_delta:
+        size += len(repr(event.actions.state_delta))
+    return size
+
+
+class PersistentSessionService(BaseSessionService):
+    """
+    ADK session service with a bounded hot cache in front of ``backend``;
+    with a SQL backend sessions survive restarts.
+
+    create_session and delete_session write through; append_event only
+    updates the cache and marks the session dirty, and a background task
+    writes new events and the state of all dirty sessions in one batch
+    every ``flush_interval`` seconds, or as soon as ``flush_batch`` sessions
+    are dirty. ``flush()`` forces a write. What is written never holds
+    credentials or a pending tool call (see encode_state), so a session
+    reloaded after a restart or eviction asks for the operation again.
+    The same task deletes stored sessions not updated for ``retention``
+    seconds, checking every ``prune_interval`` seconds.
+
+    The cache (a SessionCache) holds at most ``max_sessions`` sessions and
+    about ``max_bytes`` of state and events, evicting least recently used
+    ones and expiring sessions idle for ``idle_ttl`` seconds; sessions with
+    unflushed writes stay resident until flushed. Evicted sessions reload
+    from the backend on next use, except with MemorySessionBackend.
+
+    Sessions handed out are light copies (own events list and state dict,
+    shared values), as with InMemorySessionService's light-copy mode. The
+    cache assumes a session is served by one worker at a time (sticky
+    routing); other workers see its changes after the next flush.
+    """
+
+    def __init__(self, backend, flush_interval=0.5, flush_batch=100, max_sessions=10000,
+                 max_bytes=256 * 1024 * 1024, idle_ttl=1800.0, retention=7 * 86400.0, prune_interval=3600.0):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        # Stored sessions must outlive resident ones, or a session could be pruned while in use.
+        self.retention = max(retention, idle_ttl)
+        self.prune_interval = prune_interval
+        self._next_prune = time.monotonic() + prune_interval
+        # (app_name, user_id, session_id) -> [Session, persisted event count]
+        self._sessions = SessionCache(max_sessions, max_bytes, idle_ttl, can_evict=self._can_evict)
+        # (app_name, user_id) -> dict; user_id '' holds app-scoped state
+        self._scoped = {}
+        self._dirty = set()
+        self._dirty_scoped = set()
+        self._flushing = set()
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._flusher = None
+        self._closing = False
+        self._stats = {"flushes": 0, "flush_errors": 0, "sessions_written": 0, "events_written": 0,
+                       "flush_time_total": 0.0, "sessions_pruned": 0, "prune_errors": 0}
+
+    # --- cache helpers ---
+
+    async def _call(self, fn, *args):
+        # Durable backends block on I/O; the memory backend returns immediately.
+        if self.backend.durable:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    def _can_evict(self, key):
+        return key not in self._dirty and key not in self._flushing
+
+    def _copy(self, session, events=None):
+        copied = session.model_copy(update={"events": list(session.events if events is None else events)})
+        copied.state = dict(session.state)
+        return copied
+
+    async def _scoped_state(self, app_name, user_id):
+        key = (app_name, user_id)
+        state = self._scoped.get(key)
+        if state is None:
+            stored = await self._call(self.backend.load_scoped_state, app_name, user_id)
+            state = self._scoped.setdefault(key, _loads(stored) if stored else {})
+        return state
+
+    async def _merge_state(self, session):
+        app_state = await self._scoped_state(session.app_name, "")
+        user_state = await self._scoped_state(session.app_name, session.user_id)
+        for key, value in app_state.items():
+            session.state[State.APP_PREFIX + key] = value
+        for key, value in user_state.items():
+            session.state[State.USER_PREFIX + key] = value
+        return session
+
+    def _apply_scoped_delta(self, app_name, user_id, delta):
+        for key, value in delta.items():
+            if key.startswith(State.APP_PREFIX):
+                scope, name = (app_name, ""), key[len(State.APP_PREFIX):]
+            elif key.startswith(State.USER_PREFIX):
+                scope, name = (app_name, user_id), key[len(State.USER_PREFIX):]
+            else:
+                continue
+            self._scoped.setdefault(scope, {})[name] = value
+            self._dirty_scoped.add(scope)
+
+    async def _load(self, app_name, user_id, session_id):
+        key = (app_name, user_id, session_id)
+        entry = self._sessions.get(key)
+        if entry is not None:
+            return entry
+        row = await self._call(self.backend.load_session, app_name, user_id, session_id)
+        if row is None:
+            return None
+        state, last_update_time, events = row
+        session = Session(
+            app_name=app_name,
+            user_id=user_id,
+            id=session_id,
+            state=_loads(state),
+            events=[decode_event(event) for event in events],
+            last_update_time=last_update_time,
+        )
+        # Another request may have loaded it while this one waited on the backend.
+        size = len(state) + sum(len(event) for event in events)
+        return self._sessions.setdefault(key, [session, len(events)], size)
+
+    # --- BaseSessionService ---
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        session_id = session_id.strip() if session_id else str(uuid.uuid4())
+        key = (app_name, user_id, session_id)
+        if key in self._sessions:
+            raise AlreadyExistsError(f"Session with id {session_id} already exists.")
+        state = dict(state or {})
+        scoped = {k: state.pop(k) for k in list(state) if k.startswith((State.APP_PREFIX, State.USER_PREFIX))}
+        for key in [k for k in state if k.startswith(State.TEMP_PREFIX)]:
+            state.pop(key)
+        session = Session(app_name=app_name, user_id=user_id, id=session_id, state=state, last_update_time=time.time())
+        stored = encode_state(state)
+        inserted = await self._call(
+            self.backend.insert_session, app_name, user_id, session_id, stored, session.last_update_time
+        )
+        if not inserted:
+            raise AlreadyExistsError(f"Session with id {session_id} already exists.")
+        self._sessions.put(key, [session, 0], len(stored))
+        if scoped:
+            self._apply_scoped_delta(app_name, user_id, scoped)
+        self._schedule_flush()
+        return await self._merge_state(self._copy(session))
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        entry = await self._load(app_name, user_id, session_id.strip())
+        if entry is None:
+            return None
+        session = entry[0]
+        events = session.events
+        if config:
+            if config.num_recent_events is not None:
+                events = events[-config.num_recent_events:] if config.num_recent_events else []
+            if config.after_timestamp is not None:
+                events = [e for e in events if e.timestamp >= config.after_timestamp]
+        return await self._merge_state(self._copy(session, events))
+
+    async def get_state(self, *, app_name: str, user_id: str, session_id: str):
+        """
+        Read-only view of a session's own state (without ``app:``/``user:``
+        keys), or None if the session does not exist. Nothing is copied, so
+        this is the cheap way to inspect state; changes still go through
+        append_event.
+        """
+        entry = await self._load(app_name, user_id, session_id.strip())
+        return MappingProxyType(entry[0].state) if entry is not None else None
+
+    async def list_sessions(self, *, app_name: str, user_id: Optional[str] = None) -> ListSessionsResponse:
+        await self.flush()
+        rows = await self._call(self.backend.list_sessions, app_name, user_id)
+        found = {}
+        for uid, sid, state, last_update_time in rows:
+            found[(uid, sid)] = Session(app_name=app_name, user_id=uid, id=sid, state=_loads(state),
+                                        last_update_time=last_update_time)
+        # Resident sessions are at least as fresh as their stored rows.
+        for session, _ in self._sessions.values():
+            if session.app_name == app_name and (user_id is None or session.user_id == user_id):
+                found[(session.user_id, session.id)] = self._copy(session, [])
+        sessions = [await self._merge_state(session) for session in found.values()]
+        sessions.sort(key=lambda s: (s.last_update_time, s.user_id, s.id))
+        return ListSessionsResponse(sessions=sessions)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        key = (app_name, user_id, session_id.strip())
+        self._sessions.pop(key, None)
+        self._dirty.discard(key)
+        get_tracer().clear_session_tier(key[2])
+        await self._call(self.backend.delete_session, *key)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+        key = (session.app_name, session.user_id, session.id)
+        entry = await self._load(*key)
+        if entry is None:
+            raise SessionNotFoundError(f"Session {session.id} not found.")
+        stored = entry[0]
+        if any(e == event for e in stored.events if e.id == event.id):
+            return event
+
+        await super().append_event(session=session, event=event)
+        session.last_update_time = event.timestamp
+        if stored is not session:
+            stored.events.append(event)
+            stored.last_update_time = event.timestamp
+        if event.actions and event.actions.state_delta:
+            delta = event.actions.state_delta
+            self._apply_scoped_delta(session.app_name, session.user_id, delta)
+            stored.state.update(
+                {k: v for k, v in delta.items() if not k.startswith((State.APP_PREFIX, State.USER_PREFIX))}
+            )
+
+        if self.backend.durable:
+            self._dirty.add(key)
+        self._sessions.resize(key, _event_size(event))
+        self._schedule_flush()
+        return event
+
+    # --- write-behind ---
+
+    def _schedule_flush(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+        if len(self._dirty) >= self.flush_batch:
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self._sessions.expire()
+            await self.flush()
+            if time.monotonic() >= self._next_prune:
+                await self.prune()
+
+    async def prune(self) -> int:
+        """Deletes stored sessions not updated for ``retention`` seconds; returns how many."""
+        self._next_prune = time.monotonic() + self.prune_interval
+        try:
+            pruned = await self._call(self.backend.prune, time.time() - self.retention)
+        except Exception as e:
+            self._stats["prune_errors"] += 1
+            logger.error(f"Session store prune failed: {e}", exc_info=True)
+            return 0
+        self._stats["sessions_pruned"] += pruned
+        if pruned:
+            logger.info(f"Pruned {pruned} stored sessions idle for over {self.retention:.0f} s.")
+        return pruned
+
+    async def flush(self) -> None:
+        """Writes every dirty session and scoped state to the backend now."""
+        async with self._flush_lock:
+            if not self._dirty and not self._dirty_scoped:
+                return
+            dirty, self._dirty = self._dirty, set()
+            dirty_scoped, self._dirty_scoped = self._dirty_scoped, set()
+            # Sessions being written must not be evicted before the write lands.
+            self._flushing = dirty
+
+            # Snapshot on the event loop so no append interleaves with encoding.
+            sessions, events, persisted = [], [], {}
+            for key in dirty:
+                entry = self._sessions.peek(key)
+                if entry is None:
+                    continue
+                session, written = entry
+                try:
+                    state = encode_state(session.state)
+                    new_events = [(*key, seq, encode_event(event))
+                                  for seq, event in enumerate(session.events[written:], start=written)]
+                except (TypeError, ValueError) as e:
+                    # Retrying cannot help; leave the session out of storage rather than block the batch.
+                    self._stats["flush_errors"] += 1
+                    logger.error(f"Session {key[2]} cannot be stored: {e}")
+                    continue
+                sessions.append((*key, state, session.last_update_time))
+                events.extend(new_events)
+                persisted[key] = len(session.events)
+            scoped = [(*scope, _dumps(self._scoped[scope])) for scope in dirty_scoped]
+
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.backend.write_batch, sessions, events, scoped)
+            except Exception as e:
+                # Keep everything dirty; the next flush retries the whole batch.
+                self._dirty |= dirty
+                self._dirty_scoped |= dirty_scoped
+                self._stats["flush_errors"] += 1
+                logger.error(f"Session store flush failed for {len(dirty)} sessions: {e}", exc_info=True)
+                return
+            finally:
+                self._flushing = set()
+            for key, count in persisted.items():
+                entry = self._sessions.peek(key)
+                if entry is not None:
+                    entry[1] = count
+            self._sessions.trim()
+            self._stats["flushes"] += 1
+            self._stats["sessions_written"] += len(sessions)
+            self._stats["events_written"] += len(events)
+            self._stats["flush_time_total"] += time.perf_counter() - start
+
+    def stats(self):
+        snapshot = dict(self._stats)
+        snapshot["dirty_sessions"] = len(self._dirty)
+        snapshot["cache"] = self._sessions.stats()
+        return snapshot
+
+    async def close(self):
+        # Let the flusher finish its current batch rather than cancelling it mid-write.
+        self._closing = True
+        self._wakeup.set()
+        if self._flusher is not None:
+            await self._flusher
+            self._flusher = None
+        await self.flush()
+        self.backend.close()
+
+
+_session_service = None
+_session_service_lock = threading.Lock()
+
+
+def get_session_service():
+    """
+    Returns the process-wide session service selected by SESSION_STORE:
+    memory (default), sqlite (SESSION_STORE_PATH) or postgres (the DB_*
+    database). Built on first use, so importing the app opens nothing.
+    """
+    global _session_service
+    if _session_service is None:
+        with _session_service_lock:
+            if _session_service is None:
+                kind = os.getenv("SESSION_STORE", "memory").lower()
+                if kind == "memory":
+                    backend = MemorySessionBackend()
+                elif kind == "sqlite":
+                    backend = SQLiteSessionBackend(os.getenv("SESSION_STORE_PATH", "sessions.db"))
+                elif kind == "postgres":
+                    backend = PostgresSessionBackend()
+                else:
+                    raise ValueError(f"Unknown SESSION_STORE: {kind}")
+                logger.info(f"Using {kind} session store.")
+                _session_service = PersistentSessionService(
+                    backend,
+                    flush_interval=float(os.getenv("SESSION_FLUSH_INTERVAL", 0.5)),
+                    flush_batch=int(os.getenv("SESSION_FLUSH_BATCH", 100)),
+                    max_sessions=int(os.getenv("SESSION_CACHE_MAX_SESSIONS", 10000)),
+                    max_bytes=int(float(os.getenv("SESSION_CACHE_MAX_MB", 256)) * 1024 * 1024),
+                    idle_ttl=float(os.getenv("SESSION_IDLE_TTL", 1800)),
+                    retention=float(os.getenv("SESSION_RETENTION", 7 * 86400)),
+                )
+    return _session_service
+
+
+async def close_session_service():
+    """Flushes pending writes and stops the background flusher, if the service was built."""
+    global _session_service
+    with _session_service_lock:
+        session_service, _session_service = _session_service, None
+    if session_service is not None:
+        await session_service.close()
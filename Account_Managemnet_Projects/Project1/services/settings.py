@@ -0,0 +1,55 @@
+import os
+import threading
+
+from dotenv import load_dotenv
+
+_env_loaded = False
+
+
+def load_env():
+    """Reads .env into the environment once per process; later calls return at once."""
+    global _env_loaded
+    if not _env_loaded:
+        load_dotenv()
+        _env_loaded = True
+
+
+# Load environment variables
+load_env()
+
+
+class Settings:
+    """
+    Database settings read from the environment once at startup.
+
+    Hot paths use the attributes here instead of calling os.getenv on every
+    query.
+    """
+
+    def __init__(self):
+        self.db_name = os.getenv("DB_NAME")
+        self.db_user = os.getenv("DB_USER")
+        self.db_password = os.getenv("DB_PASSWORD")
+        self.db_host = os.getenv("DB_HOST")
+        self.db_port = int(os.getenv("DB_PORT", 5432))
+        self.db_sslmode = os.getenv("DB_SSLMODE", "require")
+        self.db_table_name = os.getenv("DB_TABLE_NAME")
+        self.db_pool_min_size = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+        self.db_pool_max_size = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+        self.db_pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", 5))
+        self.db_pool_health_check_idle = float(os.getenv("DB_POOL_HEALTH_CHECK_IDLE", 30))
+        self.db_statement_cache_size = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+
+
+_settings = None
+_settings_lock = threading.Lock()
+
+
+def get_settings():
+    """Returns the process-wide Settings, loading them on first use."""
+    global _settings
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                _settings = Settings()
+    return _settings
@@ -0,0 +1,129 @@
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from services.settings import load_env
+from services.logger import get_logger, session_id_var
+
+# Load environment variables
+load_env()
+logger = get_logger()
+
+# Verbosity tiers, from cheapest to most expensive.
+TRACE_OFF = 0
+TRACE_BASIC = 1      # one line per request / tool call
+TRACE_DETAILED = 2   # per-event summaries, prompts, message parts
+TRACE_FULL = 3       # full event, tool context and session state dumps
+
+TIER_NAMES = {"off": TRACE_OFF, "basic": TRACE_BASIC, "detailed": TRACE_DETAILED, "full": TRACE_FULL}
+
+
+class Tracer:
+    """
+    Decides per session which trace tier is enabled.
+
+    Every session gets ``default_tier``; a deterministic ``sample_rate``
+    fraction of sessions gets ``sampled_tier``; and individual sessions can
+    be switched to any tier on demand. Per-session overrides last
+    ``override_ttl`` seconds and at most ``max_overrides`` are kept, oldest
+    dropped first. Messages are built by a callback that only runs when the
+    tier is enabled, so disabled tiers cost one integer comparison and
+    never serialize events or state.
+    """
+
+    def __init__(self, default_tier=TRACE_BASIC, sample_rate=0.0, sampled_tier=TRACE_FULL,
+                 max_overrides=1000, override_ttl=1800.0):
+        self.default_tier = default_tier
+        self.sample_rate = sample_rate
+        self.sampled_tier = sampled_tier
+        self.max_overrides = max_overrides
+        self.override_ttl = override_ttl
+        # session_id -> (tier, expires_at), oldest first
+        self._overrides = OrderedDict()
+        self._lock = threading.Lock()
+        self._update_max_tier()
+
+    def _update_max_tier(self):
+        tiers = [self.default_tier, *(tier for tier, _ in self._overrides.values())]
+        if self.sample_rate > 0:
+            tiers.append(self.sampled_tier)
+        self._max_tier = max(tiers)
+
+    def _expire(self, now):
+        # Entries are kept in insertion order, and all share one TTL.
+        while self._overrides:
+            session_id, (_, expires_at) = next(iter(self._overrides.items()))
+            if expires_at > now:
+                break
+            del self._overrides[session_id]
+
+    def set_session_tier(self, session_id, tier):
+        now = time.monotonic()
+        with self._lock:
+            self._overrides.pop(session_id, None)
+            self._overrides[session_id] = (tier, now + self.override_ttl)
+            self._expire(now)
+            while len(self._overrides) > self.max_overrides:
+                self._overrides.popitem(last=False)
+            self._update_max_tier()
+
+    def clear_session_tier(self, session_id):
+        with self._lock:
+            self._overrides.pop(session_id, None)
+            self._expire(time.monotonic())
+            self._update_max_tier()
+
+    def _is_sampled(self, session_id):
+        return (zlib.crc32(session_id.encode("utf-8")) % 10000) < self.sample_rate * 10000
+
+    def session_tier(self, session_id):
+        override = self._overrides.get(session_id)
+        if override is not None and override[1] > time.monotonic():
+            return override[0]
+        if session_id and self.sample_rate > 0 and self._is_sampled(session_id):
+            return max(self.default_tier, self.sampled_tier)
+        return self.default_tier
+
+    def enabled(self, tier):
+        """True if ``tier`` is enabled for the session of the current request."""
+        if tier <= self.default_tier:
+            return True
+        if tier > self._max_tier:
+            return False
+        return tier <= self.session_tier(session_id_var.get())
+
+    def trace(self, tier, build_message, *args):
+        """Logs ``build_message(*args)`` at INFO if ``tier`` is enabled."""
+        if self.enabled(tier) and logger.isEnabledFor(logging.INFO):
+            logger.info(build_message(*args))
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """Returns the process-wide Tracer configured from TRACE_* settings."""
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = Tracer(
+                    default_tier=TIER_NAMES[os.getenv("TRACE_TIER", "basic").lower()],
+                    sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", 0)),
+                    sampled_tier=TIER_NAMES[os.getenv("TRACE_SAMPLED_TIER", "full").lower()],
+                    max_overrides=int(os.getenv("TRACE_MAX_OVERRIDES", 1000)),
+                    override_ttl=float(os.getenv("TRACE_OVERRIDE_TTL", 1800)),
+                )
+    return _tracer
+
+
+def trace_enabled(tier):
+    return get_tracer().enabled(tier)
+
+
+def trace(tier, build_message, *args):
+    get_tracer().trace(tier, build_message, *args)
@@ -1,32 +1,35 @@
 from google.genai import types
-import random
-import smtplib
+from google.adk.agents.run_config import RunConfig, StreamingMode
+import asyncio
 import random
 import os
-from email.message import EmailMessage
 from services.logger import get_logger
-from services.db_service import DBService
-from dotenv import load_dotenv
+from services.tracing import TRACE_DETAILED, TRACE_FULL, trace, trace_enabled
+from services.mailer import get_outbox
+from services.metrics import AGENT_RUN_ERRORS, AGENT_RUN_EVENTS, AGENT_RUN_SECONDS, SEND_OTP_SECONDS
+from services.router import get_router
+from services.otp_manager import OTP_EXPIRED, OTP_LOCKED, OTP_PENDING, OTP_VERIFIED, get_otp_manager
+from services.async_db_service import get_async_db
 
 import time
 
 
 
 logger = get_logger()
-db = DBService()
 
 
 async def process_agent_response(event):
     """Process and return agent's final response text."""
-    logger.info(f"process_agent_response: Event ID: {event.id}, Author: {event.author}")
+    trace(TRACE_DETAILED, "process_agent_response: Event ID: {}, Author: {}".format, event.id, event.author)
     final_response = "Not able to process the request"
     if not event.content or not event.content.parts:
-        logger.info("process_agent_response: No content parts in event")
+        trace(TRACE_DETAILED, "process_agent_response: No content parts in event".format)
         return None
 
-    for idx, part in enumerate(event.content.parts):
-        if hasattr(part, "text") and part.text and not part.text.isspace():
-            logger.info(f"process_agent_response: Part {idx}: '{part.text.strip()}'")
+    if trace_enabled(TRACE_DETAILED):
+        for idx, part in enumerate(event.content.parts):
+            if hasattr(part, "text") and part.text and not part.text.isspace():
+                logger.info(f"process_agent_response: Part {idx}: '{part.text.strip()}'")
 
     if event.is_final_response():
         for part in event.content.parts:
@@ -40,36 +43,66 @@ async def process_agent_response(event):
 
 
 
-async def call_agent_async(runner, user_id, session_id, query):
-    """Call the agent asynchronously with the user's query."""
+async def stream_agent_async(runner, user_id, session_id, query, streaming=True):
+    """
+    Runs the agent on the user's query and yields what happens as dicts:
+    {"type": "text"} chunks of partial model text (only when ``streaming``),
+    {"type": "tool_start"} / {"type": "tool_end"} markers with the tool name,
+    and finally {"type": "final", "text": <final response or None>}.
+    """
     content = types.Content(role="user", parts=[types.Part(text=query)])
-    
+    run_config = RunConfig(streaming_mode=StreamingMode.SSE if streaming else StreamingMode.NONE)
+
     final_response_text = None
     agent_name = None
     logger.info(f"call_agent_async: Query: {query}")
+    started = time.perf_counter()
+    events = 0
     try:
-        logger.info(f"call_agent_async: user_id: {user_id}  session_id: {session_id}  content: {content}")
+        trace(TRACE_DETAILED, "call_agent_async: user_id: {}  session_id: {}  content: {}".format, user_id, session_id, content)
         async for event in runner.run_async(
             user_id=user_id, 
             session_id=session_id, 
             new_message=content,
-            
+            run_config=run_config,
         ):
+            events += 1
+            if event.partial:
+                # Streamed chunk; the complete text arrives again in the final event.
+                if event.content and event.content.parts:
+                    text = "".join(part.text for part in event.content.parts if part.text)
+                    if text:
+                        yield {"type": "text", "text": text}
+                continue
             # Capture the agent name from the event if available
-            logger.info(f"call_agent_async: Event: {vars(event)}")
+            trace(TRACE_FULL, "call_agent_async: Event: {}".format, vars(event))
             if event.author:
                 agent_name = event.author
-            logger.info(f"call_agent_async: user_id: Waiting response from agent: {agent_name}")
+            for call in event.get_function_calls():
+                yield {"type": "tool_start", "tool": call.name}
+            for function_response in event.get_function_responses():
+                yield {"type": "tool_end", "tool": function_response.name}
+            trace(TRACE_DETAILED, "call_agent_async: user_id: Waiting response from agent: {}".format, agent_name)
             response = await process_agent_response(event)
-            logger.info(f"call_agent_async: Agent Response: {response}")
+            trace(TRACE_DETAILED, "call_agent_async: Agent Response: {}".format, response)
             if response:
                 final_response_text = response
-        return final_response_text
     except Exception as e:
+        AGENT_RUN_ERRORS.inc()
         msg = f"ERROR during agent run: {e}"
         logger.info(msg)
         print(msg)
-        return
+    # Includes the time the caller spends on streamed chunks, which is small next to the model.
+    AGENT_RUN_SECONDS.observe(time.perf_counter() - started)
+    AGENT_RUN_EVENTS.observe(events)
+    yield {"type": "final", "text": final_response_text}
+
+
+async def call_agent_async(runner, user_id, session_id, query):
+    """Call the agent asynchronously with the user's query."""
+    async for item in stream_agent_async(runner, user_id, session_id, query, streaming=False):
+        if item["type"] == "final":
+            return item["text"]
     
 
 #async def call_custom_async(runner, user_id, session_id, query):
@@ -78,11 +111,12 @@ async def call_custom_async(runner, state, user_id, session_id, pending_tool, pe
     
     final_response_text = None
     agent_name = None
-    logger.info(f"call_custom_async: Query: {message} and state {state}")
+    logger.info(f"call_custom_async: Query: {message}")
+    trace(TRACE_FULL, "call_custom_async: state {}".format, state)
     try:
 
         new_message=types.Content(role="model",parts=[types.Part(function_call=types.FunctionCall(name=pending_tool,args=pending_args))])
-        logger.info(f"call_custom_async: user_id: {user_id}  session_id: {session_id}  content: {new_message}")
+        trace(TRACE_DETAILED, "call_custom_async: user_id: {}  session_id: {}  content: {}".format, user_id, session_id, new_message)
         
                  
         async for event in runner.run_async(
@@ -92,13 +126,13 @@ async def call_custom_async(runner, state, user_id, session_id, pending_tool, pe
             
         ):
             # Capture the agent name from the event if available
-            logger.info(f"FULL EVENT DUMP: {event}")
+            trace(TRACE_FULL, "FULL EVENT DUMP: {}".format, event)
             #logger.info(f"call_agent_async: Event: {vars(event)}")
             if event.author:
                 agent_name = event.author
-            logger.info(f"call_agent_async: user_id: Waiting response from agent: {agent_name}")
+            trace(TRACE_DETAILED, "call_agent_async: user_id: Waiting response from agent: {}".format, agent_name)
             response = await process_agent_response(event)
-            logger.info(f"call_agent_async: Agent Response: {response}")
+            trace(TRACE_DETAILED, "call_agent_async: Agent Response: {}".format, response)
             if response:
                 final_response_text = response
         return final_response_text
@@ -116,19 +150,7 @@ def set_intent(message, session):
     Set the intent for account management based on user input.
     '''
     try:
-        msg_lower = message.lower()
-        session.state["intent"] = None
-
-        if "update address" in msg_lower:
-            session.state["intent"] = "update_address"
-        elif "update email" in msg_lower:
-            session.state["intent"] = "update_email"
-        elif "update password" in msg_lower:
-            session.state["intent"] = "update_password"
-        elif "update contact" in msg_lower:
-            session.state["intent"] = "update_contact"
-        elif "create account" in msg_lower:
-            session.state["intent"] = "create_account"
+        session.state["intent"] = get_router().detect_intent(message)
 
     except Exception as e:
         msg = f"ERROR int set_intent: {e}"
@@ -152,18 +174,17 @@ def update_customer_data(user_details, customer):
 
 
 def send_otp(recipient_email, otp):
-    logger.info(f"send_otp: Sending OTP to {recipient_email}")
-    msg = EmailMessage()
-    msg.set_content(f"Your OTP is: {otp}")
-    msg['Subject'] = 'Your OTP for Account Verification'
-    msg['From'] = os.getenv("EMAIL_SENDER")
-    msg['To'] = recipient_email
-    
-    with smtplib.SMTP(os.getenv("SMTP_SERVER"), int(os.getenv("SMTP_PORT"))) as server:
-        server.starttls()
-        server.login(os.getenv("EMAIL_SENDER"), os.getenv("SMTP_PASSWORD"))
-        server.send_message(msg)
-    logger.info(f"send_otp: Sending OTP with message  {msg}")
+    """
+    Queues the OTP email on the outbox and returns immediately; delivery
+    happens on background workers over pooled SMTP connections.
+    """
+    logger.info(f"send_otp: Queueing OTP to {recipient_email}")
+    start = time.perf_counter()
+    try:
+        if not get_outbox().enqueue(recipient_email, otp):
+            raise RuntimeError("OTP outbox is full")
+    finally:
+        SEND_OTP_SECONDS.observe(time.perf_counter() - start)
     return 
 
 
@@ -182,53 +203,53 @@ def get_instruction():
          
         
         """
-    logger.info(f"Instruction {instruction}")
+    trace(TRACE_DETAILED, "Instruction {}".format, instruction)
     return instruction
 
 
-def verify_otp(state, user_otp_input, tool_name):
+def otp_challenge_id(customer):
+    """OTP challenges are per chat session; one is outstanding at a time."""
+    return f"{customer.app_name}:{customer.user_id}:{customer.session_id}"
+
+
+async def verify_otp(state, user_otp_input, tool_name):
     """
-    Verifies the OTP for a given username using session state.
-    Returns a structured response indicating next action.
+    Verifies the OTP for the session's pending tool with the OTP manager.
+    Returns {"status", "message"}; status is OTP_PENDING while attempts remain.
     """
     customer = state.get("customer", {})
     
     username = customer.username
-    logger.info(f"verify_otp for {username} and state {state}")
+    logger.info(f"verify_otp for {username}")
+    trace(TRACE_FULL, "verify_otp: state {}".format, state)
 
-    
-    # Check OTP expiration
-    #timestamp = otp_info.get("timestamp")
-    #if not timestamp or time.datetime.now() > timestamp + time.timedelta(minutes=otp_expiry_minutes):
-    #   logger.info(f"OTP for {username} expired.")
-    #    state.pop(username, None)
-    #    return {
-    #        "status": "AUTH_REQUIRED",
-    #        "message": "Your OTP has expired. Please start authentication again."
-    #    }
-
-    # Check user input
-    generated_otp = state["generated_otp"]
-    logger.info(f"verify_otp:  for generated_otp={generated_otp} and user_otp_input={user_otp_input}")
-    
-    if user_otp_input != generated_otp:
+    result = await asyncio.to_thread(get_otp_manager().verify, otp_challenge_id(customer), user_otp_input)
+    status = result["status"]
+    logger.info(f"verify_otp: {status} for {username}")
+
+    if status == OTP_PENDING:
         return {
-            "status": "OTP_PENDING",
-            "message": "Invalid OTP. Please try again."
+            "status": status,
+            "message": f"Invalid OTP. Please try again ({result['attempts_left']} attempt(s) left)."
         }
+    if status == OTP_EXPIRED:
+        return {"status": status, "message": "Your OTP has expired. Please start again."}
+    if status == OTP_LOCKED:
+        return {"status": status, "message": "Too many invalid OTP attempts. Please start again."}
+    if status != OTP_VERIFIED:
+        return {"status": status, "message": "Your OTP has expired or was already used. Please start again."}
 
     # OTP verified successfully
     logger.info(f"OTP for {username} verified successfully.")
-    state.pop(username, None)
-    state["otp_status"] = "OPT_VERIFIED_SUCCESS"
+    state["otp_status"] = OTP_VERIFIED
     
     return {
-        "status": "OPT_VERIFIED_SUCCESS",
+        "status": status,
         "message": f"OTP verified. Proceeding with {tool_name}.",
     }
 
 
-def update_customer_account(state: dict) -> str:
+async def update_customer_account(state: dict) -> str:
     tool_name = state["pending_tool"]
     pending_args = state["pending_args"]
     
@@ -240,7 +261,7 @@ def update_customer_account(state: dict) -> str:
         try:
             logger.info(f"Attempting to update phone number for {username}.")
             # Corrected field name from "contact" to "phone_number" to match create_account
-            status = db.update_field(username, "phone_number", new_phone_number)
+            status = await get_async_db().update_field(username, "phone_number", new_phone_number)
             if status:
                 logger.info(f"Successfully updated phone number for {username}.")
 
@@ -266,7 +287,7 @@ def update_customer_account(state: dict) -> str:
         try:
             logger.info(f"Attempting to update password for {username}.")
             # Corrected field name from "contact" to "phone_number" to match create_account
-            status = db.update_field(username, "password", new_password)
+            status = await get_async_db().update_field(username, "password", new_password)
             if status:
                 logger.info(f"Successfully updated password for {username}.")
 
@@ -289,13 +310,13 @@ def update_customer_account(state: dict) -> str:
         try:
             logger.info(f"Attempting to update email for {username}.")
             # Corrected field name from "contact" to "phone_number" to match create_account
-            status = db.update_field(username, "email", new_email)
+            status = await get_async_db().update_field(username, "email", new_email)
             if status:
                 logger.info(f"Successfully updated email for {username}.")
 
                     # Update Customer
                 customer = state.get("customer")
-                customer.email = new_password
+                customer.email = new_email
                 state["customer"] = customer
                 return f"email updated successfully for {username}."
         
@@ -312,7 +333,7 @@ def update_customer_account(state: dict) -> str:
         try:
             logger.info(f"Attempting to update address for {username}.")
             # Corrected field name from "contact" to "phone_number" to match create_account
-            status = db.update_field(username, "address", new_address)
+            status = await get_async_db().update_field(username, "address", new_address)
             if status:
                 logger.info(f"Successfully updated address for {username}.")
 
@@ -353,8 +374,6 @@ def reset_state(state):
     state["pending_tool"] = None
     state["pending_args"] = None
     state["otp_status"] = None
-    state["generated_otp"] = None
-    state["otp_timestamp"] = None
     return state
 
 